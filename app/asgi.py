@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+O stream SSE da grade (/api/rifas/<slug>/grade/stream/) só funciona em ASGI:
+    gunicorn app.asgi:application -k uvicorn.workers.UvicornWorker
+Em WSGI ele responde 204 e o front fica no polling.
 """
 
 import os
@@ -94,6 +94,29 @@ DATABASES = {
     }
 }
 
+# ----------------------------------------
+# Cache (snapshot da grade e afins)
+# ----------------------------------------
+# com REDIS_URL o cache é compartilhado entre workers/máquinas;
+# sem ele cada processo tem o seu (LocMem)
+REDIS_URL = os.getenv("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "rifas",
+        }
+    }
+
+# sem REDIS_URL (LocMem) só dá para rodar um processo: ver rifas/checks.py
+
 # ----------------------------------------
 # Auth
 # ----------------------------------------
@@ -16,6 +16,7 @@ from .models import (
     WebhookEvent,
     Coupon,
     CouponRedemption,
+    CouponUsoCliente,
     DiscountRule,
     DiscountApplication,
     Affiliate,
@@ -28,7 +29,9 @@ from .models import (
     CotaPremiada,
     # 🆕 importa o financeiro da rifa
     RifaFinanceiro,
+    RifaContagem,
 )
+from .grade import registrar_transicoes, salvar_numero
 
 # -------------------------------------------------
 # Helpers
@@ -89,6 +92,17 @@ class DiscountApplicationInline(admin.TabularInline):
 
 
 # 🆕 inline pra editar o financeiro direto na rifa
+class RifaContagemInline(admin.TabularInline):
+    """Só leitura: quem mexe é grade.py (ou `manage.py recontar_grade`)."""
+    model = RifaContagem
+    extra = 0
+    can_delete = False
+    readonly_fields = ("reservados", "pagos", "atualizado_em")
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 class RifaFinanceiroInline(admin.StackedInline):
     model = RifaFinanceiro
     extra = 0
@@ -227,12 +241,13 @@ class RifaAdmin(admin.ModelAdmin):
         "inicio_vendas",
         "fim_vendas",
         "mostrar_top_compradores",
+        "grade_esparsa",
         "meio_pagamento",
         "empresa",
     )
     search_fields = ("titulo", "slug", "descricao")
     # 🆕 agora tem financeiro e cotas premiadas
-    inlines = [PremioInline, CotaPremiadaInline, RifaFinanceiroInline]
+    inlines = [PremioInline, CotaPremiadaInline, RifaFinanceiroInline, RifaContagemInline]
     readonly_fields = ("created_at",)
     autocomplete_fields = ("empresa", "efi_config")
 
@@ -255,6 +270,7 @@ class NumeroAdmin(admin.ModelAdmin):
         "status",
         "cliente",
         "reservado_em",
+        "expira_em",
         "pedido",
         "expirado_agora",
     )
@@ -274,6 +290,15 @@ class NumeroAdmin(admin.ModelAdmin):
             return format_html('<span style="color:#ef4444;font-weight:600">Sim</span>')
         return "Não"
 
+    def save_model(self, request, obj, form, change):
+        # status mudado à mão também sobe a versão da grade e mexe nos contadores
+        if change and "status" in form.changed_data:
+            salvar_numero(obj, form.changed_data)
+            return
+        super().save_model(request, obj, form, change)
+        if not change and obj.status != Numero.LIVRE:
+            registrar_transicoes(obj.rifa_id, [(Numero.LIVRE, obj.status, 1)])
+
     @admin.action(description="Liberar reservas expiradas selecionadas")
     def liberar_reservas_expiradas(self, request, queryset):
         count = 0
@@ -283,7 +308,7 @@ class NumeroAdmin(admin.ModelAdmin):
                 n.cliente = None
                 n.reservado_em = None
                 n.pedido = None
-                n.save(update_fields=["status", "cliente", "reservado_em", "pedido"])
+                salvar_numero(n, ["status", "cliente", "reservado_em", "pedido"])
                 count += 1
         self.message_user(request, f"{count} reservas liberadas.")
 
@@ -386,13 +411,31 @@ class CouponAdmin(admin.ModelAdmin):
     search_fields = ("codigo",)
     readonly_fields = ("uso_cache",)
 
+    def save_model(self, request, obj, form, change):
+        # uso_cache anda por UPDATE condicional (pricing.reservar_uso_cupom):
+        # salvar o cupom não pode gravar por cima o valor lido no form
+        if change:
+            obj.save(update_fields=[
+                f.name for f in obj._meta.concrete_fields if not f.primary_key and f.name != "uso_cache"
+            ])
+            return
+        super().save_model(request, obj, form, change)
+
 
 @admin.register(CouponRedemption)
 class CouponRedemptionAdmin(admin.ModelAdmin):
-    list_display = ("id", "coupon", "pedido", "cliente", "desconto_aplicado", "criado_em")
+    list_display = ("id", "coupon", "pedido", "cliente", "desconto_aplicado", "status", "criado_em")
+    list_filter = ("status",)
     search_fields = ("coupon__codigo", "pedido__protocolo", "cliente__cpf")
 
 
+@admin.register(CouponUsoCliente)
+class CouponUsoClienteAdmin(admin.ModelAdmin):
+    list_display = ("id", "coupon", "cliente", "usos")
+    search_fields = ("coupon__codigo", "cliente__cpf_digitos")
+    readonly_fields = ("usos",)
+
+
 @admin.register(DiscountRule)
 class DiscountRuleAdmin(admin.ModelAdmin):
     list_display = (
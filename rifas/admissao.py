@@ -0,0 +1,108 @@
+# rifas/admissao.py
+"""
+Sala de espera na abertura das vendas: controle de admissão por rifa.
+
+Quando uma rifa concorrida abre, milhares de compradores criam pedido no
+mesmo segundo e todos disputam as linhas de Numero e as conexões do banco.
+Aqui cada rifa admite no máximo N pedidos por segundo (janela fixa de um
+segundo, contador no cache com cache.incr, atômico). Quem passa do limite
+não chega no banco: recebe 429 com um Retry-After e o front tenta de novo
+sozinho.
+
+Não é uma fila: não há posição nem ordem de chegada. Quem volta disputa a
+janela daquele segundo junto com quem chegou agora; o Retry-After só
+espalha as novas tentativas (quanto mais gente passou do limite, mais
+longe manda).
+
+N vem de Rifa.pedidos_por_segundo; 0 usa RIFAS_ADMISSAO_POR_SEGUNDO, cujo
+padrão também é 0 (desligado): a sala de espera só vale nas rifas que
+pedem. O limite de cada rifa fica em cache por LIMITE_TTL (o request
+barrado não consulta o banco) e é apagado quando a rifa é salva.
+
+Métricas: contadores de admitidos e adiados por rifa
+(estatisticas_admissao), mostrados no stats.json do painel.
+
+O contador mora no cache: com LocMem cada worker teria o seu e o limite
+real seria N vezes o número de workers. Com vários workers, ligar a sala de
+espera pede cache compartilhado (ver rifas/checks.py).
+"""
+from __future__ import annotations
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Rifa
+
+ADMISSAO_POR_SEGUNDO = getattr(settings, "RIFAS_ADMISSAO_POR_SEGUNDO", 0)
+LIMITE_TTL = 30
+
+MSG_ESPERA = "Muita gente comprando agora. Já vamos tentar de novo."
+
+
+def _chave_limite(slug: str) -> str:
+    return f"rifas:admissao:limite:{slug}"
+
+
+def _chave_janela(slug: str, segundo: int) -> str:
+    return f"rifas:admissao:janela:{slug}:{segundo}"
+
+
+def _chave_stat(slug: str, nome: str) -> str:
+    return f"rifas:admissao:stats:{slug}:{nome}"
+
+
+def limite_da_rifa(slug: str) -> int:
+    """Pedidos por segundo admitidos na rifa (0 = sem limite)."""
+    limite = cache.get(_chave_limite(slug))
+    if limite is None:
+        proprio = Rifa.objects.filter(slug=slug).values_list("pedidos_por_segundo", flat=True).first()
+        limite = proprio or ADMISSAO_POR_SEGUNDO
+        cache.set(_chave_limite(slug), limite, LIMITE_TTL)
+    return int(limite)
+
+
+def esquecer_limite(slug: str) -> None:
+    cache.delete(_chave_limite(slug))
+
+
+def _incr(chave: str, timeout) -> int:
+    try:
+        return cache.incr(chave)
+    except ValueError:
+        # primeira da janela (ou o cache despejou a chave)
+        if cache.add(chave, 1, timeout):
+            return 1
+        return cache.incr(chave)
+
+
+def admitir(slug: str) -> tuple[bool, int]:
+    """
+    (admitido, retry_after_segundos) para um pedido novo na rifa `slug`.
+    Admitido -> (True, 0).
+    """
+    limite = limite_da_rifa(slug)
+    if limite <= 0:
+        return True, 0
+
+    n = _incr(_chave_janela(slug, int(time.time())), 5)
+    if n <= limite:
+        _incr(_chave_stat(slug, "admitidos"), None)
+        return True, 0
+
+    _incr(_chave_stat(slug, "adiados"), None)
+    # estimativa para espalhar as novas tentativas, não posição: cada
+    # segundo seguinte comporta mais `limite`
+    excedente = n - limite
+    return False, 1 + (excedente - 1) // limite
+
+
+def estatisticas_admissao(slug: str) -> dict:
+    """{"limite", "admitidos", "adiados"} da rifa desde que o cache subiu."""
+    nomes = ("admitidos", "adiados")
+    valores = cache.get_many([_chave_stat(slug, n) for n in nomes])
+    return {
+        "limite": limite_da_rifa(slug),
+        **{n: int(valores.get(_chave_stat(slug, n)) or 0) for n in nomes},
+    }
@@ -8,12 +8,14 @@ import logging
 import requests
 import os
 import tempfile
+import time
 
 from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
 from cryptography.hazmat.primitives.serialization.pkcs12 import load_key_and_certificates
 
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Count, Q
+from django.db.models import Count, Max, Q
 from django.http import JsonResponse, HttpRequest
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
@@ -31,6 +33,26 @@ from .models import (
     Pedido,
     EfiConfig,
 )
+from .grade import (
+    MSG_GRADE_GERANDO,
+    NumerosIndisponiveis,
+    PedidoForaDasRegras,
+    atualizar_numeros,
+    formato_pedido,
+    janela_pedida,
+    proxima_versao,
+    registrar_transicoes,
+    resposta_delta,
+    resposta_grade,
+    reservar_numeros,
+    resposta_janela,
+    sortear_livres,
+    since_pedido,
+    validar_pedido,
+)
+from . import admissao, holds, idempotencia
+from .tasks import enfileirar_cobranca, expirar_pedidos_vazios, varrer_rifa
+from .utils import com_etag, etag_forte, nao_modificado
 
 logger = logging.getLogger(__name__)
 
@@ -58,8 +80,7 @@ except Exception:
 try:
     from .utils import gera_protocolo, abreviar_nome, cpf_normalize
 except Exception:
-    def gera_protocolo() -> str:
-        return timezone.now().strftime("R%Y%m%d%H%M%S%f")[:20]
+    from .protocolo import novo_protocolo as gera_protocolo
 
     def abreviar_nome(nome: str) -> str:
         if not nome:
@@ -74,8 +95,24 @@ except Exception:
 
 # pricing
 try:
-    from .pricing import precificar
+    from .pricing import CupomEsgotado, cotar, precificar, reservar_uso_cupom, versao_precos
 except Exception:
+    class CupomEsgotado(Exception):
+        pass
+
+    def versao_precos():
+        return 0
+
+    def cotar(rifa, qtds, cupom=None):
+        return [
+            {"qtd": q, "subtotal": str(rifa.preco_numero * q), "desc_regras": "0.00",
+             "desc_cupom": "0.00", "total": str(rifa.preco_numero * q), "regras": [], "cupom": None}
+            for q in qtds
+        ]
+
+    def reservar_uso_cupom(c, pedido, cliente, desconto):
+        return None
+
     def precificar(rifa, qtd, cliente, cupom):
         total = (rifa.preco_numero or Decimal("0")) * Decimal(qtd)
         return (
@@ -114,7 +151,7 @@ def get_or_create_cliente(cdata: dict) -> Cliente:
         "telefone": cdata.get("telefone", "-"),
         "cpf": cpf,
     }
-    obj, created = Cliente.objects.get_or_create(cpf=cpf, defaults=defaults)
+    obj, created = Cliente.objects.get_or_create(cpf_digitos=cpf, defaults=defaults)
     if not created:
         changed = False
         for k in ("nome", "email", "telefone"):
@@ -164,20 +201,8 @@ def _atribuir_afiliado(request: HttpRequest, cliente: Cliente, rifa: Rifa):
 
 
 def _liberar_expirados(rifa: Rifa):
-    mins = rifa.minutos_expiracao_reserva or 15
-    limite = timezone.now() - timedelta(minutes=mins)
-    expirados = Numero.objects.filter(
-        rifa=rifa,
-        status=Numero.RESERVADO,
-        reservado_em__lt=limite,
-    )
-    if expirados.exists():
-        expirados.update(
-            status=Numero.LIVRE,
-            cliente=None,
-            pedido=None,
-            reservado_em=None,
-        )
+    # no máximo uma varredura por rifa por intervalo (ver tasks.varrer_rifa)
+    varrer_rifa(rifa.id)
 
 
 def _efi_disponivel(rifa: Rifa | None = None) -> bool:
@@ -353,12 +378,59 @@ def _efi_base_url(cred: EfiConfig) -> str:
     return "https://pix.api.efipay.com.br"
 
 
+def _txid_da_cobranca(pagamento: Pagamento) -> str:
+    """
+    txid fixo do pagamento (a Efí aceita [a-zA-Z0-9]{26,35}): toda tentativa
+    de emitir o mesmo pagamento cai na mesma cob, nunca numa segunda.
+    """
+    return f"rifas{pagamento.pk:030d}"
+
+
+def _efi_chamar(metodo: str, url: str, cred: EfiConfig, headers: dict, body: dict | None = None,
+                rotulo: str = "") -> requests.Response | None:
+    """Chama a Efí sem certificado e, se falhar, com ele. None se nenhuma deu 200/201."""
+    try:
+        r = requests.request(metodo, url, headers=headers, json=body, timeout=20)
+        if r.status_code in (200, 201):
+            return r
+        logger.warning("EFI %s (sem cert): %s %s", rotulo, r.status_code, r.text[:200])
+    except Exception as e:
+        logger.warning("EFI %s (sem cert) error: %s", rotulo, e)
+
+    cert_arg, tmp_files = _build_cert_arg_from_cred(cred)
+    if not cert_arg:
+        return None
+    try:
+        r = requests.request(metodo, url, headers=headers, json=body, timeout=20, cert=cert_arg)
+        if r.status_code in (200, 201):
+            return r
+        logger.warning("EFI %s (com cert): %s %s", rotulo, r.status_code, r.text[:200])
+    except Exception as e:
+        logger.warning("EFI %s (com cert) error: %s", rotulo, e)
+    finally:
+        for f in tmp_files:
+            try:
+                os.unlink(f)
+            except Exception:
+                pass
+    return None
+
+
 def _criar_cobranca_efi_e_salvar(
     pedido: Pedido,
-    pagamento: Pagamento | None,
+    pagamento: Pagamento,
     rifa: Rifa,
     total: Decimal,
 ) -> dict | None:
+    """
+    Emite (ou reaproveita) a cob da Efí do pagamento.
+
+    None = nada foi pedido à Efí (sem credencial ou sem token). Depois que
+    a cob é pedida o pagamento fica marcado como provider="efi" com o txid
+    fixo, e aí a resposta é sempre um dict: {"ok": False} quer dizer que a
+    cob pode existir e a próxima tentativa tem que ser na Efí, com o mesmo
+    txid (PUT /v2/cob/{txid} e, se ela já existe, GET).
+    """
     cred = _get_efi_cred(rifa)
     if not cred:
         logger.warning("EFI: nenhuma credencial ativa encontrada")
@@ -366,13 +438,13 @@ def _criar_cobranca_efi_e_salvar(
 
     token_data = _get_efi_token(cred)
     if not token_data or "access_token" not in token_data:
-        # É exatamente o que está acontecendo com você
-        logger.warning("EFI: não pegou token, indo pro registry")
+        logger.warning("EFI: não pegou token")
         return None
 
     access_token = token_data["access_token"]
     base = _efi_base_url(cred)
-    cob_url = f"{base}/v2/cob"
+    txid = _txid_da_cobranca(pagamento)
+    cob_url = f"{base}/v2/cob/{txid}"
     qrcode_base = f"{base}/v2/loc/{{id}}/qrcode"
 
     valor_str = f"{Decimal(total):.2f}".replace(",", ".")
@@ -391,96 +463,40 @@ def _criar_cobranca_efi_e_salvar(
         "Content-Type": "application/json",
     }
 
-    # 1) tenta criar cobrança SEM cert
-    try:
-        r = requests.post(cob_url, headers=headers, json=body, timeout=20)
-        if r.status_code not in (200, 201):
-            logger.warning("EFI create cob (sem cert): %s %s", r.status_code, r.text[:200])
-            r = None
-    except requests.exceptions.SSLError as e:
-        logger.warning("EFI create cob (sem cert) SSL: %s", e)
-        r = None
-    except Exception as e:
-        logger.warning("EFI create cob (sem cert) error: %s", e)
-        r = None
+    # daqui em diante a cob pode existir: marca antes de pedir, para nenhuma
+    # tentativa seguinte (nem o webhook) perder o txid
+    pagamento.provider = "efi"
+    pagamento.provider_preference_id = txid
+    Pagamento.objects.filter(pk=pagamento.pk).update(provider="efi", provider_preference_id=txid)
 
-    # 2) se falhou e tem cert, tenta COM (aceitando .p12)
+    # 1) cria a cob com o txid do pagamento; se já existe (tentativa
+    # anterior), busca a mesma
+    r = _efi_chamar("PUT", cob_url, cred, headers, body, rotulo="create cob")
     if r is None:
-        cert_arg, tmp_files = _build_cert_arg_from_cred(cred)
-        if cert_arg:
-            try:
-                r = requests.post(cob_url, headers=headers, json=body, timeout=20, cert=cert_arg)
-                if r.status_code not in (200, 201):
-                    logger.warning("EFI create cob (com cert): %s %s", r.status_code, r.text[:200])
-                    r = None
-            except Exception as e:
-                logger.warning("EFI create cob (com cert) error: %s", e)
-                r = None
-            finally:
-                for f in tmp_files:
-                    try:
-                        os.unlink(f)
-                    except Exception:
-                        pass
-        else:
-            return None
-
+        r = _efi_chamar("GET", cob_url, cred, headers, rotulo="get cob")
     if r is None:
-        return None
+        return {"ok": False, "copia_cola": None, "qr_code_base64": None, "txid": txid}
 
     data = _parse_json_safely(r) or {}
     loc_id = data.get("loc", {}).get("id")
-    txid = data.get("txid")
     copia_cola = None
     qr_code_base64 = None
 
-    # 3) pegar o QR
+    # 2) pegar o QR
     if loc_id:
-        qrcode_url = qrcode_base.format(id=loc_id)
-        # tenta sem cert
-        try:
-            rqr = requests.get(qrcode_url, headers=headers, timeout=20)
-            if rqr.status_code in (200, 201):
-                qrd = _parse_json_safely(rqr) or {}
-                copia_cola = qrd.get("qrcode") or qrd.get("pixCopiaECola")
-                qr_code_base64 = qrd.get("imagemQrcode") or qrd.get("qr_code_base64")
-            else:
-                logger.warning("EFI get qrcode (sem cert): %s %s", rqr.status_code, rqr.text[:200])
-                rqr = None
-        except Exception as e:
-            logger.warning("EFI get qrcode (sem cert) error: %s", e)
-            rqr = None
-
-        # se falhou → tenta com cert
-        if rqr is None:
-            cert_arg, tmp_files = _build_cert_arg_from_cred(cred)
-            if cert_arg:
-                try:
-                    rqr = requests.get(qrcode_url, headers=headers, timeout=20, cert=cert_arg)
-                    if rqr.status_code in (200, 201):
-                        qrd = _parse_json_safely(rqr) or {}
-                        copia_cola = qrd.get("qrcode") or qrd.get("pixCopiaECola")
-                        qr_code_base64 = qrd.get("imagemQrcode") or qrd.get("qr_code_base64")
-                    else:
-                        logger.warning("EFI get qrcode (com cert): %s %s", rqr.status_code, rqr.text[:200])
-                except Exception as e:
-                    logger.warning("EFI get qrcode (com cert) error: %s", e)
-                finally:
-                    for f in tmp_files:
-                        try:
-                            os.unlink(f)
-                        except Exception:
-                            pass
+        rqr = _efi_chamar("GET", qrcode_base.format(id=loc_id), cred, headers, rotulo="get qrcode")
+        if rqr is not None:
+            qrd = _parse_json_safely(rqr) or {}
+            copia_cola = qrd.get("qrcode") or qrd.get("pixCopiaECola")
+            qr_code_base64 = qrd.get("imagemQrcode") or qrd.get("qr_code_base64")
 
     # fallback
     if not copia_cola:
         copia_cola = data.get("pixCopiaECola") or data.get("qrcode") or data.get("location") or None
 
-    if pagamento is not None:
-        pagamento.provider = "efi"
+    if copia_cola:
         pagamento.copia_cola = copia_cola
         pagamento.qr_code_base64 = qr_code_base64
-        pagamento.provider_preference_id = txid or (str(loc_id) if loc_id else "")
         pagamento.status_provider = "pending"
         pagamento.save()
 
@@ -566,6 +582,7 @@ class RifaDetailView(PublicAPIView):
             "inicio": r.inicio_vendas,
             "fim": r.fim_vendas,
             "em_vendas": getattr(r, "em_vendas", True),
+            "grade_pronta": r.grade_pronta,
             "premios": premios,
         })
 
@@ -573,68 +590,244 @@ class RifaDetailView(PublicAPIView):
 class GradeView(PublicAPIView):
     def get(self, request, slug):
         r = get_object_or_404(Rifa, slug=slug, ativo=True)
-        _liberar_expirados(r)
-        nums_qs = Numero.objects.filter(rifa=r).order_by("numero")
 
-        if not nums_qs.exists() and r.quantidade_numeros:
-            total = int(r.quantidade_numeros)
-            return Response({
-                "numeros": [{"numero": i, "status": "livre"} for i in range(1, total + 1)]
-            })
+        since = since_pedido(request)
+        if since is not None:
+            return resposta_delta(request, r, since)
 
-        return Response({
-            "numeros": [
-                {"numero": n.numero, "status": n.status}
-                for n in nums_qs
-            ]
-        })
+        # só um pedaço da grade (?from=&to=&status=), para o virtual scroll
+        try:
+            janela = janela_pedida(request)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if janela is not None:
+            return resposta_janela(request, r, janela)
 
+        return resposta_grade(request, r, formato_pedido(request, r))
 
-class TopCompradoresView(PublicAPIView):
-    def get(self, request, slug):
-        r = get_object_or_404(Rifa, slug=slug, ativo=True)
+
+# Top compradores: a contagem (agregação sobre os pagos da rifa) é feita uma
+# vez por versão da grade e fica TOP_TTL segundos no cache; o ETag é o hash
+# desse corpo, então 304 só sai quando o corpo seria o mesmo. Nome de
+# cliente editado sem número mudar entra no máximo TOP_TTL depois.
+TOP_TTL = 30
+
+
+def _top_compradores(r: Rifa) -> list[dict]:
+    chave = f"rifas:top:{r.id}:{r.grade_versao}"
+    corpo = cache.get(chave)
+    if corpo is None:
         top = (
             Numero.objects
             .filter(rifa=r, status=Numero.PAGO, cliente__isnull=False)
             .values("cliente__nome")
             .annotate(qtd=Count("id"))
-            .order_by("-qtd")[:5]
+            .order_by("-qtd", "cliente__nome")[:5]
         )
-        return Response([
-            {
-                "nome": abreviar_nome(t["cliente__nome"]),
-                "qtd": t["qtd"],
+        corpo = [{"nome": abreviar_nome(t["cliente__nome"]), "qtd": t["qtd"]} for t in top]
+        cache.set(chave, corpo, TOP_TTL)
+    return corpo
+
+
+class TopCompradoresView(PublicAPIView):
+    def get(self, request, slug):
+        r = get_object_or_404(Rifa, slug=slug, ativo=True)
+        corpo = _top_compradores(r)
+        etag = etag_forte("top", json.dumps(corpo, sort_keys=True))
+        nao_mod = nao_modificado(request, etag)
+        if nao_mod is not None:
+            return nao_mod
+        return com_etag(Response(corpo), etag)
+
+
+# ======================================================================
+# COTAÇÃO (botões de pacote)
+# ======================================================================
+# Preço com regras e cupom para várias quantidades sem criar Pedido. A
+# resposta vale por (rifa, preço, cupom, versão das regras, quantidades) e
+# fica COTACAO_TTL segundos no cache: o limite global do cupom e as bordas
+# de janela das regras entram no máximo esse tempo depois.
+COTACAO_TTL = 30
+COTACAO_MAX_QTDS = 20
+
+
+class CotacaoView(PublicAPIView):
+    def get(self, request, slug):
+        r = get_object_or_404(Rifa, slug=slug, ativo=True)
+        try:
+            qtds = sorted({int(q) for q in (request.GET.get("qtds") or "1").split(",") if q.strip()})
+        except ValueError:
+            return Response({"detail": "qtds inválido."}, status=status.HTTP_400_BAD_REQUEST)
+        if not qtds or len(qtds) > COTACAO_MAX_QTDS or qtds[0] < 1 or qtds[-1] > r.quantidade_numeros:
+            return Response(
+                {"detail": f"Informe até {COTACAO_MAX_QTDS} quantidades entre 1 e {r.quantidade_numeros}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        cupom = (request.GET.get("cupom") or "").strip().upper()[:32]
+
+        etag = etag_forte(
+            "cot", r.id, r.preco_numero, versao_precos(), int(time.time() // COTACAO_TTL), cupom, *qtds
+        )
+        nao_mod = nao_modificado(request, etag)
+        if nao_mod is not None:
+            return nao_mod
+
+        chave = "rifas:cotacao:" + etag.strip('"')
+        corpo = cache.get(chave)
+        if corpo is None:
+            corpo = {
+                "rifa": r.slug,
+                "preco_numero": str(r.preco_numero),
+                "limite_por_pedido": r.limite_por_pedido,
+                "cupom": cupom or None,
+                "cotacoes": cotar(r, qtds, cupom),
             }
-            for t in top
-        ])
+            cache.set(chave, corpo, COTACAO_TTL)
+        return com_etag(Response(corpo), etag)
 
 
 # ======================================================================
 # CRIAR PEDIDO
 # ======================================================================
+SORTEIO_TENTATIVAS = 3
+
+
+def _reservar_sorteados(rifa: Rifa, quantidade: int, pedido, cliente):
+    """
+    Sorteia `quantidade` números livres (grade.sortear_livres) e reserva.
+    Se o snapshot estava atrás do banco, ou algum sorteado está num hold,
+    sorteia de novo sem esses. Devolve (numeros, pedidos_retomados).
+    """
+    excluir: set[int] = set()
+    for _ in range(SORTEIO_TENTATIVAS):
+        numeros = sortear_livres(rifa, quantidade, excluir)
+        if len(numeros) < quantidade:
+            raise NumerosIndisponiveis(
+                0, [], f"Restam só {len(numeros)} números disponíveis nesta rifa."
+            )
+        segurados = holds.segurados_por_outros(rifa.id, numeros)
+        if segurados:
+            excluir.update(segurados)
+            continue
+        try:
+            return sorted(numeros), reservar_numeros(rifa, numeros, pedido, cliente)
+        except NumerosIndisponiveis as exc:
+            excluir.update(exc.todos)
+            rifa.refresh_from_db(fields=["grade_versao"])
+    raise NumerosIndisponiveis(
+        0, sorted(excluir), "Muitos pedidos ao mesmo tempo. Tente novamente."
+    )
+
+
 @method_decorator(csrf_exempt, name="dispatch")
 class CriarPedidoView(PublicAPIView):
     def post(self, request, *args, **kwargs):
+        # Idempotency-Key: repetição do mesmo POST devolve a 1ª resposta
+        cli_block = request.data.get("cliente") or {}
+        slug = request.data.get("slug") or request.data.get("rifa_slug") or request.data.get("rifa") or ""
+        chave = idempotencia.chave_da_requisicao(
+            request, slug, request.data.get("cpf") or cli_block.get("cpf") or "",
+        )
+        digital = idempotencia.impressao_do_pedido(request.data)
+        try:
+            guardada = idempotencia.comecar(chave, digital)
+        except idempotencia.ChaveEmUso as exc:
+            return Response({"detail": str(exc)}, status=exc.status)
+        if guardada is not None:
+            resp = Response(guardada[1], status=guardada[0])
+            resp[idempotencia.HEADER_REPLAY] = "true"
+            return resp
+
+        # sala de espera: acima do limite por segundo nem chega no banco
+        admitido, espera = admissao.admitir(slug)
+        if not admitido:
+            idempotencia.largar(chave)
+            resp = Response(
+                {"detail": admissao.MSG_ESPERA, "retry_after": espera},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+            resp["Retry-After"] = str(espera)
+            return resp
+
+        try:
+            resp = self._criar(request)
+        except Exception:
+            idempotencia.largar(chave)
+            raise
+        idempotencia.guardar(chave, digital, resp.status_code, resp.data)
+        return resp
+
+    def _criar(self, request):
         slug = (
             request.data.get("slug")
             or request.data.get("rifa_slug")
             or request.data.get("rifa")
         )
         numeros = request.data.get("numeros") or []
+        quantidade = request.data.get("quantidade")
         cupom = request.data.get("cupom")
+        hold_id = request.data.get("hold_id") or None
 
         cli_block = request.data.get("cliente") or {}
         cpf = (request.data.get("cpf") or cli_block.get("cpf") or "").strip()
         nome = (request.data.get("nome") or cli_block.get("nome") or "").strip()
         telefone = (request.data.get("telefone") or cli_block.get("telefone") or "").strip()
 
-        if not slug or not cpf or not numeros:
+        # hold do seletor: sem "numeros", o pedido leva os números do hold
+        hold = None
+        if hold_id and not numeros:
+            hold = holds.ler_hold(hold_id)
+            if hold is None:
+                return Response(
+                    {"detail": "Sua seleção expirou. Escolha os números novamente."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            numeros = hold["numeros"]
+
+        # compra por quantidade: sem "numeros", o servidor sorteia "quantidade"
+        por_quantidade = not numeros and quantidade not in (None, "")
+        if not slug or not cpf or not (numeros or por_quantidade):
             return Response(
-                {"detail": "slug/rifa_slug, cpf e numeros são obrigatórios."},
+                {"detail": "slug/rifa_slug, cpf e numeros (ou quantidade) são obrigatórios."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
         rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
+        if not rifa.grade_pronta:
+            return Response({"detail": MSG_GRADE_GERANDO}, status=status.HTTP_409_CONFLICT)
+        if hold is not None and hold["rifa"] != rifa.id:
+            return Response(
+                {"detail": "Essa seleção é de outra rifa. Escolha os números novamente."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        if por_quantidade:
+            try:
+                quantidade = int(quantidade)
+            except (TypeError, ValueError):
+                quantidade = 0
+
+        try:
+            numeros = sorted({int(n) for n in numeros})
+        except (TypeError, ValueError):
+            return Response({"detail": "Número inválido."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            validar_pedido(rifa, quantidade if por_quantidade else len(numeros), escolhidos=not por_quantidade)
+        except PedidoForaDasRegras as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        for n in numeros:
+            if n < 1 or n > int(rifa.quantidade_numeros):
+                return Response(
+                    {"detail": f"Número {n} fora do intervalo."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        ocupados = holds.segurados_por_outros(rifa.id, numeros, hold_id)
+        if ocupados:
+            return Response(
+                {"detail": f"Número {ocupados[0]} não está disponível."},
+                status=status.HTTP_409_CONFLICT,
+            )
 
         _liberar_expirados(rifa)
 
@@ -644,9 +837,6 @@ class CriarPedidoView(PublicAPIView):
 
         _atribuir_afiliado(request, cliente, rifa)
 
-        registry_error = None
-        efi_error = None
-
         with transaction.atomic():
             pedido = Pedido.objects.create(
                 rifa=rifa,
@@ -654,42 +844,14 @@ class CriarPedidoView(PublicAPIView):
                 protocolo=gera_protocolo(),
                 status=Pedido.PENDENTE,
             )
-
-            qtd = 0
-            now = timezone.now()
-            for n in numeros:
-                n = int(n)
-                if n < 1 or n > int(rifa.quantidade_numeros):
-                    return Response(
-                        {"detail": f"Número {n} fora do intervalo."},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-
-                num_obj, _ = Numero.objects.select_for_update().get_or_create(
-                    rifa=rifa,
-                    numero=n,
-                    defaults={
-                        "status": Numero.RESERVADO,
-                        "pedido": pedido,
-                        "cliente": cliente,
-                        "reservado_em": now,
-                    },
-                )
-
-                if num_obj.status in (Numero.PAGO, Numero.RESERVADO) and num_obj.pedido_id != pedido.id:
-                    return Response(
-                        {"detail": f"Número {n} não está disponível."},
-                        status=status.HTTP_409_CONFLICT,
-                    )
-
-                num_obj.status = Numero.RESERVADO
-                num_obj.pedido = pedido
-                num_obj.cliente = cliente
-                num_obj.reservado_em = now
-                num_obj.save()
-                qtd += 1
-
-            # pricing
+            if hold_id:
+                # gravou o pedido: os números passam a valer pelo banco
+                transaction.on_commit(lambda: holds.encerrar(hold_id))
+
+            # preço e fila de cobrança vêm antes dos números: os locks dos
+            # números e da contagem (grade.reservar_numeros) ficam presos
+            # até o commit; depois dela só o UPDATE do cupom
+            qtd = quantidade if por_quantidade else len(numeros)
             subtotal, dr, dc, total, breakdown, disc_app, cup_red = precificar(
                 rifa, qtd, cliente, cupom
             )
@@ -708,59 +870,46 @@ class CriarPedidoView(PublicAPIView):
             if DiscountApplication is not None and isinstance(disc_app, DiscountApplication):
                 disc_app.pedido = pedido
                 disc_app.save(update_fields=["pedido"])
-            if CouponRedemption is not None and isinstance(cup_red, CouponRedemption):
-                cup_red.pedido = pedido
-                cup_red.save(update_fields=["pedido"])
 
-            pagamento_obj = None
+            # a cobrança (Efí / registry) sai depois do commit, fora dos
+            # locks dos números; o PIX chega pelo status do pedido
             if Pagamento is not None:
-                pagamento_obj = Pagamento.objects.create(
-                    pedido=pedido,
-                    provider="pending",
-                    status_provider="pending",
-                )
+                enfileirar_cobranca(pedido)
 
-            # 1) tenta EFI
-            if _efi_disponivel(rifa):
-                efi_data = _criar_cobranca_efi_e_salvar(pedido, pagamento_obj, rifa, total)
-                if efi_data and efi_data.get("ok") and efi_data.get("copia_cola"):
-                    return Response(
-                        {
-                            "ok": True,
-                            "protocolo": pedido.protocolo,
-                            "total": f"{pedido.total:.2f}",
-                            "provider": "efi",
-                            "copia_cola": efi_data.get("copia_cola"),
-                            "qr_code_base64": efi_data.get("qr_code_base64"),
-                        },
-                        status=status.HTTP_201_CREATED,
-                    )
+            # tudo ou nada, num UPDATE só (ver grade.reservar_numeros)
+            try:
+                if por_quantidade:
+                    numeros, retomados = _reservar_sorteados(rifa, quantidade, pedido, cliente)
                 else:
-                    efi_error = "erro ao criar cobrança EFI"
+                    retomados = reservar_numeros(rifa, numeros, pedido, cliente)
+            except NumerosIndisponiveis as exc:
+                transaction.set_rollback(True)
+                return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+
+            if cup_red is not None and dc > 0:
+                # o uso do cupom conta já (UPDATE condicional no limite);
+                # volta se o pedido expirar ou for cancelado. Fica depois da
+                # rifa para todo mundo travar na mesma ordem (rifa, cupom),
+                # como o pagamento que confirma o uso
+                try:
+                    reservar_uso_cupom(cup_red, pedido, cliente, dc)
+                except CupomEsgotado as exc:
+                    transaction.set_rollback(True)
+                    return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
 
-            # 2) fallback → registry local
-            registry_data, registry_error = _criar_pagamento_registry(pedido, pagamento_obj)
-            if registry_data and registry_data.get("ok"):
-                return Response(
-                    {
-                        "ok": True,
-                        "protocolo": pedido.protocolo,
-                        "total": f"{pedido.total:.2f}",
-                        "provider": "registry",
-                        "copia_cola": registry_data.get("copia_cola"),
-                        "qr_code_base64": registry_data.get("qr_code_base64"),
-                    },
-                    status=status.HTTP_201_CREATED,
-                )
+            # quem perdeu a reserva vencida expira depois do commit, sem a rifa travada
+            transaction.on_commit(lambda: expirar_pedidos_vazios(retomados))
 
         return Response(
             {
                 "ok": True,
                 "protocolo": pedido.protocolo,
+                "numeros": numeros,
                 "total": f"{pedido.total:.2f}",
                 "provider": None,
-                "efi_error": efi_error,
-                "registry_error": registry_error,
+                "pagamento": Pagamento.NA_FILA if Pagamento is not None else None,
+                "copia_cola": None,
+                "qr_code_base64": None,
             },
             status=status.HTTP_201_CREATED,
         )
@@ -769,37 +918,96 @@ class CriarPedidoView(PublicAPIView):
 # ======================================================================
 # STATUS DO PEDIDO
 # ======================================================================
+def _pedidos_com_versao(*related):
+    """
+    Pedido + rifa + cliente + pagamento numa consulta só, já com a "versão"
+    dos números (maior Numero.versao e quantidade), que é o que o ETag precisa.
+    """
+    related = ("rifa", "cliente") + related + (("pagamento",) if Pagamento is not None else ())
+    return Pedido.objects.select_related(*related).annotate(
+        _numeros_versao=Max("numeros__versao"),
+        _numeros_qtd=Count("numeros"),
+    )
+
+
+def _pagamento_ou_none(pedido: Pedido):
+    if Pagamento is None:
+        return None
+    try:
+        return pedido.pagamento
+    except Pagamento.DoesNotExist:
+        return None
+
+
+def _cotas_ativas(rifa: Rifa) -> list[tuple]:
+    """(numero, descricao, valor_premio) das cotas premiadas ativas, por número."""
+    return list(
+        rifa.cotas_premiadas.filter(ativo=True)
+        .order_by("numero")
+        .values_list("numero", "descricao", "valor_premio")
+    )
+
+
+def _etag_pedido(pedido: Pedido, cotas, *extra) -> str:
+    """
+    ETag com tudo o que entra no corpo das views de pedido: os campos do
+    pedido, os números (versão + quantidade), cliente, rifa, o pagamento
+    inteiro e as cotas premiadas. Tudo já veio na consulta do pedido, menos
+    as cotas (uma consulta pequena, reaproveitada no corpo).
+    """
+    pg = _pagamento_ou_none(pedido)
+    cli = pedido.cliente
+    return etag_forte(
+        "p", pedido.id, pedido.status, pedido.total, pedido.pago_em,
+        pedido._numeros_versao, pedido._numeros_qtd,
+        pedido.rifa.slug, pedido.rifa.titulo,
+        pedido.cliente_id, cli.nome, cli.email, cli.telefone, cli.cpf,
+        *(
+            (
+                pg.id, pg.atualizado_em, pg.provider, pg.status_provider,
+                pg.copia_cola, pg.qr_code_base64,
+                pg.provider_payment_id, pg.provider_preference_id,
+            )
+            if pg else (None,)
+        ),
+        *(parte for cota in cotas for parte in cota),
+        *extra,
+    )
+
+
 class PedidoStatusView(PublicAPIView):
     def get(self, request, protocolo):
-        p = get_object_or_404(Pedido.objects.select_related("rifa"), protocolo=protocolo)
+        p = get_object_or_404(_pedidos_com_versao(), protocolo=protocolo)
+        cotas = _cotas_ativas(p.rifa)
+        etag = _etag_pedido(p, cotas)
+        nao_mod = nao_modificado(request, etag)
+        if nao_mod is not None:
+            return nao_mod
+
         nums = list(p.numeros.values_list("numero", flat=True))
 
+        premiadas_map = {numero: (descricao, valor) for numero, descricao, valor in cotas}
         cotas_premiadas = []
-        try:
-            from .models import CotaPremiada
-            cp_qs = CotaPremiada.objects.filter(rifa=p.rifa, ativo=True)
-            premiadas_map = {c.numero: c for c in cp_qs}
-            for n in nums:
-                if n in premiadas_map:
-                    c = premiadas_map[n]
-                    cotas_premiadas.append({
-                        "numero": n,
-                        "descricao": c.descricao,
-                        "valor_premio": str(c.valor_premio) if c.valor_premio is not None else "",
-                    })
-        except Exception:
-            cotas_premiadas = []
+        for n in nums:
+            if n in premiadas_map:
+                descricao, valor = premiadas_map[n]
+                cotas_premiadas.append({
+                    "numero": n,
+                    "descricao": descricao,
+                    "valor_premio": str(valor) if valor is not None else "",
+                })
 
         pagamento_info = {}
-        if Pagamento is not None and hasattr(p, "pagamento"):
+        pg = _pagamento_ou_none(p)
+        if pg is not None:
             pagamento_info = {
-                "provider": p.pagamento.provider,
-                "status_provider": p.pagamento.status_provider,
-                "copia_cola": p.pagamento.copia_cola,
-                "qr_code_base64": p.pagamento.qr_code_base64,
+                "provider": pg.provider,
+                "status_provider": pg.status_provider,
+                "copia_cola": pg.copia_cola,
+                "qr_code_base64": pg.qr_code_base64,
             }
 
-        return Response(
+        return com_etag(Response(
             {
                 "protocolo": p.protocolo,
                 "status": p.status,
@@ -809,7 +1017,7 @@ class PedidoStatusView(PublicAPIView):
                 "cotas_premiadas": cotas_premiadas,
                 "pagamento": pagamento_info,
             }
-        )
+        ), etag)
 
 
 # ======================================================================
@@ -978,7 +1186,7 @@ def webhook_provider(request: HttpRequest, provider_key: str, *args, **kwargs):
                 pedido.pago_em = timezone.now()
                 pedido.save(update_fields=["status", "pago_em"])
                 # marca números
-                pedido.numeros.update(status=Numero.PAGO)
+                atualizar_numeros(pedido.rifa_id, pedido.numeros.all(), status=Numero.PAGO)
 
                 # comissão de afiliado (mesmo código de antes)
                 if (
@@ -1031,14 +1239,20 @@ def webhook_provider(request: HttpRequest, provider_key: str, *args, **kwargs):
     )
 
 # ======================================================================
-# RESERVA UNITÁRIA
+# RESERVA UNITÁRIA (hold no cache, ver rifas/holds.py)
 # ======================================================================
 class ReservarNumeroView(APIView):
+    """
+    POST {"numero", "hold_id"?}: segura o número no cache para o hold do
+    navegador (cria um se não vier). Não grava nada no banco; a reserva de
+    verdade nasce no CriarPedidoView com o mesmo hold_id.
+    """
     permission_classes = [permissions.AllowAny]
 
     def post(self, request, slug: str):
         rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
-        _liberar_expirados(rifa)
+        if not rifa.grade_pronta:
+            return Response({"detail": MSG_GRADE_GERANDO}, status=status.HTTP_409_CONFLICT)
 
         numero_raw = request.data.get("numero")
         try:
@@ -1049,43 +1263,36 @@ class ReservarNumeroView(APIView):
         if numero_int < 1 or numero_int > int(rifa.quantidade_numeros):
             return Response({"detail": "Número fora do intervalo."}, status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            num_obj, created = Numero.objects.select_for_update().get_or_create(
-                rifa=rifa,
-                numero=numero_int,
-                defaults={
-                    "status": Numero.RESERVADO,
-                    "reservado_em": timezone.now(),
-                },
-            )
+        try:
+            hold = holds.segurar(rifa, numero_int, request.data.get("hold_id"))
+        except holds.HoldIndisponivel as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
 
-            if not created:
-                if num_obj.status == Numero.RESERVADO:
-                    if num_obj.reservado_em and num_obj.reservado_em < timezone.now() - timedelta(
-                        minutes=rifa.minutos_expiracao_reserva or 15
-                    ):
-                        num_obj.status = Numero.RESERVADO
-                        num_obj.reservado_em = timezone.now()
-                        num_obj.cliente = None
-                        num_obj.pedido = None
-                        num_obj.save(update_fields=["status", "reservado_em", "cliente", "pedido"])
-                        return Response({"ok": True, "status": "reservado"})
-                    return Response(
-                        {"detail": "Número já está reservado."},
-                        status=status.HTTP_409_CONFLICT,
-                    )
+        return Response({"ok": True, "status": "reservado", **hold})
 
-                if num_obj.status == Numero.PAGO:
-                    return Response(
-                        {"detail": "Número já está pago."},
-                        status=status.HTTP_409_CONFLICT,
-                    )
 
-                num_obj.status = Numero.RESERVADO
-                num_obj.reservado_em = timezone.now()
-                num_obj.save(update_fields=["status", "reservado_em"])
+class HoldView(PublicAPIView):
+    """
+    GET    /api/rifas/<slug>/hold/<hold_id>/            -> números do hold
+    DELETE /api/rifas/<slug>/hold/<hold_id>/?numero=N   -> solta N (sem N, o hold todo)
+    """
+
+    def get(self, request, slug: str, hold_id: str):
+        rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
+        hold = holds.ler_hold(hold_id)
+        if hold is None or hold["rifa"] != rifa.id:
+            return Response({"detail": "Seleção expirada."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"hold_id": hold_id, "numeros": sorted(hold["numeros"]), "ttl": holds.HOLD_TTL})
 
-        return Response({"ok": True, "status": "reservado"})
+    def delete(self, request, slug: str, hold_id: str):
+        rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
+        numero = request.query_params.get("numero")
+        try:
+            numero = int(numero) if numero not in (None, "") else None
+        except (TypeError, ValueError):
+            return Response({"detail": "Número inválido."}, status=status.HTTP_400_BAD_REQUEST)
+        hold = holds.soltar(rifa, hold_id, numero)
+        return Response(hold or {"hold_id": hold_id, "numeros": [], "ttl": holds.HOLD_TTL})
 
 
 # ======================================================================
@@ -1095,25 +1302,46 @@ class ReservarNumeroView(APIView):
 class PedidoPublicDetailView(PublicAPIView):
     def get(self, request, protocolo: str, *args, **kwargs):
         pedido = get_object_or_404(
-            Pedido.objects.select_related("rifa", "cliente"),
+            _pedidos_com_versao(),
             protocolo=protocolo
         )
+        cotas = _cotas_ativas(pedido.rifa)
 
-        pagamento_obj = None
-        if Pagamento is not None:
-            try:
-                pagamento_obj = pedido.pagamento
-            except Pagamento.DoesNotExist:
-                pagamento_obj = None
+        pagamento_obj = _pagamento_ou_none(pedido)
 
         generated_now = False
         registry_error = None
 
-        if pay is not None:
-            need_create = (
-                pagamento_obj is None
-                or not getattr(pagamento_obj, "copia_cola", None)
+        # cobrança na fila é do worker (tasks.emitir_cobranca): o GET só espera.
+        # Pagamento que já pediu cob na Efí nunca ganha outra no registry
+        need_create = pay is not None and (
+            pagamento_obj is None
+            or (
+                not getattr(pagamento_obj, "copia_cola", None)
+                and pagamento_obj.status_provider != Pagamento.NA_FILA
+                and pagamento_obj.provider != "efi"
             )
+        )
+
+        # prazo da reserva: entra no ETag só o limite e se já venceu
+        # (o contador regressivo o front faz sozinho)
+        limite = None
+        if pedido.status not in (Pedido.PAGO, Pedido.CANCELADO, Pedido.EXPIRADO):
+            if pedido.criado_em and pedido.rifa.minutos_expiracao_reserva:
+                limite = pedido.criado_em + timedelta(
+                    minutes=pedido.rifa.minutos_expiracao_reserva
+                )
+        vencido = limite is not None and limite <= timezone.now()
+
+        # ainda falta gerar o PIX -> nada de 304, tem trabalho a fazer
+        etag = None
+        if not need_create:
+            etag = _etag_pedido(pedido, cotas, limite, vencido)
+            nao_mod = nao_modificado(request, etag)
+            if nao_mod is not None:
+                return nao_mod
+
+        if pay is not None:
             if need_create:
                 if pagamento_obj is None and Pagamento is not None:
                     pagamento_obj = Pagamento.objects.create(
@@ -1141,26 +1369,20 @@ class PedidoPublicDetailView(PublicAPIView):
 
         # calcula expire usando datetime.timedelta
         expires_in = None
-        if pedido.status not in (Pedido.PAGO, Pedido.CANCELADO, Pedido.EXPIRADO):
-            if pedido.criado_em and pedido.rifa.minutos_expiracao_reserva:
-                agora = timezone.now()
-                limite = pedido.criado_em + timedelta(
-                    minutes=pedido.rifa.minutos_expiracao_reserva
-                )
-                diff = (limite - agora).total_seconds()
-                if diff <= 0:
-                    expires_in = 0
-                else:
-                    expires_in = int(diff)
+        if limite is not None:
+            diff = (limite - timezone.now()).total_seconds()
+            if diff <= 0:
+                expires_in = 0
+            else:
+                expires_in = int(diff)
 
-        cotas_ativas = pedido.rifa.cotas_premiadas.filter(ativo=True).order_by("numero")
         cotas_data = [
             {
-                "numero": cota.numero,
-                "descricao": cota.descricao,
-                "valor_premio": f"{cota.valor_premio:.2f}",
+                "numero": numero,
+                "descricao": descricao,
+                "valor_premio": f"{valor:.2f}",
             }
-            for cota in cotas_ativas
+            for numero, descricao, valor in cotas
         ]
 
         resp = {
@@ -1204,4 +1426,6 @@ class PedidoPublicDetailView(PublicAPIView):
         if expires_in == 0 and pedido.status not in (Pedido.PAGO, Pedido.CANCELADO):
             resp["status"] = Pedido.EXPIRADO.upper()
 
-        return Response(resp)
+        if etag is None:
+            return Response(resp)
+        return com_etag(Response(resp), etag)
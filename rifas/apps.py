@@ -5,4 +5,4 @@ class RifasConfig(AppConfig):
     name = "rifas"
 
     def ready(self):
-        from . import signals  # noqa
+        from . import checks, signals  # noqa
@@ -0,0 +1,46 @@
+# rifas/checks.py
+"""
+Cache compartilhado: holds, nó do protocolo, sala de espera e outras
+coordenações entre workers moram no cache. Com LocMem (ou Dummy) cada
+processo tem o seu cache e essas garantias somem quando há mais de um
+worker: hold que não existe no worker que recebe o pedido, dois workers com
+o mesmo nó de protocolo, limite de admissão multiplicado pelo número de
+workers.
+
+Num processo só (runserver, testes, um worker) o LocMem é um substituto
+local que funciona. Por isso é só um aviso, e só no
+`manage.py check --deploy`: quem sobe vários workers sem REDIS_URL fica
+sabendo na checagem de deploy.
+"""
+from __future__ import annotations
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Tags, Warning, register
+
+# backends que guardam tudo dentro do próprio processo
+BACKENDS_LOCAIS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def cache_compartilhado() -> bool:
+    """True se o cache default é visto por todos os workers."""
+    backend = settings.CACHES.get("default", {}).get("BACKEND", "")
+    return backend not in BACKENDS_LOCAIS
+
+
+@register(Tags.caches, deploy=True)
+def checar_cache_compartilhado(app_configs, **kwargs):
+    if cache_compartilhado():
+        return []
+    backend = caches["default"].__class__.__name__
+    return [
+        Warning(
+            f"O cache default ({backend}) é local ao processo; holds, protocolo e "
+            "sala de espera só valem entre workers com cache compartilhado.",
+            hint="Defina REDIS_URL, ou rode um processo só (silencie rifas.W001).",
+            id="rifas.W001",
+        )
+    ]
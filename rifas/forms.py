@@ -24,7 +24,9 @@ class RifaForm(forms.ModelForm):
             "permitir_numero_escolhido",
             "limite_por_pedido",
             "minutos_expiracao_reserva",
+            "pedidos_por_segundo",
             "mostrar_top_compradores",
+            "grade_esparsa",
         ]
         widgets = {
             "descricao": forms.Textarea(attrs={"rows": 4, "class": "form-control"}),
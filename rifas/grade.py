@@ -0,0 +1,1274 @@
+# rifas/grade.py
+"""
+Grade compacta (bit-packed) das rifas.
+
+Em vez de mandar um dict JSON por número, a grade vira um blob binário:
+
+    offset  tam  campo
+    0       2    magic b"RG"
+    2       1    versão do formato (1)
+    3       1    flags (reservado, sempre 0)
+    4       4    total de números (uint32, big-endian)
+    8       4    qtd livres
+    12      4    qtd reservados
+    16      4    qtd pagos
+    20      ⌈total/4⌉  status, 2 bits por número (0 livre, 1 reservado, 2 pago)
+    ...     ⌈total/8⌉  bitmap de cotas premiadas (1 bit por número)
+
+O número N ocupa o índice N-1. Dentro de cada byte o primeiro número fica
+nos bits mais altos (MSB first), tanto no status quanto no bitmap de cotas.
+
+Versionamento: toda mudança de status de um Numero passa por
+atualizar_numeros()/salvar_numero(), que tiram uma versão nova e carimbam
+na linha. Assim o front pode pedir ?since=<versao> e receber só o que mudou.
+
+As versões saem de um contador no cache (cache.incr), não da linha da rifa:
+nada trava a Rifa durante a transação, e reservas e pagamentos da mesma
+rifa correm em paralelo (cada um trava só os próprios números). Como duas
+transações podem commitar fora da ordem das versões, Rifa.grade_versao é a
+marca d'água: a maior versão V tal que toda versão <= V já terminou
+(commit ou rollback). É ela que vai para o cliente como cursor; o feed
+manda tudo que já commitou acima do since, então o que passou da marca vem
+de novo na próxima vez (status absoluto, repetir não estraga nada) e nada
+que commitou atrasado fica para trás.
+
+Grade esparsa (Rifa.grade_esparsa): não existe uma linha por número, só
+para os que já foram reservados/pagos; número sem linha = livre. Quem
+reserva usa reservar_numeros() (cria a linha na hora) e quem conta usa
+contar_grade(). Número que volta a ficar livre mantém a linha (status
+livre + versão nova), senão o ?since= não ficaria sabendo da liberação.
+
+Snapshot: a grade inteira (binária + gzip; o JSON antigo só quando pedido)
+fica no cache do Django por rifa, marcada com a versão em que foi montada.
+Versão diferente da Rifa.grade_versao = snapshot velho; só um worker o
+atualiza (lock no cache) e os outros seguem servindo o velho enquanto isso.
+Atualizar não relê a grade: aplica no bin velho só as linhas que mudaram
+desde a versão dele (índice rifa+versao) e as reservas que venceram desde
+que ele foi montado. Montar do zero (todas as linhas não livres) só sem
+snapshot nenhum, depois de invalidar_snapshot() ou com mudança demais.
+
+Geração: a grade densa é materializada por gerar_grade() em lotes (um
+INSERT ... SELECT generate_series por lote no Postgres). Grade grande não é
+gerada no request do admin nem em thread do worker web: quem gera é o
+worker_reservas (ou o comando gerar_grade), que pega toda rifa com
+grade_gerada_ate < quantidade_numeros. Rifa.grade_gerada_ate marca até onde
+já foi; a rifa só vende com a grade pronta e a geração retoma de onde parou.
+
+Expiração virtual: reserva com expira_em já passado é lida como livre em
+todas as leituras (snapshot, janela, delta, contagem), sem UPDATE nenhum;
+quem solta a linha de verdade é o worker_reservas, quando der. Por isso o
+snapshot e as ETags levam, além da versão, o "corte": o instante do próximo
+vencimento de reserva aberta. Passou do corte, a grade mudou sem a versão
+mudar (ver marca_grade).
+
+Janela: ?from=&to=&status= devolve só um pedaço da grade (para o front
+rolar uma rifa de 1M de números sem montar 1M de elementos), lido direto
+do bin do snapshot, sem ir ao banco.
+"""
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+import logging
+import random
+import struct
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone as dt_timezone
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import Rifa, Numero, RifaContagem
+from .utils import com_etag, etag_forte, nao_modificado
+
+logger = logging.getLogger(__name__)
+
+try:
+    from .models import CotaPremiada
+except Exception:
+    CotaPremiada = None
+
+
+GRADE_MAGIC = b"RG"
+GRADE_FORMATO_VERSAO = 1
+GRADE_HEADER = struct.Struct(">2sBBIIII")
+
+STATUS_CODIGOS = {
+    Numero.LIVRE: 0,
+    Numero.RESERVADO: 1,
+    Numero.PAGO: 2,
+}
+CODIGOS_STATUS = {v: k for k, v in STATUS_CODIGOS.items()}
+
+CONTENT_TYPE_BIN = "application/octet-stream"
+
+# acima disso de mudanças desde ?since= mandamos o cliente recarregar tudo
+DELTA_MAX_MUDANCAS = 2000
+
+# máximo de números por resposta de janela (?from=&to=)
+JANELA_MAX = 2000
+
+# geração da grade: números por lote (1 transação curta por lote) e até
+# quantos faltando ainda vale gerar dentro do próprio request
+GRADE_LOTE = getattr(settings, "RIFAS_GRADE_LOTE", 20_000)
+GRADE_SINCRONA_ATE = getattr(settings, "RIFAS_GRADE_SINCRONA_ATE", 20_000)
+
+MSG_GRADE_GERANDO = "Os números desta rifa ainda estão sendo gerados. Tente novamente em instantes."
+
+SNAPSHOT_TTL = getattr(settings, "RIFAS_GRADE_SNAPSHOT_TTL", 60 * 60)
+SNAPSHOT_LOCK_TTL = 30
+# acima disso de linhas mudadas desde o snapshot velho, remonta do zero
+SNAPSHOT_MUDANCAS_MAX = 50_000
+# a grade inteira em JSON (um dict por número, montado em Python) só é o
+# formato padrão até esse tamanho; acima, sem ?formato=, vai a binária
+GRADE_JSON_MAX = getattr(settings, "RIFAS_GRADE_JSON_MAX", 20_000)
+# sem snapshot nenhum e outro worker montando: espera até isso antes de montar junto
+SNAPSHOT_ESPERA_MAX = 2.0
+
+
+# ======================================================================
+# VERSÃO DA GRADE
+# ======================================================================
+# versão aberta (transação em andamento) segura a marca d'água no máximo
+# isso; passa disso = a transação foi desfeita sem avisar (rollback de fora)
+VERSAO_ABERTA_TTL = 30
+# contador perdido no cache: recomeça desta folga acima do maior valor
+# conhecido, para não repetir versões de transações ainda abertas
+VERSAO_FOLGA = 256
+# versões olhadas por vez ao avançar a marca d'água
+PUBLICAR_MAX = 1024
+
+
+def _versao_key(rifa_id: int) -> str:
+    return f"rifas:grade:versao:{rifa_id}"
+
+
+def _abrindo_key(rifa_id: int) -> str:
+    return f"rifas:grade:abrindo:{rifa_id}"
+
+
+def _aberta_key(rifa_id: int, versao: int) -> str:
+    return f"rifas:grade:aberta:{rifa_id}:{versao}"
+
+
+def _semente_versao(rifa_id: int) -> int:
+    publicada = Rifa.objects.filter(pk=rifa_id).values_list("grade_versao", flat=True).first() or 0
+    carimbada = Numero.objects.filter(rifa_id=rifa_id).aggregate(m=Max("versao"))["m"] or 0
+    return max(publicada, carimbada) + VERSAO_FOLGA
+
+
+def _incr(chave: str, semente) -> int:
+    try:
+        return cache.incr(chave)
+    except ValueError:
+        cache.add(chave, semente(), None)
+        return cache.incr(chave)
+
+
+def proxima_versao(rifa_id: int) -> int:
+    """
+    Versão nova da grade para a transação corrente (tem que rodar dentro de
+    um transaction.atomic()).
+
+    Sai do contador do cache, sem tocar na Rifa. A versão fica "aberta" até
+    o commit; só então a marca d'água (Rifa.grade_versao) pode passar dela.
+    "abrindo" cobre o instante entre o incr e a marcação da aberta, para
+    quem avança a marca não pular uma versão que ainda nem foi marcada.
+    """
+    abrindo = _abrindo_key(rifa_id)
+    _incr(abrindo, lambda: 0)
+    try:
+        versao = _incr(_versao_key(rifa_id), lambda: _semente_versao(rifa_id))
+        cache.set(_aberta_key(rifa_id, versao), 1, VERSAO_ABERTA_TTL)
+    finally:
+        try:
+            cache.decr(abrindo)
+        except ValueError:
+            pass
+    transaction.on_commit(lambda: fechar_versao(rifa_id, versao))
+    return versao
+
+
+def fechar_versao(rifa_id: int, versao: int) -> int:
+    """A transação da versão terminou (commit ou rollback): avança a marca."""
+    cache.delete(_aberta_key(rifa_id, versao))
+    return publicar_versao(rifa_id)
+
+
+def publicar_versao(rifa_id: int, publicada: int | None = None) -> int:
+    """
+    Avança Rifa.grade_versao até antes da primeira versão ainda aberta e
+    devolve o valor. Só lê o cache quando não há nada a publicar; o UPDATE
+    é curto (fora das transações de reserva) e nunca volta o valor.
+    """
+    if publicada is None:
+        publicada = Rifa.objects.filter(pk=rifa_id).values_list("grade_versao", flat=True).first() or 0
+    # a ordem importa: contador antes de "abrindo" (ver proxima_versao)
+    ultima = cache.get(_versao_key(rifa_id))
+    if ultima is None or ultima <= publicada or (cache.get(_abrindo_key(rifa_id)) or 0) > 0:
+        return publicada
+
+    candidatas = range(publicada + 1, min(ultima, publicada + PUBLICAR_MAX) + 1)
+    abertas = cache.get_many([_aberta_key(rifa_id, v) for v in candidatas])
+    nova = publicada
+    for v in candidatas:
+        if _aberta_key(rifa_id, v) in abertas:
+            break
+        nova = v
+    if nova > publicada:
+        Rifa.objects.filter(pk=rifa_id, grade_versao__lt=nova).update(grade_versao=nova)
+    return nova
+
+
+def versao_atual(rifa: Rifa) -> int:
+    """Marca d'água da rifa, já avançada (e gravada na instância)."""
+    rifa.grade_versao = publicar_versao(rifa.id, rifa.grade_versao)
+    return rifa.grade_versao
+
+
+def atualizar_numeros(rifa_id: int, qs, **campos) -> int:
+    """
+    qs.update(**campos) carimbando uma versão nova da grade.
+    Use no lugar de Numero.objects...update(status=...) em qualquer mudança
+    de status. Retorna quantas linhas mudaram.
+
+    Saindo de reservado, expira_em é limpo junto (só reserva aberta tem prazo).
+    """
+    with transaction.atomic():
+        versao = proxima_versao(rifa_id)
+        if "status" not in campos:
+            return qs.update(versao=versao, **campos)
+        if campos["status"] != Numero.RESERVADO:
+            campos.setdefault("expira_em", None)
+
+        # trava as linhas (em ordem de número, a mesma da reserva) antes de
+        # contar: ninguém muda esses números entre a contagem e o update
+        antes: dict[str, int] = {}
+        for st in qs.select_for_update().order_by("numero").values_list("status", flat=True):
+            antes[st] = antes.get(st, 0) + 1
+        feitos = qs.update(versao=versao, **campos)
+        registrar_transicoes(rifa_id, [(st, campos["status"], qtd) for st, qtd in antes.items()])
+        return feitos
+
+
+def salvar_numero(numero: Numero, update_fields) -> None:
+    """Versão de atualizar_numeros() para um Numero já carregado."""
+    with transaction.atomic():
+        numero.versao = proxima_versao(numero.rifa_id)
+        antes = None
+        campos = [*update_fields, "versao"]
+        if "status" in update_fields:
+            antes = (
+                Numero.objects.select_for_update()
+                .filter(pk=numero.pk).values_list("status", flat=True).first()
+            )
+            if numero.status != Numero.RESERVADO and "expira_em" not in campos:
+                numero.expira_em = None
+                campos.append("expira_em")
+        numero.save(update_fields=campos)
+        if antes is not None:
+            registrar_transicoes(numero.rifa_id, [(antes, numero.status, 1)])
+
+
+# ======================================================================
+# CONTADORES (RifaContagem)
+# ======================================================================
+def registrar_transicoes(rifa_id: int, transicoes) -> None:
+    """
+    Leva para RifaContagem as mudanças de status, dadas como
+    (status_antes, status_depois, qtd). Tem que rodar na mesma transação
+    da mudança, com as linhas já travadas, e de preferência no fim dela: o
+    UPDATE da contagem trava a linha de RifaContagem até o commit.
+
+    atualizar_numeros()/salvar_numero() já chamam; quem usa proxima_versao()
+    direto (reservas em loop) chama no fim.
+    """
+    reservados = pagos = 0
+    for antes, depois, qtd in transicoes:
+        if antes == depois or not qtd:
+            continue
+        if antes == Numero.RESERVADO:
+            reservados -= qtd
+        elif antes == Numero.PAGO:
+            pagos -= qtd
+        if depois == Numero.RESERVADO:
+            reservados += qtd
+        elif depois == Numero.PAGO:
+            pagos += qtd
+    if not (reservados or pagos):
+        return
+
+    feitos = RifaContagem.objects.filter(rifa_id=rifa_id).update(
+        reservados=F("reservados") + reservados,
+        pagos=F("pagos") + pagos,
+        atualizado_em=timezone.now(),
+    )
+    if not feitos:
+        # rifa sem contagem ainda: conta do zero (as linhas já mudaram)
+        recontar_grade(rifa_id)
+
+
+def recontar_grade(rifa_id: int) -> RifaContagem:
+    """
+    Refaz a RifaContagem da rifa a partir das linhas de Numero.
+
+    A linha da contagem fica travada (select_for_update) da contagem até a
+    gravação: uma transição registrada no meio espera o commit e soma por
+    cima do valor novo, em vez de se perder ou contar duas vezes.
+    """
+    with transaction.atomic():
+        RifaContagem.objects.get_or_create(rifa_id=rifa_id)
+        contagem = RifaContagem.objects.select_for_update().get(rifa_id=rifa_id)
+        por_status = dict(
+            Numero.objects
+            .filter(rifa_id=rifa_id, status__in=[Numero.RESERVADO, Numero.PAGO])
+            .values_list("status")
+            .annotate(qtd=Count("id"))
+            .order_by()
+        )
+        contagem.reservados = por_status.get(Numero.RESERVADO, 0)
+        contagem.pagos = por_status.get(Numero.PAGO, 0)
+        contagem.save(update_fields=["reservados", "pagos", "atualizado_em"])
+    return contagem
+
+
+# ======================================================================
+# RESERVA EM LOTE / CONTAGEM
+# ======================================================================
+class NumerosIndisponiveis(Exception):
+    """Algum número do pedido não está livre; nada foi reservado."""
+
+    def __init__(self, numero: int, todos=None, mensagem: str = ""):
+        self.numero = numero
+        self.todos = list(todos or [numero])
+        super().__init__(mensagem or f"Número {numero} não está disponível.")
+
+
+class PedidoForaDasRegras(Exception):
+    """O pedido fere uma regra da rifa (escolha de números, limite por pedido)."""
+
+
+def validar_pedido(rifa: Rifa, quantidade: int, escolhidos: bool) -> None:
+    """
+    Regras da rifa que valem para qualquer caminho que cria pedido (API,
+    site, checkout rápido): `escolhidos` = o comprador mandou os números
+    (lista ou hold) em vez de pedir uma quantidade sorteada.
+    Levanta PedidoForaDasRegras com a mensagem para o comprador.
+    """
+    if quantidade < 1:
+        raise PedidoForaDasRegras("Quantidade inválida.")
+    if escolhidos and not rifa.permitir_numero_escolhido:
+        raise PedidoForaDasRegras("Esta rifa não permite escolher números; informe a quantidade.")
+    limite = int(rifa.limite_por_pedido or 0)
+    if limite and quantidade > limite:
+        raise PedidoForaDasRegras(f"Limite de {limite} números por pedido.")
+
+
+def reservar_numeros(rifa: Rifa, numeros, pedido, cliente, agora=None) -> set[int]:
+    """
+    Reserva `numeros` para o pedido, tudo ou nada, com um UPDATE condicional
+    em vez de travar e salvar linha por linha:
+
+        UPDATE numero SET status='reservado', pedido=..., versao=...
+         WHERE rifa=? AND numero IN (...) AND status='livre'
+
+    Se o UPDATE pegou menos linhas do que números pedidos, tenta as reservas
+    já vencidas (expiração virtual) num segundo UPDATE; se ainda faltar,
+    desfaz tudo e levanta NumerosIndisponiveis com o primeiro que faltou.
+
+    Devolve os ids dos pedidos que tinham as reservas vencidas retomadas
+    (para tasks.expirar_pedidos_vazios). Número fora de 1..quantidade_numeros
+    conta como indisponível; quem chama valida o intervalo antes se quiser
+    outra mensagem.
+    """
+    agora = agora or timezone.now()
+    pedidos = sorted({int(n) for n in numeros})
+    total = int(rifa.quantidade_numeros or 0)
+    for n in pedidos:
+        if not 1 <= n <= total:
+            raise NumerosIndisponiveis(n)
+    if not pedidos:
+        return set()
+
+    campos = {
+        "status": Numero.RESERVADO,
+        "pedido": pedido,
+        "cliente": cliente,
+        "reservado_em": agora,
+        "expira_em": rifa.vencimento_reserva(agora),
+    }
+    versao = None
+    try:
+        with transaction.atomic():
+            if rifa.grade_esparsa:
+                Numero.objects.bulk_create(
+                    [Numero(rifa=rifa, numero=n) for n in pedidos],
+                    ignore_conflicts=True,
+                    batch_size=1000,
+                )
+            versao = proxima_versao(rifa.id)
+            alvo = Numero.objects.filter(rifa=rifa, numero__in=pedidos)
+            # trava em ordem de número: dois pedidos com números em comum
+            # esperam um pelo outro em vez de cair em deadlock
+            list(alvo.select_for_update().order_by("numero").values_list("id", flat=True))
+
+            livres = alvo.filter(status=Numero.LIVRE).update(versao=versao, **campos)
+            retomados: set[int] = set()
+            vencidos = 0
+            if livres < len(pedidos):
+                qs = alvo.filter(status=Numero.RESERVADO, expira_em__lte=agora)
+                retomados = {p for p in qs.values_list("pedido_id", flat=True) if p}
+                vencidos = qs.update(versao=versao, **campos)
+
+            if livres + vencidos < len(pedidos):
+                meus = set(alvo.filter(pedido=pedido).values_list("numero", flat=True))
+                faltaram = [n for n in pedidos if n not in meus]
+                raise NumerosIndisponiveis(faltaram[0], faltaram)
+
+            # reserva vencida retomada continua reservada: só os livres contam
+            registrar_transicoes(rifa.id, [(Numero.LIVRE, Numero.RESERVADO, livres)])
+    except NumerosIndisponiveis:
+        if versao is not None:
+            # o savepoint foi desfeito: a versão não vai commitar
+            fechar_versao(rifa.id, versao)
+        raise
+    return retomados
+
+
+def contar_grade(rifa: Rifa) -> dict:
+    """
+    {"total", "livres", "reservados", "pagos"} da rifa, lidos da
+    RifaContagem (uma linha, sem COUNT). livres = total - reservados - pagos,
+    o que vale tanto para a grade cheia quanto para a esparsa.
+
+    Reserva vencida que o worker ainda não soltou conta como livre: só ela
+    é contada na hora (índice parcial de reservas abertas, poucas linhas).
+    """
+    try:
+        contagem = rifa.contagem
+    except RifaContagem.DoesNotExist:
+        contagem = recontar_grade(rifa.id)
+    vencidas = 0
+    if contagem.reservados:
+        vencidas = Numero.objects.filter(
+            rifa=rifa, status=Numero.RESERVADO, expira_em__lte=timezone.now(),
+        ).count()
+    reservados = max(contagem.reservados - vencidas, 0)
+    total = int(rifa.quantidade_numeros or 0)
+    return {
+        "total": total,
+        "livres": max(total - reservados - contagem.pagos, 0),
+        "reservados": reservados,
+        "pagos": contagem.pagos,
+    }
+
+
+# ======================================================================
+# GERAÇÃO DA GRADE DENSA
+# ======================================================================
+def _faixas(inicio: int, fim: int, tamanho: int):
+    """Pedaços (a, b) inclusivos de inicio..fim, sem montar lista nenhuma."""
+    a = inicio
+    while a <= fim:
+        b = min(a + tamanho - 1, fim)
+        yield a, b
+        a = b + 1
+
+
+def _inserir_faixa(rifa_id: int, a: int, b: int) -> None:
+    """Cria os números a..b como livres; os que já existem ficam como estão."""
+    if connection.vendor == "postgresql":
+        # o banco gera a faixa: nada de objeto Python por número
+        tabela = connection.ops.quote_name(Numero._meta.db_table)
+        with connection.cursor() as cur:
+            cur.execute(
+                f"INSERT INTO {tabela} (rifa_id, numero, status, versao) "
+                "SELECT %s, g, %s, 0 FROM generate_series(%s, %s) AS g "
+                "ON CONFLICT (rifa_id, numero) DO NOTHING",
+                [rifa_id, Numero.LIVRE, a, b],
+            )
+        return
+    Numero.objects.bulk_create(
+        (Numero(rifa_id=rifa_id, numero=i) for i in range(a, b + 1)),
+        batch_size=5000,
+        ignore_conflicts=True,
+    )
+
+
+def rifas_com_grade_incompleta():
+    """Rifas densas que ainda não têm todos os números (a mais antiga primeiro)."""
+    return Rifa.objects.filter(
+        grade_esparsa=False,
+        grade_gerada_ate__lt=F("quantidade_numeros"),
+    ).order_by("id")
+
+
+def gerar_grade(rifa_id: int, lote: int = GRADE_LOTE, progresso=None, max_lotes: int | None = None) -> int:
+    """
+    Cria as linhas que faltam da grade densa (grade_gerada_ate+1 até
+    quantidade_numeros), `lote` números por transação. Cada lote avança
+    Rifa.grade_gerada_ate junto com o insert: se o processo cair no meio,
+    a próxima chamada continua de onde parou.
+
+    `progresso(gerada_ate, total)` é chamado a cada lote; `max_lotes` para
+    depois de tantos lotes (o worker intercala a geração com as reservas).
+    Devolve quantos números foram percorridos.
+    """
+    feitos = 0
+    lotes = 0
+    while max_lotes is None or lotes < max_lotes:
+        rifa = (
+            Rifa.objects
+            .only("id", "quantidade_numeros", "grade_esparsa", "grade_gerada_ate")
+            .filter(pk=rifa_id)
+            .first()
+        )
+        if rifa is None or rifa.grade_pronta:
+            break
+        total = int(rifa.quantidade_numeros or 0)
+        for a, b in _faixas(rifa.grade_gerada_ate + 1, total, max(1, lote)):
+            with transaction.atomic():
+                _inserir_faixa(rifa_id, a, b)
+                Rifa.objects.filter(pk=rifa_id, grade_gerada_ate__lt=b).update(grade_gerada_ate=b)
+            feitos += b - a + 1
+            lotes += 1
+            if progresso:
+                progresso(b, total)
+            if max_lotes is not None and lotes >= max_lotes:
+                break
+        # volta pro while: a quantidade pode ter subido durante a geração
+
+    if feitos:
+        invalidar_snapshot(rifa_id)
+    return feitos
+
+
+def gerar_lote_pendente(lote: int = GRADE_LOTE) -> int | None:
+    """
+    Um lote da próxima grade incompleta, para o worker_reservas. Devolve o
+    id da rifa trabalhada ou None se não há grade nenhuma por gerar.
+    """
+    rifa_id = rifas_com_grade_incompleta().values_list("id", flat=True).first()
+    if rifa_id is None:
+        return None
+    gerar_grade(rifa_id, lote=lote, max_lotes=1)
+    return rifa_id
+
+
+def agendar_grade(rifa: Rifa) -> None:
+    """
+    Garante que a grade densa vai existir inteira.
+
+    Faltando até GRADE_SINCRONA_ATE números, gera aqui mesmo. Mais que
+    isso fica para o worker_reservas (ou o comando gerar_grade), que pega
+    a rifa pela grade incompleta, sem thread nenhuma no worker web: um
+    restart do gunicorn no meio não perde nada. Enquanto isso
+    rifa.grade_pronta é False e a rifa não vende.
+    """
+    if rifa.grade_pronta:
+        return
+    faltam = int(rifa.quantidade_numeros or 0) - rifa.grade_gerada_ate
+    if faltam <= GRADE_SINCRONA_ATE:
+        gerar_grade(rifa.id)
+        rifa.grade_gerada_ate = (
+            Rifa.objects.filter(pk=rifa.id).values_list("grade_gerada_ate", flat=True).first() or 0
+        )
+
+
+# ======================================================================
+# CODIFICAÇÃO
+# ======================================================================
+def codificar_grade(total: int, ocupados, cotas=()) -> bytes:
+    """
+    Monta o blob binário da grade.
+
+    - total: quantidade de números da rifa
+    - ocupados: iterável de (numero, status) — só precisa trazer quem NÃO
+      está livre, o resto já nasce zerado (= livre)
+    - cotas: iterável de números que são cota premiada
+
+    O custo é O(ocupados + cotas), não O(total).
+    """
+    total = max(int(total or 0), 0)
+    status_bytes = bytearray((total + 3) // 4)
+    cotas_bytes = bytearray((total + 7) // 8)
+
+    reservados = 0
+    pagos = 0
+    for numero, status in ocupados:
+        codigo = STATUS_CODIGOS.get(status, 0)
+        if not codigo or numero < 1 or numero > total:
+            continue
+        idx = numero - 1
+        shift = 6 - ((idx & 3) << 1)
+        atual = (status_bytes[idx >> 2] >> shift) & 3
+        if atual == codigo:
+            continue
+        # número repetido com outro status: o último vence
+        if atual == 1:
+            reservados -= 1
+        elif atual == 2:
+            pagos -= 1
+        status_bytes[idx >> 2] = (status_bytes[idx >> 2] & ~(3 << shift)) | (codigo << shift)
+        if codigo == 1:
+            reservados += 1
+        else:
+            pagos += 1
+
+    for numero in cotas:
+        if 1 <= numero <= total:
+            idx = numero - 1
+            cotas_bytes[idx >> 3] |= 0x80 >> (idx & 7)
+
+    livres = total - reservados - pagos
+    header = GRADE_HEADER.pack(
+        GRADE_MAGIC, GRADE_FORMATO_VERSAO, 0, total, livres, reservados, pagos
+    )
+    return header + bytes(status_bytes) + bytes(cotas_bytes)
+
+
+def decodificar_grade(blob: bytes) -> dict:
+    """
+    Inverso de codificar_grade. Usado no benchmark e em conferências;
+    o navegador tem o decoder equivalente em JS no template.
+    """
+    if len(blob) < GRADE_HEADER.size:
+        raise ValueError("grade binária truncada")
+    magic, versao, _flags, total, livres, reservados, pagos = GRADE_HEADER.unpack_from(blob)
+    if magic != GRADE_MAGIC or versao != GRADE_FORMATO_VERSAO:
+        raise ValueError("formato de grade desconhecido")
+
+    ini_status = GRADE_HEADER.size
+    ini_cotas = ini_status + (total + 3) // 4
+    if len(blob) < ini_cotas + (total + 7) // 8:
+        raise ValueError("grade binária truncada")
+
+    status = []
+    cotas = set()
+    for idx in range(total):
+        codigo = (blob[ini_status + (idx >> 2)] >> (6 - ((idx & 3) << 1))) & 3
+        status.append(CODIGOS_STATUS.get(codigo, Numero.LIVRE))
+        if blob[ini_cotas + (idx >> 3)] & (0x80 >> (idx & 7)):
+            cotas.add(idx + 1)
+
+    return {
+        "total": total,
+        "livres": livres,
+        "reservados": reservados,
+        "pagos": pagos,
+        "status": status,
+        "cotas": cotas,
+    }
+
+
+# ======================================================================
+# CONSULTAS
+# ======================================================================
+def cotas_da_rifa(rifa: Rifa) -> set[int]:
+    """Números das cotas premiadas ativas da rifa."""
+    if CotaPremiada is not None:
+        return set(
+            CotaPremiada.objects
+            .filter(rifa=rifa, ativo=True)
+            .values_list("numero", flat=True)
+        )
+
+    cotas = set()
+    for item in getattr(rifa, "cotas_premiadas", None) or []:
+        try:
+            cotas.add(int(item.get("numero")))
+        except Exception:
+            pass
+    return cotas
+
+
+def _ocupados(rifa: Rifa, agora=None) -> tuple[list[tuple[int, str]], float]:
+    """
+    (numero, status) de quem não está livre (índice rifa+status), com a
+    reserva vencida já contada como livre, e o corte: epoch do próximo
+    vencimento entre as reservas que ficaram (0 se não há nenhuma).
+    """
+    agora = agora or timezone.now()
+    ocupados = []
+    proximo = None
+    linhas = (
+        Numero.objects
+        .filter(rifa=rifa)
+        .exclude(status=Numero.LIVRE)
+        .values_list("numero", "status", "expira_em")
+    )
+    for numero, st, expira_em in linhas:
+        if st == Numero.RESERVADO and expira_em is not None:
+            if expira_em <= agora:
+                continue  # vencida: livre (expiração virtual)
+            if proximo is None or expira_em < proximo:
+                proximo = expira_em
+        ocupados.append((numero, st))
+    return ocupados, (proximo.timestamp() if proximo else 0)
+
+
+def _total(rifa: Rifa, ocupados) -> int:
+    total = int(rifa.quantidade_numeros or 0)
+    if ocupados:
+        total = max(total, max(n for n, _ in ocupados))
+    return total
+
+
+def grade_binaria(rifa: Rifa) -> bytes:
+    """
+    Grade da rifa já empacotada.
+    Só lê do banco os números reservados/pagos (índice rifa+status).
+    """
+    ocupados, _corte = _ocupados(rifa)
+    return codificar_grade(_total(rifa, ocupados), ocupados, cotas_da_rifa(rifa))
+
+
+# ======================================================================
+# SNAPSHOT EM CACHE
+# ======================================================================
+def _snapshot_key(rifa_id: int) -> str:
+    return f"rifas:grade:snap:{rifa_id}"
+
+
+def _marca_key(rifa_id: int) -> str:
+    return f"rifas:grade:marca:{rifa_id}"
+
+
+def _vigente(corte: float, agora: float | None = None) -> bool:
+    return not corte or (agora or time.time()) < corte
+
+
+def marca_grade(rifa: Rifa) -> tuple[int, float]:
+    """
+    (versao, corte) que identifica o conteúdo atual da grade: a versão da
+    rifa + o instante do próximo vencimento de reserva aberta. Fica numa
+    chave pequena do cache (o snapshot grava a dele ao ser montado); sem
+    ela, ou com ela vencida, sai de uma consulta no índice de reservas.
+    """
+    versao_atual(rifa)
+    marca = cache.get(_marca_key(rifa.id))
+    if marca is not None and marca[0] == rifa.grade_versao and _vigente(marca[1]):
+        return marca
+    proximo = (
+        Numero.objects
+        .filter(rifa=rifa, status=Numero.RESERVADO, expira_em__gt=timezone.now())
+        .aggregate(m=Min("expira_em"))["m"]
+    )
+    marca = (rifa.grade_versao, proximo.timestamp() if proximo else 0)
+    cache.set(_marca_key(rifa.id), marca, SNAPSHOT_TTL)
+    return marca
+
+
+def _montar_snapshot(rifa: Rifa, anterior: dict | None = None) -> dict:
+    """
+    Snapshot da versão atual: a partir do `anterior` (snapshot velho da
+    mesma rifa) quando dá, senão do zero.
+    """
+    # a versão é lida antes dos números: no pior caso o snapshot traz uma
+    # mudança mais nova que a versão dele, que vem de novo na próxima
+    versao = rifa.grade_versao
+    agora = timezone.now()
+    if anterior is not None:
+        snap = _atualizar_snapshot(rifa, anterior, versao, agora)
+        if snap is not None:
+            return snap
+
+    ocupados, corte = _ocupados(rifa, agora)
+    blob = codificar_grade(_total(rifa, ocupados), ocupados, cotas_da_rifa(rifa))
+    return _empacotar_snapshot(versao, corte, agora, blob)
+
+
+def _empacotar_snapshot(versao: int, corte: float, agora, blob: bytes) -> dict:
+    return {
+        "versao": versao,
+        "corte": corte,
+        "montado_em": agora.timestamp(),
+        "bin": blob,
+        "bin_gz": gzip.compress(blob, compresslevel=6),
+        # para o sorteio por posição (ver sortear_livres)
+        "livres_acum": livres_acumulados(blob),
+        # JSON antigo só é montado se alguém pedir (ver _json_gz)
+        "json_gz": None,
+    }
+
+
+def _atualizar_snapshot(rifa: Rifa, anterior: dict, versao: int, agora) -> dict | None:
+    """
+    Aplica no bin do `anterior` o que mudou depois dele: linhas com versão
+    maior que a dele e reservas que venceram depois de montado_em (as que
+    já estavam vencidas ele mostra livres). Custo O(mudanças) no banco e um
+    gzip do bin; None se não dá (tamanho mudou, mudança demais, snapshot
+    sem montado_em) e aí quem chama monta do zero.
+    """
+    blob = bytearray(anterior["bin"])
+    _magic, _fmt, _flags, total, livres, reservados, pagos = GRADE_HEADER.unpack_from(blob)
+    montado_em = anterior.get("montado_em")
+    if montado_em is None or total != int(rifa.quantidade_numeros or 0):
+        return None
+
+    base = Numero.objects.filter(rifa=rifa)
+    linhas = list(
+        base.filter(versao__gt=anterior["versao"])
+        .values_list("numero", "status", "expira_em")[:SNAPSHOT_MUDANCAS_MAX + 1]
+    )
+    venceram = list(
+        base.filter(
+            status=Numero.RESERVADO,
+            expira_em__gt=datetime.fromtimestamp(montado_em, tz=dt_timezone.utc),
+            expira_em__lte=agora,
+        )
+        .values_list("numero", flat=True)[:SNAPSHOT_MUDANCAS_MAX + 1]
+    )
+    if len(linhas) + len(venceram) > SNAPSHOT_MUDANCAS_MAX:
+        return None
+
+    contagem = {0: livres, 1: reservados, 2: pagos}
+    mudancas = [(n, 0) for n in venceram]
+    for numero, st, expira_em in linhas:
+        vencida = st == Numero.RESERVADO and expira_em is not None and expira_em <= agora
+        mudancas.append((numero, 0 if vencida else STATUS_CODIGOS.get(st, 0)))
+
+    ini = GRADE_HEADER.size
+    for numero, codigo in mudancas:
+        if not 1 <= numero <= total:
+            return None  # número fora da grade: só do zero
+        idx = numero - 1
+        shift = 6 - ((idx & 3) << 1)
+        atual = (blob[ini + (idx >> 2)] >> shift) & 3
+        if atual == codigo:
+            continue
+        blob[ini + (idx >> 2)] = (blob[ini + (idx >> 2)] & ~(3 << shift)) | (codigo << shift)
+        contagem[atual] -= 1
+        contagem[codigo] += 1
+
+    GRADE_HEADER.pack_into(
+        blob, 0, GRADE_MAGIC, GRADE_FORMATO_VERSAO, 0, total, contagem[0], contagem[1], contagem[2]
+    )
+    proximo = (
+        base.filter(status=Numero.RESERVADO, expira_em__gt=agora)
+        .aggregate(m=Min("expira_em"))["m"]
+    )
+    return _empacotar_snapshot(versao, proximo.timestamp() if proximo else 0, agora, bytes(blob))
+
+
+def _json_gz(rifa: Rifa, snap: dict) -> bytes:
+    """
+    Grade no JSON antigo (um dict por número), já com gzip, derivada do
+    bin do snapshot. Fica guardada no próprio snapshot depois da 1ª vez.
+    """
+    if snap.get("json_gz") is not None:
+        return snap["json_gz"]
+
+    g = decodificar_grade(snap["bin"])
+    cotas = g["cotas"]
+    corpo = json.dumps({
+        "versao": snap["versao"],
+        "numeros": [
+            {"numero": n, "status": st, "cota_premiada": n in cotas}
+            for n, st in enumerate(g["status"], start=1)
+        ],
+    }).encode("utf-8")
+    json_gz = gzip.compress(corpo, compresslevel=6)
+
+    key = _snapshot_key(rifa.id)
+    atual = cache.get(key)
+    if atual is not None and (atual["versao"], atual.get("corte", 0)) == (snap["versao"], snap.get("corte", 0)):
+        cache.set(key, {**atual, "json_gz": json_gz}, SNAPSHOT_TTL)
+    return json_gz
+
+
+def invalidar_snapshot(rifa_id: int) -> None:
+    """
+    Descarta o snapshot da rifa. Mudança de status de número não precisa
+    disso (a versão já invalida); serve para o que não mexe na versão,
+    como cotas premiadas e quantidade de números.
+    """
+    cache.delete_many([_snapshot_key(rifa_id), _marca_key(rifa_id)])
+
+
+def snapshot_grade(rifa: Rifa) -> dict:
+    """
+    Snapshot da grade para a versão atual da rifa (rifa.grade_versao),
+    enquanto nenhuma reserva dele vencer (corte).
+
+    - snapshot da versão certa e dentro do corte -> devolve direto
+    - velho -> quem pegar o lock aplica nele as mudanças; os demais recebem o velho
+    - nenhum -> quem pegar o lock monta; os demais esperam um pouco por ele
+    """
+    versao_atual(rifa)
+    key = _snapshot_key(rifa.id)
+    snap = cache.get(key)
+    if snap is not None and snap["versao"] == rifa.grade_versao and _vigente(snap.get("corte", 0)):
+        return snap
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, SNAPSHOT_LOCK_TTL):
+        try:
+            snap = _montar_snapshot(rifa, anterior=snap)
+            cache.set_many({
+                key: snap,
+                _marca_key(rifa.id): (snap["versao"], snap["corte"]),
+            }, SNAPSHOT_TTL)
+        finally:
+            cache.delete(lock_key)
+        return snap
+
+    if snap is not None:
+        return snap  # stale-while-revalidate
+
+    limite = time.monotonic() + SNAPSHOT_ESPERA_MAX
+    while time.monotonic() < limite:
+        time.sleep(0.05)
+        snap = cache.get(key)
+        if snap is not None:
+            return snap
+
+    # quem tinha o lock demorou demais (ou morreu): monta sem gravar
+    return _montar_snapshot(rifa)
+
+
+# ======================================================================
+# JANELA (virtual scroll)
+# ======================================================================
+# códigos de status presentes em cada valor de byte (4 números por byte):
+# com filtro de status dá para pular 4 números de uma vez
+_CODIGOS_NO_BYTE = [
+    frozenset((b >> shift) & 3 for shift in (6, 4, 2, 0))
+    for b in range(256)
+]
+
+
+def janela_grade(rifa: Rifa, de: int, ate: int, status=None, limite: int = JANELA_MAX) -> dict:
+    """
+    Números de `de` a `ate` (inclusive), opcionalmente só os dos `status`
+    pedidos, no máximo `limite` por vez. Se o limite cortar a janela,
+    "proximo" diz de onde continuar.
+
+    As contagens (livres/reservados/pagos) são da rifa inteira.
+    """
+    snap = snapshot_grade(rifa)
+    blob = snap["bin"]
+    _magic, _fmt, _flags, total, livres, reservados, pagos = GRADE_HEADER.unpack_from(blob)
+    ini_status = GRADE_HEADER.size
+    ini_cotas = ini_status + (total + 3) // 4
+
+    de = max(int(de), 1)
+    ate = min(int(ate), total)
+    limite = max(1, min(int(limite), JANELA_MAX))
+    codigos = None if not status else {STATUS_CODIGOS[st] for st in status}
+
+    numeros = []
+    proximo = None
+    n = de
+    while n <= ate:
+        idx = n - 1
+        byte = blob[ini_status + (idx >> 2)]
+        if codigos is not None and (idx & 3) == 0 and codigos.isdisjoint(_CODIGOS_NO_BYTE[byte]):
+            n += 4
+            continue
+        codigo = (byte >> (6 - ((idx & 3) << 1))) & 3
+        if codigos is None or codigo in codigos:
+            if len(numeros) >= limite:
+                proximo = n
+                break
+            numeros.append({
+                "numero": n,
+                "status": CODIGOS_STATUS.get(codigo, Numero.LIVRE),
+                "cota_premiada": bool(blob[ini_cotas + (idx >> 3)] & (0x80 >> (idx & 7))),
+            })
+        n += 1
+
+    return {
+        "versao": snap["versao"],
+        "corte": snap.get("corte", 0),
+        "total": total,
+        "livres": livres,
+        "reservados": reservados,
+        "pagos": pagos,
+        "from": de,
+        "to": ate,
+        "status": sorted(status) if status else None,
+        "numeros": numeros,
+        "proximo": proximo,
+    }
+
+
+# ======================================================================
+# SORTEIO (compra por quantidade)
+# ======================================================================
+# O snapshot guarda a soma acumulada dos livres por bloco de BLOCO_LIVRES
+# números (livres_acum). Sortear é escolher posições 0..livres-1 e achar o
+# k-ésimo livre: bisect no acumulado dá o bloco e só os bytes dele são
+# varridos. Nada de listar os livres nem de sortear e descartar ocupados,
+# então custa o mesmo com 1% ou com 99% vendido.
+BLOCO_LIVRES = 256  # múltiplo de 4: o bloco é um pedaço inteiro de bytes
+_BYTES_BLOCO = BLOCO_LIVRES // 4
+
+# tabela de translate: quantos números livres (código 0) há em cada byte
+_LIVRES_NO_BYTE = bytes(
+    sum(1 for shift in (6, 4, 2, 0) if not (b >> shift) & 3)
+    for b in range(256)
+)
+
+_aleatorio = random.SystemRandom()
+
+
+def livres_acumulados(blob: bytes) -> list[int]:
+    """Soma acumulada dos livres por bloco do bin (a contagem roda em C)."""
+    total = GRADE_HEADER.unpack_from(blob)[3]
+    ini = GRADE_HEADER.size
+    por_byte = blob[ini: ini + (total + 3) // 4].translate(_LIVRES_NO_BYTE)
+    acum = list(accumulate(
+        sum(por_byte[i: i + _BYTES_BLOCO]) for i in range(0, len(por_byte), _BYTES_BLOCO)
+    ))
+    sobra = -total % 4  # fim do último byte: zerado, mas não é número
+    if sobra:
+        acum[-1] -= sobra
+    return acum
+
+
+def _k_esimo_livre(blob: bytes, acum: list[int], k: int) -> int:
+    """Número do k-ésimo livre (0 = o primeiro) da grade."""
+    bloco = bisect_right(acum, k)
+    if bloco:
+        k -= acum[bloco - 1]
+    ini = GRADE_HEADER.size + bloco * _BYTES_BLOCO
+    for i in range(ini, ini + _BYTES_BLOCO):
+        byte = blob[i]
+        livres = _LIVRES_NO_BYTE[byte]
+        if k >= livres:
+            k -= livres
+            continue
+        for pos in range(4):
+            if not (byte >> (6 - (pos << 1))) & 3:
+                if not k:
+                    return ((i - GRADE_HEADER.size) << 2) + pos + 1
+                k -= 1
+    raise ValueError("contagem de livres do snapshot não bate com o bin")
+
+
+def sortear_livres(rifa: Rifa, qtd: int, excluir=()) -> list[int]:
+    """
+    `qtd` números livres sorteados de forma uniforme, lidos do snapshot da
+    grade (sem consulta). Menos que `qtd` só se não houver livres bastantes.
+
+    Quem chama reserva com reservar_numeros(): o snapshot pode estar um pouco
+    atrás do banco, e aí a reserva falha e o sorteio se repete sem os que
+    faltaram (ver NumerosIndisponiveis.todos).
+    """
+    snap = snapshot_grade(rifa)
+    blob = snap["bin"]
+    livres = GRADE_HEADER.unpack_from(blob)[4]
+    excluir = set(excluir)
+    qtd = int(qtd)
+    if qtd <= 0 or livres <= 0:
+        return []
+
+    acum = snap.get("livres_acum") or livres_acumulados(blob)
+    # sorteia posições a mais para cobrir os excluídos que ainda estão livres
+    posicoes = _aleatorio.sample(range(livres), min(qtd + len(excluir), livres))
+    escolhidos = []
+    for k in posicoes:
+        n = _k_esimo_livre(blob, acum, k)
+        if n not in excluir:
+            escolhidos.append(n)
+            if len(escolhidos) == qtd:
+                break
+    return escolhidos
+
+
+# ======================================================================
+# RESPOSTA HTTP
+# ======================================================================
+def delta_grade(rifa: Rifa, since: int) -> dict:
+    """
+    Números que mudaram depois da versão `since`.
+
+    Se o cliente estiver muito atrás (ou com uma versão que não existe),
+    devolve {"resync": True} e ele recarrega a grade inteira.
+
+    "versao" (o próximo since) é a marca d'água; o que já commitou acima
+    dela vem junto agora e de novo na próxima (ver o topo do módulo).
+
+    Reservas vencidas que ainda não foram soltas no banco vão sempre junto,
+    como livres (expiração virtual): não mudaram de versão, mas mudaram.
+    """
+    # marca d'água antes das linhas: tudo até ela já commitou e entra
+    versao = versao_atual(rifa)
+    base = {"versao": versao, "since": since, "total": int(rifa.quantidade_numeros or 0)}
+
+    if since < 0 or since > versao:
+        return {**base, "resync": True, "numeros": []}
+
+    agora = timezone.now()
+    linhas = []
+    if since < versao:
+        linhas = list(
+            Numero.objects
+            .filter(rifa=rifa, versao__gt=since)
+            .order_by("numero")
+            .values_list("numero", "status", "expira_em")[:DELTA_MAX_MUDANCAS + 1]
+        )
+        if len(linhas) > DELTA_MAX_MUDANCAS:
+            return {**base, "resync": True, "numeros": []}
+
+    status = {}
+    for numero, st, expira_em in linhas:
+        vencida = st == Numero.RESERVADO and expira_em is not None and expira_em <= agora
+        status[numero] = Numero.LIVRE if vencida else st
+    for numero in (
+        Numero.objects
+        .filter(rifa=rifa, status=Numero.RESERVADO, expira_em__lte=agora)
+        .values_list("numero", flat=True)[:DELTA_MAX_MUDANCAS]
+    ):
+        status[numero] = Numero.LIVRE
+
+    mudancas = [{"numero": n, "status": st} for n, st in sorted(status.items())]
+    return {**base, "resync": False, "numeros": mudancas}
+
+
+def since_pedido(request: HttpRequest):
+    """Valor de ?since= como int; None se não veio, -1 se veio inválido (força resync)."""
+    raw = request.GET.get("since")
+    if raw in (None, ""):
+        return None
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return -1
+
+
+def janela_pedida(request: HttpRequest):
+    """
+    Parâmetros de janela (?from=&to=&status=&limite=) ou None se não vieram.
+    status aceita vários separados por vírgula; status desconhecido -> ValueError.
+    """
+    params = request.GET
+    if not any(params.get(k) for k in ("from", "to", "status")):
+        return None
+
+    def _int(nome, padrao):
+        try:
+            return int(params.get(nome) or padrao)
+        except (TypeError, ValueError):
+            return padrao
+
+    de = _int("from", 1)
+    status = {st.strip().lower() for st in (params.get("status") or "").split(",") if st.strip()}
+    desconhecidos = status - set(STATUS_CODIGOS)
+    if desconhecidos:
+        raise ValueError(f"status inválido: {', '.join(sorted(desconhecidos))}")
+    # sem filtro a janela é o próprio intervalo; com filtro ela anda até achar `limite` números
+    ate = _int("to", de + JANELA_MAX - 1 if not status else 2 ** 31)
+    return {"de": de, "ate": ate, "status": status, "limite": _int("limite", JANELA_MAX)}
+
+
+def formato_pedido(request: HttpRequest, rifa: Rifa | None = None) -> str:
+    """
+    Formato pedido pelo cliente:
+      - ?formato=bin (ou Accept: application/octet-stream) -> "bin"
+      - ?formato=b64 -> "b64" (JSON com o blob em base64)
+      - ?formato=json -> "json" (formato antigo)
+      - sem ?formato= -> "json" até GRADE_JSON_MAX números, "bin" acima
+        (o JSON de uma rifa grande é montado em Python, número a número)
+    """
+    formato = (request.GET.get("formato") or "").strip().lower()
+    if formato in ("bin", "b64", "json"):
+        return formato
+    if CONTENT_TYPE_BIN in (request.headers.get("Accept") or ""):
+        return "bin"
+    if rifa is not None and int(rifa.quantidade_numeros or 0) > GRADE_JSON_MAX:
+        return "bin"
+    return "json"
+
+
+def _aceita_gzip(request: HttpRequest) -> bool:
+    return "gzip" in (request.headers.get("Accept-Encoding") or "").lower()
+
+
+def resposta_grade(request: HttpRequest, rifa: Rifa, formato: str) -> HttpResponse:
+    """
+    Grade inteira a partir do snapshot em cache, no formato pedido.
+    Se o cliente aceita gzip, os bytes já comprimidos vão direto.
+
+    ETag = (rifa, versão, corte, formato, gzip): If-None-Match da mesma
+    marca (marca_grade) volta 304 sem carregar o snapshot.
+    """
+    gz = formato != "b64" and _aceita_gzip(request)
+
+    def _etag(versao, corte):
+        return etag_forte("g", rifa.id, versao, corte, formato, "gz" if gz else "")
+
+    if request.headers.get("If-None-Match"):
+        nao_mod = nao_modificado(request, _etag(*marca_grade(rifa)))
+        if nao_mod is not None:
+            return nao_mod
+
+    snap = snapshot_grade(rifa)
+
+    if formato == "b64":
+        resp = JsonResponse({
+            "formato": f"rg{GRADE_FORMATO_VERSAO}",
+            "versao": snap["versao"],
+            "dados": base64.b64encode(snap["bin"]).decode("ascii"),
+        })
+        resp["X-Grade-Versao"] = str(snap["versao"])
+        return com_etag(resp, _etag(snap["versao"], snap.get("corte", 0)))
+
+    if formato == "bin":
+        content_type = CONTENT_TYPE_BIN
+        corpo, corpo_gz = snap["bin"], snap["bin_gz"]
+    else:
+        content_type = "application/json"
+        corpo, corpo_gz = None, _json_gz(rifa, snap)
+
+    if gz:
+        resp = HttpResponse(corpo_gz, content_type=content_type)
+        resp["Content-Encoding"] = "gzip"
+    else:
+        resp = HttpResponse(
+            corpo if corpo is not None else gzip.decompress(corpo_gz),
+            content_type=content_type,
+        )
+    resp["Vary"] = "Accept-Encoding"
+    resp["X-Grade-Versao"] = str(snap["versao"])
+    # o snapshot pode ser o velho (stale-while-revalidate): ETag da versão servida
+    return com_etag(resp, _etag(snap["versao"], snap.get("corte", 0)))
+
+
+def resposta_janela(request: HttpRequest, rifa: Rifa, janela: dict) -> HttpResponse:
+    """Resposta do ?from=&to=&status= (JSON), com ETag por marca + janela."""
+    def _etag(versao, corte):
+        return etag_forte(
+            "j", rifa.id, versao, corte, janela["de"], janela["ate"],
+            ",".join(sorted(janela["status"])), janela["limite"],
+        )
+
+    if request.headers.get("If-None-Match"):
+        nao_mod = nao_modificado(request, _etag(*marca_grade(rifa)))
+        if nao_mod is not None:
+            return nao_mod
+
+    dados = janela_grade(rifa, janela["de"], janela["ate"], janela["status"], janela["limite"])
+    resp = JsonResponse(dados)
+    resp["X-Grade-Versao"] = str(dados["versao"])
+    return com_etag(resp, _etag(dados["versao"], dados["corte"]))
+
+
+def resposta_delta(request: HttpRequest, rifa: Rifa, since: int) -> HttpResponse:
+    """
+    Resposta do ?since=. Enquanto a grade não anda, o cliente repete o mesmo
+    since e recebe 304 (ETag = rifa + since + marca atual), sem consultar Numero.
+    """
+    etag = etag_forte("d", rifa.id, since, *marca_grade(rifa))
+    nao_mod = nao_modificado(request, etag)
+    if nao_mod is not None:
+        return nao_mod
+    return com_etag(JsonResponse(delta_grade(rifa, since)), etag)
@@ -0,0 +1,188 @@
+# rifas/holds.py
+"""
+Pré-reserva (hold) de números no cache, sem tocar no banco.
+
+Cada toque no seletor segura o número por HOLD_TTL segundos numa chave do
+cache; cache.add() é atômico, então só um hold ganha cada número. O hold
+vira reserva de verdade (Numero reservado + Pedido) só quando o
+CriarPedidoView recebe o hold_id: até lá o banco não vê nada, nem lock
+nem UPDATE.
+
+Chaves:
+    rifas:hold:n:<rifa_id>:<numero>  -> hold_id dono do número
+    rifas:hold:h:<hold_id>           -> {"rifa": rifa_id, "numeros": [...]}
+
+    rifas:hold:t:<hold_id>           -> trava de quem está mexendo no hold
+
+O cache precisa ser compartilhado entre os workers (Redis, Memcached): o
+hold criado num worker tem que existir no worker que recebe o pedido. O
+LocMem serve enquanto o site roda num processo só (ver rifas/checks.py).
+
+Dois toques seguidos no mesmo hold (duas abas, clique duplo) fazem
+ler-alterar-gravar no mesmo dict; a trava por hold_id serializa segurar()
+e soltar() para um não apagar o número que o outro acabou de pôr.
+
+Número segurado por alguém continua aparecendo livre na grade dos outros;
+quem tentar pegar recebe 409 (segurar() ou na criação do pedido).
+"""
+from __future__ import annotations
+
+import secrets
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .grade import janela_grade
+from .models import Numero, Rifa
+
+HOLD_TTL = getattr(settings, "RIFAS_HOLD_TTL", 5 * 60)
+TRAVA_TTL = 5  # segundos; segurar() leva milissegundos
+TRAVA_ESPERA = 2.0
+
+
+class HoldIndisponivel(Exception):
+    """Número já segurado por outro hold, reservado/pago ou fora da rifa."""
+
+
+def _chave_numero(rifa_id: int, numero: int) -> str:
+    return f"rifas:hold:n:{rifa_id}:{numero}"
+
+
+def _chave_hold(hold_id: str) -> str:
+    return f"rifas:hold:h:{hold_id}"
+
+
+def _chave_trava(hold_id: str) -> str:
+    return f"rifas:hold:t:{hold_id}"
+
+
+@contextmanager
+def _travado(hold_id: str):
+    """Uma alteração por vez no mesmo hold (cache.add como mutex)."""
+    chave = _chave_trava(hold_id)
+    limite = time.monotonic() + TRAVA_ESPERA
+    while not cache.add(chave, 1, TRAVA_TTL):
+        if time.monotonic() >= limite:
+            raise HoldIndisponivel("Seleção sendo atualizada, tente de novo.")
+        time.sleep(0.02)
+    try:
+        yield
+    finally:
+        cache.delete(chave)
+
+
+def novo_hold_id() -> str:
+    return secrets.token_urlsafe(12)
+
+
+def ler_hold(hold_id: str | None) -> dict | None:
+    if not hold_id:
+        return None
+    return cache.get(_chave_hold(hold_id))
+
+
+def donos(rifa_id: int, numeros) -> dict[int, str]:
+    """{numero: hold_id} dos números que estão segurados agora."""
+    chaves = {_chave_numero(rifa_id, int(n)): int(n) for n in numeros}
+    return {chaves[k]: dono for k, dono in cache.get_many(list(chaves)).items()}
+
+
+def segurados_por_outros(rifa_id: int, numeros, hold_id: str | None = None) -> list[int]:
+    """Números da lista que estão com outro hold (o pedido não pode levar)."""
+    return sorted(n for n, dono in donos(rifa_id, numeros).items() if dono != hold_id)
+
+
+def segurar(rifa: Rifa, numero: int, hold_id: str | None = None) -> dict:
+    """
+    Segura `numero` para o hold (cria um hold novo se não vier hold_id ou
+    se o informado já venceu). Renova o TTL do hold inteiro.
+    Devolve o estado do hold; HoldIndisponivel se não der.
+    """
+    numero = int(numero)
+    if not rifa.permitir_numero_escolhido:
+        raise HoldIndisponivel("Esta rifa não permite escolher números.")
+    if numero < 1 or numero > int(rifa.quantidade_numeros or 0):
+        raise HoldIndisponivel("Número fora do intervalo.")
+
+    hold = ler_hold(hold_id)
+    if hold is not None and hold["rifa"] != rifa.id:
+        hold = None
+    if hold is None:
+        hold_id = novo_hold_id()
+
+    with _travado(hold_id):
+        # relê dentro da trava: outro toque pode ter gravado no meio
+        hold = ler_hold(hold_id)
+        if hold is None or hold["rifa"] != rifa.id:
+            hold = {"rifa": rifa.id, "numeros": []}
+        _segurar_numero(rifa, numero, hold_id, hold)
+        _gravar(hold_id, hold)
+    return _estado(hold_id, hold)
+
+
+def _segurar_numero(rifa: Rifa, numero: int, hold_id: str, hold: dict) -> None:
+    if numero in hold["numeros"]:
+        return
+    limite = int(rifa.limite_por_pedido or 0)
+    if limite and len(hold["numeros"]) >= limite:
+        raise HoldIndisponivel(f"Limite de {limite} números por pedido.")
+
+    # o que o banco já tem vem do snapshot da grade (cache), sem consulta
+    atual = janela_grade(rifa, numero, numero, limite=1)["numeros"]
+    if not atual or atual[0]["status"] != Numero.LIVRE:
+        raise HoldIndisponivel("Número já está reservado.")
+
+    chave = _chave_numero(rifa.id, numero)
+    if not cache.add(chave, hold_id, HOLD_TTL) and cache.get(chave) != hold_id:
+        raise HoldIndisponivel("Número já está reservado.")
+    hold["numeros"].append(numero)
+
+
+def soltar(rifa: Rifa, hold_id: str, numero: int | None = None) -> dict | None:
+    """Solta um número do hold (ou o hold inteiro, sem `numero`)."""
+    if not hold_id:
+        return None
+    with _travado(hold_id):
+        hold = ler_hold(hold_id)
+        if hold is None or hold["rifa"] != rifa.id:
+            return None
+        saindo = hold["numeros"] if numero is None else [int(numero)]
+        _apagar_numeros(rifa.id, hold_id, saindo)
+        hold["numeros"] = [n for n in hold["numeros"] if n not in saindo]
+        if not hold["numeros"]:
+            cache.delete(_chave_hold(hold_id))
+        else:
+            _gravar(hold_id, hold)
+    return _estado(hold_id, hold)
+
+
+def encerrar(hold_id: str | None) -> None:
+    """O pedido foi gravado: o hold saiu do cache e agora vale o banco."""
+    hold = ler_hold(hold_id)
+    if hold is None:
+        return
+    _apagar_numeros(hold["rifa"], hold_id, hold["numeros"])
+    cache.delete(_chave_hold(hold_id))
+
+
+# ----------------------------------------------------------------------
+def _gravar(hold_id: str, hold: dict) -> None:
+    cache.set(_chave_hold(hold_id), hold, HOLD_TTL)
+    for n in hold["numeros"]:
+        cache.touch(_chave_numero(hold["rifa"], n), HOLD_TTL)
+
+
+def _apagar_numeros(rifa_id: int, hold_id: str, numeros) -> None:
+    meus = [n for n, dono in donos(rifa_id, numeros).items() if dono == hold_id]
+    if meus:
+        cache.delete_many([_chave_numero(rifa_id, n) for n in meus])
+
+
+def _estado(hold_id: str, hold: dict) -> dict:
+    return {
+        "hold_id": hold_id,
+        "numeros": sorted(hold["numeros"]),
+        "ttl": HOLD_TTL,
+    }
@@ -0,0 +1,110 @@
+# rifas/idempotencia.py
+"""
+Idempotency-Key nos endpoints que criam pedido.
+
+Cliente em rede ruim repete o POST; sem isso cada repetição vira outro
+Pedido, outras reservas e outra cobrança. Com o header Idempotency-Key (ou
+o campo idempotency_key, no formulário do checkout rápido):
+
+- a 1ª requisição marca a chave como "em andamento" (cache.add, atômico) e,
+  se der certo (2xx), guarda a resposta por IDEMPOTENCIA_TTL;
+- repetição com a chave já respondida recebe a mesma resposta, sem tocar em
+  Numero nem na Efí (header Idempotent-Replayed: true);
+- repetição enquanto a 1ª ainda roda recebe 409;
+- mesma chave com outro corpo (outros números/quantidade) recebe 422.
+
+A chave vale por (chave, CPF, rifa): o mesmo UUID de dois clientes não
+colide. Resposta de erro não fica guardada: o cliente pode tentar de novo.
+
+Como os holds, precisa de cache compartilhado entre os workers em produção.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import cpf_normalize
+
+IDEMPOTENCIA_TTL = getattr(settings, "RIFAS_IDEMPOTENCIA_TTL", 24 * 60 * 60)
+# tempo máximo de uma criação de pedido "em andamento"
+IDEMPOTENCIA_LOCK_TTL = 60
+
+HEADER_REPLAY = "Idempotent-Replayed"
+MSG_EM_ANDAMENTO = "Este pedido ainda está sendo processado. Aguarde um instante."
+MSG_CHAVE_REUSADA = "Idempotency-Key já usada com outro pedido."
+
+
+class ChaveEmUso(Exception):
+    """A mesma chave ainda está sendo processada (409) ou veio com outro corpo (422)."""
+
+    def __init__(self, mensagem: str, status: int):
+        self.status = status
+        super().__init__(mensagem)
+
+
+def chave_da_requisicao(request, rifa_slug: str, cpf: str) -> str | None:
+    """Chave de cache da requisição, ou None se ela não mandou Idempotency-Key."""
+    bruta = (
+        request.headers.get("Idempotency-Key")
+        or (request.POST.get("idempotency_key") if request.method == "POST" else None)
+        or ""
+    ).strip()
+    if not bruta or len(bruta) > 255:
+        return None
+    base = f"{bruta}|{cpf_normalize(cpf)}|{rifa_slug}"
+    return "rifas:idem:" + hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+
+def impressao(*partes) -> str:
+    """Resumo do que foi pedido (números, quantidade, cupom...)."""
+    bruto = json.dumps(partes, sort_keys=True, default=str)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()[:32]
+
+
+def impressao_do_pedido(dados) -> str:
+    """
+    Impressão do corpo de criação de pedido, a mesma em /api/v2/pedidos/ e
+    /api/pedidos/: o front repete no endpoint legado com a mesma chave
+    quando o v2 falha, e essa repetição não pode virar 422.
+    """
+    return impressao(dados.get("numeros"), dados.get("quantidade"), dados.get("hold_id"), dados.get("cupom"))
+
+
+def comecar(chave: str | None, digital: str) -> tuple[int, dict] | None:
+    """
+    Antes de criar o pedido. Devolve a resposta guardada (status, corpo) se a
+    chave já foi respondida; None se esta requisição pode seguir (e aí a
+    chave fica "em andamento" até guardar() ou largar()).
+    """
+    if chave is None:
+        return None
+    registro = cache.get(chave)
+    if registro is None and cache.add(chave, {"andamento": True, "digital": digital}, IDEMPOTENCIA_LOCK_TTL):
+        return None
+    if registro is None:
+        registro = cache.get(chave) or {"andamento": True, "digital": digital}
+
+    if registro.get("digital") != digital:
+        raise ChaveEmUso(MSG_CHAVE_REUSADA, 422)
+    if registro.get("andamento"):
+        raise ChaveEmUso(MSG_EM_ANDAMENTO, 409)
+    return registro["status"], registro["corpo"]
+
+
+def guardar(chave: str | None, digital: str, status: int, corpo: dict) -> None:
+    """Guarda a resposta de sucesso; qualquer outra só solta a chave."""
+    if chave is None:
+        return
+    if 200 <= status < 300:
+        cache.set(chave, {"digital": digital, "status": status, "corpo": corpo}, IDEMPOTENCIA_TTL)
+    else:
+        cache.delete(chave)
+
+
+def largar(chave: str | None) -> None:
+    """A criação estourou no meio: a chave fica livre para nova tentativa."""
+    if chave is not None:
+        cache.delete(chave)
@@ -0,0 +1,108 @@
+# rifas/management/commands/bench_grade.py
+import gzip
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rifas.grade import codificar_grade, decodificar_grade, grade_binaria, cotas_da_rifa
+from rifas.models import Rifa, Numero
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara tamanho e tempo de serialização da grade JSON atual "
+        "com a grade bit-packed (?formato=bin)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--total", type=int, default=100_000, help="Qtd de números da grade sintética.")
+        parser.add_argument("--reservados", type=float, default=0.05, help="Fração reservada (0..1).")
+        parser.add_argument("--pagos", type=float, default=0.40, help="Fração paga (0..1).")
+        parser.add_argument("--cotas", type=int, default=20, help="Qtd de cotas premiadas.")
+        parser.add_argument("--repeticoes", type=int, default=5)
+        parser.add_argument("--slug", default="", help="Usa uma rifa real do banco em vez da grade sintética.")
+
+    def handle(self, *args, **opts):
+        repeticoes = max(1, opts["repeticoes"])
+
+        if opts["slug"]:
+            rifa = Rifa.objects.filter(slug=opts["slug"]).first()
+            if not rifa:
+                raise CommandError(f"Rifa '{opts['slug']}' não encontrada.")
+            linhas = list(
+                Numero.objects.filter(rifa=rifa).order_by("numero").values_list("numero", "status")
+            )
+            cotas = cotas_da_rifa(rifa)
+            total = max(int(rifa.quantidade_numeros or 0), len(linhas))
+        else:
+            total = opts["total"]
+            linhas = self._grade_sintetica(total, opts["reservados"], opts["pagos"])
+            cotas = set(random.sample(range(1, total + 1), min(opts["cotas"], total)))
+
+        ocupados = [(n, st) for n, st in linhas if st != Numero.LIVRE]
+
+        # formato atual (o que api_rifa_grade devolve hoje)
+        def _json():
+            data = [
+                {"numero": n, "status": st, "cota_premiada": n in cotas}
+                for n, st in linhas
+            ]
+            return json.dumps({"numeros": data}).encode("utf-8")
+
+        def _bin():
+            return codificar_grade(total, ocupados, cotas)
+
+        corpo_json, t_json = self._medir(_json, repeticoes)
+        corpo_bin, t_bin = self._medir(_bin, repeticoes)
+
+        # confere ida e volta antes de mostrar números
+        g = decodificar_grade(corpo_bin)
+        esperado = {n: st for n, st in linhas}
+        for idx, st in enumerate(g["status"], start=1):
+            if esperado.get(idx, Numero.LIVRE) != st:
+                raise CommandError(f"Grade binária divergente no número {idx}.")
+        if g["cotas"] != {c for c in cotas if c <= total}:
+            raise CommandError("Bitmap de cotas divergente.")
+
+        gz_json = len(gzip.compress(corpo_json))
+        gz_bin = len(gzip.compress(corpo_bin))
+
+        self.stdout.write(f"Números: {total} (ocupados: {len(ocupados)}, cotas: {len(cotas)})")
+        self.stdout.write(f"{'formato':<8} {'bytes':>12} {'gzip':>10} {'ms/serialização':>16}")
+        self.stdout.write(f"{'json':<8} {len(corpo_json):>12} {gz_json:>10} {t_json * 1000:>16.2f}")
+        self.stdout.write(f"{'bin':<8} {len(corpo_bin):>12} {gz_bin:>10} {t_bin * 1000:>16.2f}")
+        self.stdout.write(self.style.SUCCESS(
+            f"bin = {len(corpo_bin) / max(len(corpo_json), 1):.1%} do JSON; "
+            f"{t_json / max(t_bin, 1e-9):.1f}x mais rápido para serializar."
+        ))
+
+        if opts["slug"]:
+            # caminho real, incluindo a consulta ao banco
+            _, t_real = self._medir(lambda: grade_binaria(rifa), repeticoes)
+            self.stdout.write(f"grade_binaria() com banco: {t_real * 1000:.2f} ms")
+
+    # ------------------------------------------------------------------
+    def _grade_sintetica(self, total, frac_reservados, frac_pagos):
+        linhas = []
+        for n in range(1, total + 1):
+            r = random.random()
+            if r < frac_pagos:
+                st = Numero.PAGO
+            elif r < frac_pagos + frac_reservados:
+                st = Numero.RESERVADO
+            else:
+                st = Numero.LIVRE
+            linhas.append((n, st))
+        return linhas
+
+    def _medir(self, fn, repeticoes):
+        melhor = None
+        resultado = None
+        for _ in range(repeticoes):
+            ini = time.perf_counter()
+            resultado = fn()
+            dt = time.perf_counter() - ini
+            melhor = dt if melhor is None else min(melhor, dt)
+        return resultado, melhor
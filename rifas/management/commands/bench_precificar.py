@@ -0,0 +1,85 @@
+# rifas/management/commands/bench_precificar.py
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rifas import pricing
+from rifas.models import Cliente, Coupon, DiscountRule, Rifa
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede precificar() recompilando as regras a cada pedido (como antes: "
+        "consulta DiscountRule e Coupon toda vez) e com o plano compilado em "
+        "regime. Roda numa rifa temporária, dentro de uma transação desfeita "
+        "no fim."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--regras", type=int, default=20, help="DiscountRules da rifa temporária.")
+        parser.add_argument("--pedidos", type=int, default=2000)
+
+    def handle(self, *args, **opts):
+        n_regras = max(1, opts["regras"])
+        pedidos = max(1, opts["pedidos"])
+
+        with transaction.atomic():
+            agora = timezone.now()
+            rifa = Rifa.objects.create(
+                titulo="bench_precificar",
+                slug=f"bench-{uuid.uuid4().hex[:8]}",
+                preco_numero=Decimal("2.50"),
+                quantidade_numeros=10,
+                inicio_vendas=agora,
+                fim_vendas=agora,
+                grade_esparsa=True,
+            )
+            cliente, _ = Cliente.objects.get_or_create(
+                cpf_digitos="00000000000",
+                defaults={"nome": "Bench", "email": "bench@fake.local", "telefone": "-", "cpf": "00000000000"},
+            )
+            DiscountRule.objects.bulk_create([
+                DiscountRule(
+                    nome=f"bench {i}", rifa=rifa, prioridade=i % 5,
+                    qtd_numeros_min=(i % 4) * 10 or None,
+                    tipo=DiscountRule.PERCENTUAL if i % 2 else DiscountRule.VALOR,
+                    valor=Decimal("1.00"),
+                    inicio=agora - timedelta(days=1), fim=agora + timedelta(days=1),
+                )
+                for i in range(n_regras)
+            ])
+            codigo = f"BENCH{uuid.uuid4().hex[:6].upper()}"
+            Coupon.objects.create(codigo=codigo, valor=Decimal("5.00"), acumulavel=False)
+
+            resultados = []
+            for nome, recompilar in (("antes", True), ("plano", False)):
+                pricing.invalidar_precos()
+                pricing.precificar(rifa, 30, cliente, codigo)  # aquece
+                with CaptureQueriesContext(connection) as q:
+                    ini = time.perf_counter()
+                    for _ in range(pedidos):
+                        if recompilar:
+                            pricing.invalidar_precos()
+                        res = pricing.precificar(rifa, 30, cliente, codigo)
+                    dt = time.perf_counter() - ini
+                resultados.append((nome, dt / pedidos, len(q) / pedidos, res[3]))
+
+            transaction.set_rollback(True)
+        pricing.invalidar_precos()
+
+        self.stdout.write(f"{n_regras} regras + 1 cupom, {pedidos} pedidos ({connection.vendor})")
+        self.stdout.write(f"{'modo':<8} {'consultas':>10} {'µs/pedido':>12} {'total':>10}")
+        for nome, dt, consultas, total in resultados:
+            self.stdout.write(f"{nome:<8} {consultas:>10.1f} {dt * 1e6:>12.1f} {total:>10}")
+        (_, t_antes, _, total_antes), (_, t_plano, c_plano, total_plano) = resultados
+        if total_antes != total_plano:
+            self.stderr.write(f"Totais diferentes: {total_antes} x {total_plano}")
+        self.stdout.write(self.style.SUCCESS(
+            f"plano: {c_plano:.0f} consultas por pedido, {t_antes / max(t_plano, 1e-9):.1f}x mais rápido."
+        ))
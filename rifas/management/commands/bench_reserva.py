@@ -0,0 +1,113 @@
+# rifas/management/commands/bench_reserva.py
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rifas.grade import proxima_versao, registrar_transicoes, reservar_numeros
+from rifas.models import Cliente, Numero, Pedido, Rifa
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara a reserva de um pedido número a número (select_for_update + "
+        "get_or_create + save) com o UPDATE condicional de reservar_numeros(). "
+        "Roda numa rifa temporária, dentro de uma transação desfeita no fim."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--total", type=int, default=10_000, help="Qtd de números da rifa temporária.")
+        parser.add_argument("--qtd", type=int, default=100, help="Números por pedido.")
+        parser.add_argument("--repeticoes", type=int, default=5)
+
+    def handle(self, *args, **opts):
+        total = max(1, opts["total"])
+        qtd = max(1, min(opts["qtd"], total))
+        repeticoes = max(1, opts["repeticoes"])
+
+        with transaction.atomic():
+            agora = timezone.now()
+            rifa = Rifa.objects.create(
+                titulo="bench_reserva",
+                slug=f"bench-{uuid.uuid4().hex[:8]}",
+                preco_numero=Decimal("1.00"),
+                quantidade_numeros=total,
+                inicio_vendas=agora,
+                fim_vendas=agora,
+            )
+            cliente, _ = Cliente.objects.get_or_create(
+                cpf_digitos="00000000000",
+                defaults={"nome": "Bench", "email": "bench@fake.local", "telefone": "-", "cpf": "00000000000"},
+            )
+            numeros = list(range(1, qtd + 1))
+
+            resultados = []
+            for nome, fn in (("loop", self._em_loop), ("update", self._em_lote)):
+                melhor, consultas = None, 0
+                for _ in range(repeticoes):
+                    pedido = Pedido.objects.create(
+                        rifa=rifa, cliente=cliente, protocolo=uuid.uuid4().hex[:20],
+                    )
+                    with CaptureQueriesContext(connection) as q:
+                        ini = time.perf_counter()
+                        fn(rifa, numeros, pedido, cliente)
+                        dt = time.perf_counter() - ini
+                    if Numero.objects.filter(rifa=rifa, pedido=pedido).count() != qtd:
+                        raise RuntimeError(f"{nome}: reserva incompleta.")
+                    melhor = dt if melhor is None else min(melhor, dt)
+                    consultas = len(q)
+                    # devolve os números para a próxima rodada
+                    Numero.objects.filter(rifa=rifa).update(
+                        status=Numero.LIVRE, pedido=None, cliente=None, reservado_em=None, expira_em=None,
+                    )
+                resultados.append((nome, melhor, consultas))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"Pedido de {qtd} números numa rifa de {total} ({connection.vendor})")
+        self.stdout.write(f"{'modo':<8} {'consultas':>10} {'ms/pedido':>12}")
+        for nome, dt, consultas in resultados:
+            self.stdout.write(f"{nome:<8} {consultas:>10} {dt * 1000:>12.2f}")
+        (_, t_loop, c_loop), (_, t_lote, c_lote) = resultados
+        self.stdout.write(self.style.SUCCESS(
+            f"update: {c_loop / max(c_lote, 1):.0f}x menos consultas, "
+            f"{t_loop / max(t_lote, 1e-9):.1f}x mais rápido."
+        ))
+
+    # ------------------------------------------------------------------
+    def _em_loop(self, rifa, numeros, pedido, cliente):
+        """O caminho antigo do CriarPedidoView, linha por linha."""
+        with transaction.atomic():
+            now = timezone.now()
+            expira_em = rifa.vencimento_reserva(now)
+            versao = proxima_versao(rifa.id)
+            transicoes = []
+            for n in numeros:
+                num_obj, criado = Numero.objects.select_for_update().get_or_create(
+                    rifa=rifa,
+                    numero=n,
+                    defaults={
+                        "status": Numero.RESERVADO,
+                        "pedido": pedido,
+                        "cliente": cliente,
+                        "reservado_em": now,
+                        "expira_em": expira_em,
+                        "versao": versao,
+                    },
+                )
+                transicoes.append((Numero.LIVRE if criado else num_obj.status, Numero.RESERVADO, 1))
+                num_obj.status = Numero.RESERVADO
+                num_obj.pedido = pedido
+                num_obj.cliente = cliente
+                num_obj.reservado_em = now
+                num_obj.expira_em = expira_em
+                num_obj.versao = versao
+                num_obj.save()
+            registrar_transicoes(rifa.id, transicoes)
+
+    def _em_lote(self, rifa, numeros, pedido, cliente):
+        reservar_numeros(rifa, numeros, pedido, cliente)
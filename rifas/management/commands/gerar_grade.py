@@ -0,0 +1,44 @@
+# rifas/management/commands/gerar_grade.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rifas.grade import GRADE_LOTE, gerar_grade, rifas_com_grade_incompleta
+from rifas.models import Rifa
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera (ou retoma) os números que faltam das grades densas, em lotes. "
+        "O worker_reservas já faz isso aos poucos; use para completar de uma vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slug", default="", help="Só esta rifa (padrão: todas com grade incompleta).")
+        parser.add_argument("--lote", type=int, default=GRADE_LOTE, help="Números por transação.")
+
+    def handle(self, *args, **opts):
+        rifas = rifas_com_grade_incompleta()
+        if opts["slug"]:
+            if not Rifa.objects.filter(slug=opts["slug"]).exists():
+                raise CommandError(f"Rifa '{opts['slug']}' não encontrada.")
+            rifas = rifas.filter(slug=opts["slug"])
+
+        total_rifas = 0
+        for rifa in rifas:
+            total_rifas += 1
+            ini = time.perf_counter()
+            ultimo = [-1]
+
+            def progresso(ate, total, slug=rifa.slug):
+                pct = int(ate * 100 / max(total, 1))
+                if pct // 10 != ultimo[0] or ate == total:
+                    ultimo[0] = pct // 10
+                    self.stdout.write(f"{slug}: {ate}/{total} ({pct}%)")
+
+            feitos = gerar_grade(rifa.id, lote=max(1, opts["lote"]), progresso=progresso)
+            self.stdout.write(
+                f"{rifa.slug}: {feitos} números em {time.perf_counter() - ini:.1f}s"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"{total_rifas} grade(s) completada(s)."))
@@ -0,0 +1,110 @@
+# rifas/management/commands/mesclar_clientes.py
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from rifas.models import Cliente, CouponUsoCliente
+from rifas.utils import cpf_normalize
+
+# campos do cliente que o duplicado completa quando o canônico não tem
+PREENCHER = ("nome", "email", "telefone")
+VAZIOS = ("", "-", "Cliente")
+
+
+class Command(BaseCommand):
+    help = (
+        "Mescla clientes duplicados pelo CPF (o mesmo CPF gravado com e sem "
+        "máscara). O mais antigo fica; pedidos, números, cupons, afiliados e "
+        "premiações dos outros passam para ele. Roda em lotes, cada lote numa "
+        "transação, e pode ser interrompido e rodado de novo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=500, help="Duplicados por transação.")
+        parser.add_argument("--dry-run", action="store_true", help="Só conta; desfaz cada lote.")
+
+    def handle(self, *args, **opts):
+        lote = max(1, opts["lote"])
+        # toda FK que aponta para Cliente (Pedido, Numero, CouponRedemption...)
+        relacoes = [
+            (rel.related_model, rel.field.name)
+            for rel in Cliente._meta.related_objects
+            if rel.one_to_many or rel.one_to_one
+        ]
+
+        ultimo_id = 0
+        mesclados = promovidos = sem_cpf = 0
+        while True:
+            pendentes = list(
+                Cliente.objects
+                .filter(cpf_digitos__isnull=True, id__gt=ultimo_id)
+                .order_by("id")
+                .values_list("id", "cpf")[:lote]
+            )
+            if not pendentes:
+                break
+            ultimo_id = pendentes[-1][0]
+
+            with transaction.atomic():
+                m, p, s = self._mesclar_lote(pendentes, relacoes)
+                if opts["dry_run"]:
+                    transaction.set_rollback(True)
+            mesclados, promovidos, sem_cpf = mesclados + m, promovidos + p, sem_cpf + s
+            if opts["verbosity"] > 1:
+                self.stdout.write(f"até o cliente {ultimo_id}: {mesclados} mesclados")
+
+        prefixo = "[dry-run] " if opts["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefixo}{mesclados} duplicados mesclados, {promovidos} clientes ganharam a chave, "
+            f"{sem_cpf} sem CPF ficaram como estão."
+        ))
+
+    def _mesclar_lote(self, pendentes, relacoes):
+        digitos_de = {cid: cpf_normalize(cpf) for cid, cpf in pendentes}
+        canonicos = {
+            d: cid
+            for cid, d in Cliente.objects
+            .filter(cpf_digitos__in={d for d in digitos_de.values() if d})
+            .values_list("id", "cpf_digitos")
+        }
+
+        sem_cpf = promovidos = 0
+        por_canonico = defaultdict(list)
+        for cid, digitos in digitos_de.items():
+            if not digitos:
+                sem_cpf += 1
+            elif digitos not in canonicos:
+                # nenhum cliente com a chave ainda: este vira o canônico
+                Cliente.objects.filter(pk=cid).update(cpf_digitos=digitos)
+                canonicos[digitos] = cid
+                promovidos += 1
+            else:
+                por_canonico[canonicos[digitos]].append(cid)
+
+        for canon_id, dup_ids in por_canonico.items():
+            # contador de cupom é único por (cupom, cliente): soma no canônico
+            for coupon_id, usos in CouponUsoCliente.objects.filter(cliente_id__in=dup_ids).values_list(
+                "coupon_id", "usos"
+            ):
+                uso, _ = CouponUsoCliente.objects.get_or_create(coupon_id=coupon_id, cliente_id=canon_id)
+                CouponUsoCliente.objects.filter(pk=uso.pk).update(usos=F("usos") + usos)
+            CouponUsoCliente.objects.filter(cliente_id__in=dup_ids).delete()
+
+            for modelo, campo in relacoes:
+                modelo.objects.filter(**{f"{campo}__in": dup_ids}).update(**{campo: canon_id})
+
+            canon = Cliente.objects.get(pk=canon_id)
+            mudou = []
+            for dup in Cliente.objects.filter(pk__in=dup_ids).order_by("id"):
+                for attr in PREENCHER:
+                    if getattr(canon, attr) in VAZIOS and getattr(dup, attr) not in VAZIOS:
+                        setattr(canon, attr, getattr(dup, attr))
+                        mudou.append(attr)
+            if mudou:
+                Cliente.objects.filter(pk=canon_id).update(**{a: getattr(canon, a) for a in set(mudou)})
+            Cliente.objects.filter(pk__in=dup_ids).delete()
+
+        mesclados = sum(len(ids) for ids in por_canonico.values())
+        return mesclados, promovidos, sem_cpf
@@ -0,0 +1,38 @@
+# rifas/management/commands/recontar_grade.py
+from django.core.management.base import BaseCommand, CommandError
+
+from rifas.grade import contar_grade, recontar_grade
+from rifas.models import Rifa, RifaContagem
+
+
+class Command(BaseCommand):
+    help = (
+        "Refaz os contadores da grade (RifaContagem: reservados/pagos) "
+        "a partir das linhas de Numero."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--slug", default="", help="Só esta rifa (padrão: todas).")
+
+    def handle(self, *args, **opts):
+        rifas = Rifa.objects.order_by("id")
+        if opts["slug"]:
+            rifas = rifas.filter(slug=opts["slug"])
+            if not rifas.exists():
+                raise CommandError(f"Rifa '{opts['slug']}' não encontrada.")
+
+        corrigidas = 0
+        for rifa in rifas.iterator():
+            # só para o relatório: quem vale é a contagem feita com a linha travada
+            antes = RifaContagem.objects.filter(rifa=rifa).values_list("reservados", "pagos").first()
+            depois = recontar_grade(rifa.id)
+            if antes != (depois.reservados, depois.pagos):
+                corrigidas += 1
+                self.stdout.write(
+                    f"{rifa.slug}: {antes or '(sem contagem)'} -> "
+                    f"({depois.reservados}, {depois.pagos})"
+                )
+            if opts["verbosity"] > 1:
+                self.stdout.write(f"{rifa.slug}: {contar_grade(rifa)}")
+
+        self.stdout.write(self.style.SUCCESS(f"Contagens refeitas; {corrigidas} estavam erradas."))
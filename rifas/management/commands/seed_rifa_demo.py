@@ -79,8 +79,9 @@ class Command(BaseCommand):
             cpf = f"11122233{i:02d}"  # gera um cpf fake só p/ teste
             tel = f"(63) 9 8{i:03d}-000{i%10}"
             cli, _ = Cliente.objects.get_or_create(
-                cpf=cpf,
+                cpf_digitos=cpf,
                 defaults={
+                    "cpf": cpf,
                     "nome": nome,
                     "telefone": tel,
                 }
@@ -0,0 +1,86 @@
+# rifas/management/commands/stress_protocolo.py
+import multiprocessing
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from rifas.protocolo import TAMANHO, GeradorDeProtocolo, partes
+
+
+def _gerar_no_processo(args):
+    """Roda num processo filho: `threads` threads gerando `por_thread` cada."""
+    no, threads, por_thread = args
+    gerador = GeradorDeProtocolo(no)
+    saidas = [[] for _ in range(threads)]
+
+    def _thread(saida):
+        for _ in range(por_thread):
+            saida.append(gerador.novo())
+
+    ths = [threading.Thread(target=_thread, args=(s,)) for s in saidas]
+    for t in ths:
+        t.start()
+    for t in ths:
+        t.join()
+    return saidas
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga do gerador de protocolo: vários processos x várias "
+        "threads gerando ao mesmo tempo. Confere que nenhum protocolo se "
+        "repete e que cada thread recebe protocolos em ordem crescente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processos", type=int, default=4)
+        parser.add_argument("--threads", type=int, default=8, help="Threads por processo.")
+        parser.add_argument("--quantidade", type=int, default=20_000, help="Protocolos por thread.")
+        parser.add_argument(
+            "--usar-cache", action="store_true",
+            help="Cada processo reserva o nó no cache (só faz sentido com cache compartilhado). "
+                 "Sem isso, cada processo recebe um nó fixo, como com RIFAS_PROTOCOLO_NO.",
+        )
+
+    def handle(self, *args, **opts):
+        processos = max(1, opts["processos"])
+        threads = max(1, opts["threads"])
+        quantidade = max(1, opts["quantidade"])
+
+        if opts["usar_cache"]:
+            if isinstance(cache, LocMemCache) and processos > 1:
+                raise CommandError("LocMemCache não é compartilhado entre processos; use um cache de verdade.")
+            nos = [None] * processos
+        else:
+            if processos > 1024:
+                raise CommandError("No máximo 1024 processos (nós).")
+            nos = list(range(processos))
+
+        ini = time.perf_counter()
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(processos) as pool:
+            resultados = pool.map(_gerar_no_processo, [(no, threads, quantidade) for no in nos])
+        dt = time.perf_counter() - ini
+
+        total = 0
+        vistos = set()
+        for p, saidas in enumerate(resultados):
+            for t, saida in enumerate(saidas):
+                total += len(saida)
+                vistos.update(saida)
+                if saida != sorted(saida):
+                    raise CommandError(f"Processo {p}, thread {t}: protocolos fora de ordem.")
+                if any(len(x) != TAMANHO for x in saida):
+                    raise CommandError(f"Processo {p}, thread {t}: protocolo com tamanho errado.")
+
+        repetidos = total - len(vistos)
+        exemplo = resultados[0][0][0]
+        self.stdout.write(f"{processos} processos x {threads} threads x {quantidade} = {total} protocolos")
+        self.stdout.write(f"exemplo: {exemplo} {partes(exemplo)}")
+        self.stdout.write(f"tempo: {dt:.2f}s ({total / max(dt, 1e-9):,.0f}/s)")
+        if repetidos:
+            raise CommandError(f"{repetidos} protocolos repetidos!")
+        self.stdout.write(self.style.SUCCESS("Nenhum protocolo repetido; todos em ordem por thread."))
@@ -0,0 +1,56 @@
+# rifas/management/commands/worker_cobrancas.py
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rifas.tasks import cobrancas_na_fila, emitir_cobranca
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker contínuo que emite as cobranças PIX (Efí / registry) dos "
+        "pagamentos na fila. Os pedidos já foram gravados; aqui só sai a "
+        "cobrança, com novas tentativas e backoff quando o provedor falha."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--intervalo", type=float, default=1.0,
+            help="Segundos entre consultas à fila quando ela está vazia.",
+        )
+        parser.add_argument(
+            "--uma-vez", action="store_true",
+            help="Emite o que estiver na fila e sai (para cron / teste).",
+        )
+
+    def handle(self, *args, **opts):
+        intervalo = max(0.1, opts["intervalo"])
+
+        if not opts["uma_vez"]:
+            self.stdout.write(f"worker_cobrancas: fila a cada {intervalo:.1f}s (Ctrl+C para sair)")
+
+        try:
+            while True:
+                close_old_connections()
+                ids = cobrancas_na_fila()
+                for pagamento_id in ids:
+                    try:
+                        emitiu = emitir_cobranca(pagamento_id)
+                    except Exception:
+                        logger.exception("worker_cobrancas: falha no pagamento %s", pagamento_id)
+                        continue
+                    if emitiu is not None:
+                        self.stdout.write(
+                            f"pagamento {pagamento_id}: {'emitido' if emitiu else 'falhou, volta para a fila'}"
+                        )
+
+                if opts["uma_vez"]:
+                    return
+                if not ids:
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            self.stdout.write("worker_cobrancas: encerrado.")
@@ -0,0 +1,89 @@
+# rifas/management/commands/worker_reservas.py
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from rifas.grade import gerar_lote_pendente
+from rifas.tasks import FilaDeVencimentos, liberar_reservas_expiradas
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker contínuo que libera reservas vencidas. Mantém uma fila ordenada "
+        "pelo próximo vencimento de cada rifa e acorda exatamente nessa hora; "
+        "de tempos em tempos relê o banco para pegar reservas novas. Entre uma "
+        "coisa e outra gera, um lote por vez, as grades densas incompletas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--releitura", type=float, default=5.0,
+            help="Segundos entre releituras do banco atrás de reservas novas.",
+        )
+        parser.add_argument(
+            "--uma-vez", action="store_true",
+            help="Libera o que já venceu e sai (para cron / teste).",
+        )
+
+    def handle(self, *args, **opts):
+        releitura = max(0.5, opts["releitura"])
+        fila = FilaDeVencimentos()
+        proxima_releitura = 0.0
+
+        if not opts["uma_vez"]:
+            self.stdout.write(f"worker_reservas: releitura a cada {releitura:.1f}s (Ctrl+C para sair)")
+
+        try:
+            while True:
+                close_old_connections()
+                if time.monotonic() >= proxima_releitura:
+                    fila.recarregar()
+                    proxima_releitura = time.monotonic() + releitura
+
+                agora = timezone.now()
+                for rifa_id in fila.vencidas(agora):
+                    try:
+                        n, p = liberar_reservas_expiradas(rifa_id, agora)
+                    except Exception:
+                        logger.exception("worker_reservas: falha ao liberar rifa %s", rifa_id)
+                        continue
+                    if n or p:
+                        self.stdout.write(f"rifa {rifa_id}: {n} números liberados, {p} pedidos expirados")
+                    fila.recarregar(rifa_id)
+
+                # grade densa por gerar: um lote por volta, para não
+                # atrasar as reservas (no --uma-vez, tudo de uma vez)
+                gerando = self._gerar_grades(opts["uma_vez"])
+
+                if opts["uma_vez"]:
+                    return
+                if gerando:
+                    continue  # próximo lote sem dormir
+
+                # dorme até o próximo vencimento ou a próxima releitura
+                espera = proxima_releitura - time.monotonic()
+                proximo = fila.proximo()
+                if proximo is not None:
+                    espera = min(espera, (proximo - timezone.now()).total_seconds())
+                time.sleep(max(0.05, espera))
+        except KeyboardInterrupt:
+            self.stdout.write("worker_reservas: encerrado.")
+
+    def _gerar_grades(self, tudo: bool) -> bool:
+        """Gera um lote (ou tudo); True se ainda pode haver grade por gerar."""
+        while True:
+            try:
+                rifa_id = gerar_lote_pendente()
+            except Exception:
+                logger.exception("worker_reservas: falha ao gerar grade")
+                return False
+            if rifa_id is None:
+                return False
+            if not tudo:
+                return True
+            self.stdout.write(f"rifa {rifa_id}: lote da grade gerado")
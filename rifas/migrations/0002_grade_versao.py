@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='numero',
+            name='versao',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='rifa',
+            name='grade_versao',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='numero',
+            index=models.Index(fields=['rifa', 'versao'], name='rifas_numer_rifa_id_2f4b4d_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0002_grade_versao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rifa',
+            name='grade_esparsa',
+            field=models.BooleanField(default=False, help_text='Só grava no banco os números que já foram reservados/pagos. Use em rifas muito grandes.'),
+        ),
+    ]
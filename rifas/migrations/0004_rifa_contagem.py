@@ -0,0 +1,54 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def preencher_contagens(apps, schema_editor):
+    Rifa = apps.get_model("rifas", "Rifa")
+    Numero = apps.get_model("rifas", "Numero")
+    RifaContagem = apps.get_model("rifas", "RifaContagem")
+
+    por_rifa = {}
+    for rifa_id, status, qtd in (
+        Numero.objects
+        .filter(status__in=["reservado", "pago"])
+        .values_list("rifa_id", "status")
+        .annotate(qtd=models.Count("id"))
+        .order_by()
+    ):
+        por_rifa.setdefault(rifa_id, {})[status] = qtd
+
+    RifaContagem.objects.bulk_create([
+        RifaContagem(
+            rifa_id=rifa_id,
+            reservados=por_rifa.get(rifa_id, {}).get("reservado", 0),
+            pagos=por_rifa.get(rifa_id, {}).get("pago", 0),
+        )
+        for rifa_id in Rifa.objects.values_list("id", flat=True)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0003_rifa_grade_esparsa'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RifaContagem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reservados', models.IntegerField(default=0)),
+                ('pagos', models.IntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('rifa', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='contagem', to='rifas.rifa')),
+            ],
+            options={
+                'verbose_name': 'Contagem da grade',
+                'verbose_name_plural': 'Contagens da grade',
+            },
+        ),
+        migrations.RunPython(preencher_contagens, migrations.RunPython.noop),
+    ]
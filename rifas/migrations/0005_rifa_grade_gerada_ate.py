@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:38
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def marcar_grades_existentes(apps, schema_editor):
+    """Rifas densas que já existem foram geradas inteiras pelo signal antigo."""
+    Rifa = apps.get_model("rifas", "Rifa")
+    Numero = apps.get_model("rifas", "Numero")
+
+    maiores = dict(
+        Numero.objects.values("rifa_id").annotate(m=Max("numero")).values_list("rifa_id", "m")
+    )
+    for rifa in Rifa.objects.filter(grade_esparsa=False).only("id", "quantidade_numeros"):
+        ate = min(maiores.get(rifa.id) or 0, rifa.quantidade_numeros or 0)
+        if ate:
+            Rifa.objects.filter(pk=rifa.id).update(grade_gerada_ate=ate)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0004_rifa_contagem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rifa',
+            name='grade_gerada_ate',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(marcar_grades_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 05:46
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def preencher_expira_em(apps, schema_editor):
+    """Reservas abertas ganham o prazo que hoje é calculado na hora."""
+    Rifa = apps.get_model("rifas", "Rifa")
+    Numero = apps.get_model("rifas", "Numero")
+
+    abertas = Numero.objects.filter(status="reservado", reservado_em__isnull=False)
+    for rifa_id in abertas.values_list("rifa_id", flat=True).distinct():
+        minutos = Rifa.objects.filter(pk=rifa_id).values_list("minutos_expiracao_reserva", flat=True).first()
+        abertas.filter(rifa_id=rifa_id).update(
+            expira_em=F("reservado_em") + timedelta(minutes=minutos or 15)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0005_rifa_grade_gerada_ate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='numero',
+            name='expira_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='numero',
+            index=models.Index(condition=models.Q(('status', 'reservado')), fields=['expira_em'], name='numero_reserva_expira_idx'),
+        ),
+        migrations.RunPython(preencher_expira_em, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0006_numero_expira_em'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagamento',
+            name='proxima_tentativa_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pagamento',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pagamento',
+            name='ultimo_erro',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='pagamento',
+            index=models.Index(condition=models.Q(('status_provider', 'na_fila')), fields=['proxima_tentativa_em'], name='pagamento_fila_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0007_pagamento_fila'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rifa',
+            name='pedidos_por_segundo',
+            field=models.PositiveIntegerField(default=0, help_text='Pedidos admitidos por segundo nesta rifa; 0 = padrão do sistema (RIFAS_ADMISSAO_POR_SEGUNDO).'),
+        ),
+    ]
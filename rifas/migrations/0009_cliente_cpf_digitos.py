@@ -0,0 +1,47 @@
+# Generated by Django 5.2.3 on 2026-10-18 06:40
+
+import re
+
+from django.db import migrations, models
+
+
+def preencher_cpf_digitos(apps, schema_editor):
+    """
+    O cliente mais antigo de cada CPF ganha a chave; os outros (mesmo CPF
+    gravado com e sem máscara) ficam com NULL até o `mesclar_clientes`.
+    """
+    Cliente = apps.get_model("rifas", "Cliente")
+
+    vistos = set()
+    lote = []
+    for cid, cpf in Cliente.objects.order_by("id").values_list("id", "cpf").iterator(chunk_size=2000):
+        digitos = re.sub(r"\D+", "", cpf or "")
+        if not digitos or digitos in vistos:
+            continue
+        vistos.add(digitos)
+        lote.append(Cliente(id=cid, cpf_digitos=digitos))
+        if len(lote) >= 1000:
+            Cliente.objects.bulk_update(lote, ["cpf_digitos"])
+            lote = []
+    if lote:
+        Cliente.objects.bulk_update(lote, ["cpf_digitos"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0008_rifa_pedidos_por_segundo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='cpf_digitos',
+            field=models.CharField(blank=True, editable=False, max_length=14, null=True),
+        ),
+        migrations.RunPython(preencher_cpf_digitos, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cliente',
+            constraint=models.UniqueConstraint(fields=('cpf_digitos',), name='cliente_cpf_digitos_unico'),
+        ),
+    ]
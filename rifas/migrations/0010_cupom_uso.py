@@ -0,0 +1,68 @@
+# Generated by Django 5.2.3 on 2026-10-18 06:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def preencher_contadores(apps, schema_editor):
+    """
+    Os usos já gravados passam a contar: uso_cache do cupom e usos por
+    cliente. Os de pedido pago ficam confirmados; os de pedido expirado ou
+    cancelado continuam reservados e a varredura de cupons devolve.
+    """
+    Coupon = apps.get_model("rifas", "Coupon")
+    CouponRedemption = apps.get_model("rifas", "CouponRedemption")
+    CouponUsoCliente = apps.get_model("rifas", "CouponUsoCliente")
+
+    for row in CouponRedemption.objects.values("coupon_id").annotate(n=Count("id")):
+        Coupon.objects.filter(pk=row["coupon_id"]).update(uso_cache=row["n"])
+    CouponUsoCliente.objects.bulk_create(
+        [
+            CouponUsoCliente(coupon_id=row["coupon_id"], cliente_id=row["cliente_id"], usos=row["n"])
+            for row in CouponRedemption.objects.values("coupon_id", "cliente_id").annotate(n=Count("id"))
+        ],
+        batch_size=1000,
+    )
+    CouponRedemption.objects.filter(pedido__status="pago").update(status="confirmado")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rifas', '0009_cliente_cpf_digitos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CouponUsoCliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('usos', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='couponredemption',
+            name='status',
+            field=models.CharField(choices=[('reservado', 'Reservado'), ('confirmado', 'Confirmado'), ('liberado', 'Liberado')], default='reservado', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='couponredemption',
+            index=models.Index(condition=models.Q(('status', 'reservado')), fields=['status'], name='cupom_uso_reservado_idx'),
+        ),
+        migrations.AddField(
+            model_name='couponusocliente',
+            name='cliente',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usos_de_cupom', to='rifas.cliente'),
+        ),
+        migrations.AddField(
+            model_name='couponusocliente',
+            name='coupon',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usos_por_cliente', to='rifas.coupon'),
+        ),
+        migrations.AddConstraint(
+            model_name='couponusocliente',
+            constraint=models.UniqueConstraint(fields=('coupon', 'cliente'), name='cupom_uso_cliente_unico'),
+        ),
+        migrations.RunPython(preencher_contadores, migrations.RunPython.noop),
+    ]
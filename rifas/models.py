@@ -13,6 +13,8 @@ from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .utils import cpf_mask, cpf_normalize
+
 User = get_user_model()
 
 # ============================================================
@@ -360,6 +362,10 @@ class Cliente(models.Model):
     email = models.EmailField()
     telefone = models.CharField(max_length=20)
     cpf = models.CharField(max_length=14, db_index=True)  # 000.000.000-00
+    # chave canônica (só dígitos): toda busca por CPF vai por aqui, uma
+    # consulta no índice único. NULL = duplicado antigo esperando o
+    # `manage.py mesclar_clientes`.
+    cpf_digitos = models.CharField(max_length=14, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -367,10 +373,30 @@ class Cliente(models.Model):
             models.Index(fields=["cpf"]),
             models.Index(fields=["email"]),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=["cpf_digitos"], name="cliente_cpf_digitos_unico"),
+        ]
 
     def __str__(self):
         return f"{self.nome} ({self.cpf})"
 
+    def save(self, *args, **kwargs):
+        digitos = cpf_normalize(self.cpf)
+        if len(digitos) == 11:
+            self.cpf = cpf_mask(digitos)
+        # duplicado antigo (sem chave) só ganha a chave na mesclagem
+        if self._state.adding or self.cpf_digitos:
+            self.cpf_digitos = digitos or None
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def por_cpf(cls, cpf: str):
+        """Cliente do CPF (com ou sem máscara), ou None."""
+        digitos = cpf_normalize(cpf)
+        if not digitos:
+            return None
+        return cls.objects.filter(cpf_digitos=digitos).first()
+
 
 # ============================================================
 # RIFA / NÚMEROS / PRÊMIOS / SORTEIO / COTAS PREMIADAS
@@ -416,6 +442,11 @@ class Rifa(models.Model):
         default=15,
         validators=[MinValueValidator(1)],
     )
+    # sala de espera na abertura (ver rifas/admissao.py)
+    pedidos_por_segundo = models.PositiveIntegerField(
+        default=0,
+        help_text="Pedidos admitidos por segundo nesta rifa; 0 = padrão do sistema (RIFAS_ADMISSAO_POR_SEGUNDO).",
+    )
     mostrar_top_compradores = models.BooleanField(default=True)
 
     em_vendas = models.BooleanField(default=True)
@@ -457,19 +488,73 @@ class Rifa(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # versão da grade publicada: a marca d'água das mudanças de status já
+    # terminadas (ver grade.publicar_versao)
+    grade_versao = models.PositiveBigIntegerField(default=0, editable=False)
+
+    # grade esparsa: não cria 1 linha por número; número sem linha = livre
+    grade_esparsa = models.BooleanField(
+        default=False,
+        help_text="Só grava no banco os números que já foram reservados/pagos. Use em rifas muito grandes.",
+    )
+
+    # grade densa: números 1..grade_gerada_ate já têm linha em Numero.
+    # Enquanto não chega em quantidade_numeros a rifa não vende (ver grade.gerar_grade)
+    grade_gerada_ate = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         ordering = ["-created_at"]
 
+    # mantidos só por UPDATE ... F() em rifas/grade.py: um save() de edição
+    # (admin, painel) com a instância carregada antes não pode voltar o valor
+    CAMPOS_DA_GRADE = ("grade_versao", "grade_gerada_ate")
+
     def __str__(self):
         if self.empresa:
             return f"{self.titulo} — {self.empresa.nome}"
         return self.titulo
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # o signal de post_save compara para saber se a grade mudou de tamanho
+        instance._quantidade_carregada = instance.__dict__.get("quantidade_numeros")
+        return instance
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CAMPOS_DA_GRADE
+                and f.attname in self.__dict__
+            ]
+        super().save(*args, **kwargs)
+        self._quantidade_carregada = self.quantidade_numeros
+
     @property
     def em_vendas_agora(self) -> bool:
         now = timezone.now()
         return self.ativo and (self.inicio_vendas <= now <= self.fim_vendas)
 
+    def vencimento_reserva(self, a_partir=None):
+        """Numero.expira_em de uma reserva feita agora (ou em `a_partir`)."""
+        minutos = self.minutos_expiracao_reserva or 15
+        return (a_partir or timezone.now()) + timedelta(minutes=minutos)
+
+    @property
+    def grade_pronta(self) -> bool:
+        """Todos os números já existem no banco (grade esparsa está sempre pronta)."""
+        return self.grade_esparsa or self.grade_gerada_ate >= (self.quantidade_numeros or 0)
+
+    @property
+    def grade_progresso(self) -> int:
+        """Percentual (0..100) da geração da grade, para o painel."""
+        total = self.quantidade_numeros or 0
+        if self.grade_pronta or total <= 0:
+            return 100
+        return min(99, int(self.grade_gerada_ate * 100 / total))
+
     # 👇👇👇 herança dos links da empresa
     @property
     def whatsapp_suporte(self):
@@ -522,6 +607,9 @@ class Numero(models.Model):
         related_name="numeros",
     )
     reservado_em = models.DateTimeField(null=True, blank=True)
+    # prazo da reserva (reservado_em + rifa.minutos_expiracao_reserva);
+    # só tem valor enquanto status == reservado
+    expira_em = models.DateTimeField(null=True, blank=True)
     pedido = models.ForeignKey(
         "Pedido",
         null=True,
@@ -529,19 +617,32 @@ class Numero(models.Model):
         on_delete=models.SET_NULL,
         related_name="numeros",
     )
+    # versão da grade (grade.proxima_versao) da última mudança (feed ?since=)
+    versao = models.PositiveBigIntegerField(default=0, editable=False)
 
     class Meta:
         unique_together = ("rifa", "numero")
         indexes = [
             models.Index(fields=["rifa", "status"]),
             models.Index(fields=["rifa", "numero"]),
+            models.Index(fields=["rifa", "versao"]),
+            # só as reservas abertas entram: a varredura de vencidas é um range scan
+            models.Index(
+                fields=["expira_em"],
+                condition=models.Q(status="reservado"),
+                name="numero_reserva_expira_idx",
+            ),
         ]
 
     def __str__(self):
         return f"{self.rifa.slug} #{self.numero}"
 
     def expirou(self) -> bool:
-        if self.status != self.RESERVADO or not self.reservado_em:
+        if self.status != self.RESERVADO:
+            return False
+        if self.expira_em:
+            return timezone.now() >= self.expira_em
+        if not self.reservado_em:
             return False
         delta = timezone.now() - self.reservado_em
         return delta.total_seconds() > (self.rifa.minutos_expiracao_reserva * 60)
@@ -555,8 +656,10 @@ class Numero(models.Model):
         if self.status == self.PAGO:
             return
 
+        from .grade import salvar_numero  # evita import circular
+
         self.status = self.PAGO
-        self.save(update_fields=["status"])
+        salvar_numero(self, ["status"])
 
         # se esse número for cota premiada, joga na RifaPremiacao
         cota = self.rifa.cotas_premiadas.filter(numero=self.numero, ativo=True).first()
@@ -577,6 +680,33 @@ class Numero(models.Model):
                 prem.save(update_fields=["cliente"])
 
 
+# ============================================================
+# CONTAGEM DA GRADE (1:1) — livres/reservados/pagos sem COUNT(*)
+# ============================================================
+class RifaContagem(models.Model):
+    """
+    Quantos números da rifa estão reservados/pagos, mantido junto com cada
+    mudança de status (rifas/grade.py). Livres = quantidade_numeros - os dois,
+    o que vale também para a grade esparsa.
+    Se sair do prumo: python manage.py recontar_grade
+    """
+    rifa = models.OneToOneField(
+        Rifa,
+        on_delete=models.CASCADE,
+        related_name="contagem",
+    )
+    reservados = models.IntegerField(default=0)
+    pagos = models.IntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Contagem da grade"
+        verbose_name_plural = "Contagens da grade"
+
+    def __str__(self):
+        return f"{self.rifa.slug}: {self.reservados} reservados / {self.pagos} pagos"
+
+
 class CotaPremiada(models.Model):
     rifa = models.ForeignKey(
         Rifa,
@@ -764,13 +894,16 @@ class Pedido(models.Model):
 
     def liberar_numeros(self):
         from .models import Numero  # evitar circular
-        numeros = Numero.objects.filter(pedido=self)
-        for n in numeros:
-            n.status = Numero.LIVRE
-            n.pedido = None
-            n.cliente = None
-            n.reservado_em = None
-            n.save(update_fields=["status", "pedido", "cliente", "reservado_em"])
+        from .grade import atualizar_numeros
+
+        atualizar_numeros(
+            self.rifa_id,
+            Numero.objects.filter(pedido=self),
+            status=Numero.LIVRE,
+            pedido=None,
+            cliente=None,
+            reservado_em=None,
+        )
 
     def tem_numeros(self):
         return self.numeros.exists()
@@ -833,9 +966,29 @@ class Pagamento(models.Model):
         blank=True,
         null=True,
     )
+
+    # outbox da cobrança: o pedido grava o Pagamento na fila e quem fala com
+    # a Efí é o worker_cobrancas (ver tasks.emitir_cobranca)
+    NA_FILA = "na_fila"
+    FALHOU = "falhou"
+
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa_em = models.DateTimeField(null=True, blank=True)
+    ultimo_erro = models.TextField(blank=True, default="")
+
     criado_em = models.DateTimeField(auto_now_add=True)
     atualizado_em = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # só as cobranças esperando o worker
+            models.Index(
+                fields=["proxima_tentativa_em"],
+                name="pagamento_fila_idx",
+                condition=models.Q(status_provider="na_fila"),
+            ),
+        ]
+
     def __str__(self):
         return f"Pagamento {self.pedido.protocolo} ({self.provider})"
 
@@ -901,6 +1054,18 @@ class Coupon(models.Model):
 
 
 class CouponRedemption(models.Model):
+    # ciclo de vida de um uso (ver pricing.reservar_uso_cupom):
+    # reservado ao criar o pedido (já conta no limite), confirmado quando o
+    # pedido é pago, liberado (devolve o uso) quando expira ou é cancelado
+    RESERVADO = "reservado"
+    CONFIRMADO = "confirmado"
+    LIBERADO = "liberado"
+    STATUS_CHOICES = [
+        (RESERVADO, "Reservado"),
+        (CONFIRMADO, "Confirmado"),
+        (LIBERADO, "Liberado"),
+    ]
+
     coupon = models.ForeignKey(
         Coupon,
         on_delete=models.CASCADE,
@@ -917,12 +1082,50 @@ class CouponRedemption(models.Model):
         related_name="coupon_redemptions",
     )
     desconto_aplicado = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=RESERVADO)
     criado_em = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # só os usos em aberto: é o que a varredura de liberação lê
+            models.Index(
+                fields=["status"],
+                condition=models.Q(status="reservado"),
+                name="cupom_uso_reservado_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.coupon.codigo} → {self.pedido.protocolo}"
 
 
+class CouponUsoCliente(models.Model):
+    """
+    Usos de um cupom por um cliente (reservados + confirmados). Contador
+    mantido por UPDATE condicional; a validação lê uma linha pelo índice
+    único em vez de contar CouponRedemption.
+    """
+    coupon = models.ForeignKey(
+        Coupon,
+        on_delete=models.CASCADE,
+        related_name="usos_por_cliente",
+    )
+    cliente = models.ForeignKey(
+        Cliente,
+        on_delete=models.CASCADE,
+        related_name="usos_de_cupom",
+    )
+    usos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["coupon", "cliente"], name="cupom_uso_cliente_unico"),
+        ]
+
+    def __str__(self):
+        return f"{self.coupon.codigo} × {self.cliente_id}: {self.usos}"
+
+
 
 class DiscountRule(models.Model):
     PERCENTUAL, VALOR = "percentual", "valor"
@@ -38,6 +38,7 @@ from .models import (
     Pedido,
     Rifa,
     Empresa,
+    RifaContagem,
     RifaFinanceiro,
     RifaPremiacao,
     # 👇 novos
@@ -52,6 +53,10 @@ from .models import (
     Cliente,
     EfiConfig,
 )
+from .admissao import estatisticas_admissao
+from .pricing import liberar_usos_cupom
+from .utils import cpf_normalize
+from .grade import agendar_grade, atualizar_numeros, contar_grade, salvar_numero
 
 
 
@@ -152,10 +157,18 @@ def dashboard_view(request):
 
     # pode acontecer de você rodar o painel antes de migrar Numero
     try:
+        # contadores por rifa (RifaContagem), sem COUNT em Numero;
+        # livre = total - ocupados (grade esparsa não tem linha para livre)
+        somas = RifaContagem.objects.aggregate(res=Sum("reservados"), pag=Sum("pagos"))
+        total_numeros = Rifa.objects.aggregate(t=Sum("quantidade_numeros"))["t"] or 0
         numeros_status = {
-            r["status"]: r["qtd"]
-            for r in Numero.objects.values("status").annotate(qtd=Count("id"))
+            Numero.RESERVADO: somas["res"] or 0,
+            Numero.PAGO: somas["pag"] or 0,
         }
+        numeros_status[Numero.LIVRE] = max(
+            total_numeros - numeros_status[Numero.RESERVADO] - numeros_status[Numero.PAGO],
+            0,
+        )
     except Exception:
         numeros_status = {"livre": 0, "reservado": 0, "pago": 0}
 
@@ -260,16 +273,10 @@ def rifa_edit_view(request: HttpRequest, rifa_id: int):
 def _ensure_grade(rifa: Rifa):
     """
     Garante a criação dos números 1..quantidade_numeros para a rifa (não remove existentes).
+    Grade grande é gerada em segundo plano (ver grade.agendar_grade).
+    Grade esparsa não pré-cria nada (número sem linha = livre).
     """
-    existentes = set(
-        Numero.objects.filter(rifa=rifa).values_list("numero", flat=True)
-    )
-    to_create = []
-    for n in range(1, int(rifa.quantidade_numeros) + 1):
-        if n not in existentes:
-            to_create.append(Numero(rifa=rifa, numero=n, status=Numero.LIVRE))
-    if to_create:
-        Numero.objects.bulk_create(to_create, ignore_conflicts=True)
+    agendar_grade(rifa)
 
 
 # ================================================================
@@ -287,11 +294,16 @@ def pedidos_list_view(request: HttpRequest):
     if rifa_f:
         qs = qs.filter(rifa__id=rifa_f)
     if q:
-        qs = qs.filter(
+        busca = (
             Q(protocolo__icontains=q)
             | Q(cliente__nome__icontains=q)
             | Q(cliente__cpf__icontains=q)
         )
+        # CPF digitado com ou sem máscara
+        digitos = cpf_normalize(q)
+        if digitos and set(q) <= set("0123456789.- "):
+            busca |= Q(cliente__cpf_digitos__startswith=digitos)
+        qs = qs.filter(busca)
 
     rifas = Rifa.objects.order_by("titulo")
     ctx = {
@@ -324,7 +336,7 @@ def pedido_mark_paid_view(request: HttpRequest, pedido_id: int):
         p.status = Pedido.PAGO
         p.pago_em = timezone.now()
         p.save(update_fields=["status", "pago_em"])
-        p.numeros.update(status=Numero.PAGO)
+        atualizar_numeros(p.rifa_id, p.numeros.all(), status=Numero.PAGO)
         messages.success(request, "Pedido marcado como PAGO.")
     return redirect("adminx_pedido_detail", pedido_id=pedido_id)
 
@@ -337,7 +349,7 @@ def pedido_mark_paid(request: HttpRequest, pedido_id: int):
         p.status = Pedido.PAGO
         p.pago_em = timezone.now()
         p.save(update_fields=["status", "pago_em"])
-        p.numeros.update(status=Numero.PAGO)
+        atualizar_numeros(p.rifa_id, p.numeros.all(), status=Numero.PAGO)
         messages.success(request, f"Pedido {p.protocolo} marcado como PAGO.")
     return redirect("adminx_pedidos")
 
@@ -349,7 +361,9 @@ def pedido_mark_cancel(request: HttpRequest, pedido_id: int):
     if p.status != Pedido.CANCELADO:
         p.status = Pedido.CANCELADO
         p.save(update_fields=["status"])
-        p.numeros.update(
+        atualizar_numeros(
+            p.rifa_id,
+            p.numeros.all(),
             status=Numero.LIVRE,
             pedido=None,
             cliente=None,
@@ -409,7 +423,7 @@ def liberar_reservas_view(request: HttpRequest):
                 num.pedido = None
                 num.cliente = None
                 num.reservado_em = None
-                num.save(update_fields=["status", "pedido", "cliente", "reservado_em"])
+                salvar_numero(num, ["status", "pedido", "cliente", "reservado_em"])
                 n_liberados += 1
 
                 # se o pedido existir e estiver pendente e ficou sem números -> expira
@@ -430,10 +444,16 @@ def liberar_reservas_view(request: HttpRequest):
     )
     extra = vazios.update(status=Pedido.EXPIRADO)
     p_expirados += extra
+    if extra:
+        liberar_usos_cupom()
 
+    from .tasks import estatisticas_varredura
+    varreduras = estatisticas_varredura()
     messages.info(
         request,
-        f"Reservas liberadas: {n_liberados}; pedidos expirados: {p_expirados}."
+        f"Reservas liberadas: {n_liberados}; pedidos expirados: {p_expirados}. "
+        f"Varreduras por rifa: {varreduras['executadas']} feitas, "
+        f"{varreduras['coalescidas']} coalescidas."
     )
     return redirect("adminx_pedidos")
 
@@ -537,10 +557,10 @@ def rifa_detail_admin_view(request, rifa_id):
     total_configurado = rifa.quantidade_numeros or 0
     numeros_qs = Numero.objects.filter(rifa=rifa)
 
-    total_criado = numeros_qs.count()
-    pagos = numeros_qs.filter(status=Numero.PAGO).count()
-    reservados = numeros_qs.filter(status=Numero.RESERVADO).count()
-    livres = numeros_qs.filter(status=Numero.LIVRE).count()
+    contagem = contar_grade(rifa)
+    pagos = contagem["pagos"]
+    reservados = contagem["reservados"]
+    livres = contagem["livres"]
 
     # 2) últimos pedidos (SEM cancelado e SEM expirado)
     ultimos_pedidos = (
@@ -652,7 +672,7 @@ def rifa_detail_admin_view(request, rifa_id):
     # =========================================================
     pode_sortear = False
     if total_configurado > 0:
-        if total_criado == total_configurado and pagos == total_configurado:
+        if pagos == total_configurado:
             pode_sortear = True
 
     context = {
@@ -881,13 +901,13 @@ def rifa_stats_json(request: HttpRequest, rifa_id: int):
         "em_vendas": bool(getattr(rifa, "em_vendas", False)),
         "inicio_vendas": rifa.inicio_vendas.isoformat() if rifa.inicio_vendas else None,
         "fim_vendas": rifa.fim_vendas.isoformat() if rifa.fim_vendas else None,
-        "livres": Numero.objects.filter(rifa=rifa, status=Numero.LIVRE).count(),
-        "reservados": Numero.objects.filter(
-            rifa=rifa, status=Numero.RESERVADO
-        ).count(),
-        "pagos": Numero.objects.filter(rifa=rifa, status=Numero.PAGO).count(),
-        "total": Numero.objects.filter(rifa=rifa).count(),
+        **contar_grade(rifa),
+        "grade_pronta": rifa.grade_pronta,
+        "grade_gerada_ate": rifa.grade_gerada_ate,
+        "grade_progresso": rifa.grade_progresso,
         "preco_numero": str(rifa.preco_numero),
+        # sala de espera (pedidos por segundo)
+        "admissao": estatisticas_admissao(rifa.slug),
     }
     return JsonResponse(data)
 
@@ -924,7 +944,7 @@ def pedido_mark_paid_json(request: HttpRequest, pedido_id: int):
         p.status = Pedido.PAGO
         p.pago_em = timezone.now()
         p.save(update_fields=["status", "pago_em"])
-        p.numeros.update(status=Numero.PAGO)
+        atualizar_numeros(p.rifa_id, p.numeros.all(), status=Numero.PAGO)
     return JsonResponse(
         {
             "ok": True,
@@ -945,7 +965,9 @@ def pedido_mark_cancel_json(request: HttpRequest, pedido_id: int):
     if p.status != Pedido.CANCELADO:
         p.status = Pedido.CANCELADO
         p.save(update_fields=["status"])
-        p.numeros.update(
+        atualizar_numeros(
+            p.rifa_id,
+            p.numeros.all(),
             status=Numero.LIVRE,
             pedido=None,
             cliente=None,
@@ -1252,7 +1274,7 @@ def adminx_rifa_sorteador_view(request, rifa_id):
     total_configurado = rifa.quantidade_numeros or 0
 
     # quantos números pagos existem de fato
-    qtd_pagos = Numero.objects.filter(rifa=rifa, status=Numero.PAGO).count()
+    qtd_pagos = contar_grade(rifa)["pagos"]
 
     # condição para estar liberado:
     # - rifa tem quantidade configurada
@@ -1485,14 +1507,14 @@ def pedido_status_public_json(request: HttpRequest, protocolo: str):
 
         if limite_seg > 0 and diff > limite_seg:
             # EXPIRA DE VERDADE: libera números e marca o pedido
-            for num in pedido.numeros.all():
-                num.status = Numero.LIVRE
-                num.pedido = None
-                num.cliente = None
-                num.reservado_em = None
-                num.save(
-                    update_fields=["status", "pedido", "cliente", "reservado_em"]
-                )
+            atualizar_numeros(
+                pedido.rifa_id,
+                pedido.numeros.all(),
+                status=Numero.LIVRE,
+                pedido=None,
+                cliente=None,
+                reservado_em=None,
+            )
 
             pedido.status = Pedido.EXPIRADO
             pedido.save(update_fields=["status"])
@@ -1,101 +1,238 @@
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
-from django.db.models import Count, Q
-from .models import Rifa, Pedido, Coupon, CouponRedemption, DiscountRule, DiscountApplication, Cliente
+from django.db.models import Count, F, Q
+from .models import (
+    Rifa, Pedido, Coupon, CouponRedemption, CouponUsoCliente, DiscountRule, DiscountApplication, Cliente,
+)
 
-def _money(x): 
+def _money(x):
     return Decimal(x).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
-def aplicar_regras(rifa: Rifa, qtd: int, subtotal: Decimal):
-    """Aplica DiscountRules ativas, respeitando janelas/prioridade/exclusiva."""
-    now = timezone.now()
+# ================================================================
+# PLANO DE REGRAS COMPILADO (cache no processo)
+# ================================================================
+# Cada processo guarda, por rifa, as regras ativas já filtradas pela janela
+# de datas e ordenadas por prioridade, e os cupons por código. Em regime,
+# precificar() não consulta DiscountRule nem Coupon.
+#
+# Salvar/apagar DiscountRule ou Coupon (signals) incrementa PRECOS_VERSAO_KEY
+# no cache compartilhado; cada processo compara com a versão do plano e
+# recompila. O plano também vence sozinho na próxima borda de janela
+# (início ou fim de alguma regra).
+#
+# A versão só chega aos outros processos com cache compartilhado, e
+# .update() em massa (admin, shell) nem passa pelos signals: por isso plano
+# e cupom guardados também vencem em PRECOS_TTL segundos. É o atraso máximo
+# de uma mudança de preço num processo que não viu a invalidação.
+PRECOS_VERSAO_KEY = "rifas:precos:versao"
+PRECOS_TTL = getattr(settings, "RIFAS_PRECOS_TTL", 30)
+
+_planos = {}   # rifa_id -> PlanoDeRegras
+_cupons = {}   # codigo -> (versao, vence_em monotonic, Coupon | None)
+
+
+@dataclass(frozen=True)
+class RegraCompilada:
+    regra: DiscountRule
+    qtd_min: int
+    fator: Decimal | None        # percentual / 100
+    valor_fixo: Decimal | None   # desconto em R$
+
+
+@dataclass(frozen=True)
+class PlanoDeRegras:
+    versao: int
+    regras: tuple
+    valido_ate: datetime  # próxima borda de janela ou fim do PRECOS_TTL
+
+
+def versao_precos() -> int:
+    versao = cache.get(PRECOS_VERSAO_KEY)
+    if versao is None:
+        # chave nova (ou despejada): valor que nenhum processo tem guardado
+        cache.add(PRECOS_VERSAO_KEY, time.time_ns(), None)
+        versao = cache.get(PRECOS_VERSAO_KEY) or 0
+    return versao
+
+
+def invalidar_precos() -> None:
+    """Chamado pelos signals de DiscountRule/Coupon: todos os processos recompilam."""
+    try:
+        cache.incr(PRECOS_VERSAO_KEY)
+    except ValueError:
+        cache.add(PRECOS_VERSAO_KEY, time.time_ns(), None)
+    _planos.clear()
+    _cupons.clear()
+
+
+def compilar_plano(rifa_id: int, versao: int, now=None) -> PlanoDeRegras:
+    now = now or timezone.now()
     regras = (DiscountRule.objects
-              .filter(Q(rifa__isnull=True) | Q(rifa=rifa), ativo=True)
+              .filter(Q(rifa__isnull=True) | Q(rifa_id=rifa_id), ativo=True)
               .order_by("-prioridade", "-created_at"))
-    aplicado = []
-    parcial = subtotal
-
+    vigentes, bordas = [], []
     for r in regras:
-        # gatilhos
-        if r.inicio and now < r.inicio: 
+        if r.inicio and r.inicio > now:
+            bordas.append(r.inicio)
             continue
-        if r.fim and now > r.fim: 
+        if r.fim and now > r.fim:
             continue
-        if r.qtd_numeros_min and qtd < r.qtd_numeros_min:
+        if r.fim:
+            bordas.append(r.fim)
+        vigentes.append(RegraCompilada(
+            regra=r,
+            qtd_min=r.qtd_numeros_min or 0,
+            fator=r.valor / Decimal("100") if r.tipo == DiscountRule.PERCENTUAL else None,
+            valor_fixo=None if r.tipo == DiscountRule.PERCENTUAL else _money(r.valor),
+        ))
+    bordas.append(now + timedelta(seconds=PRECOS_TTL))
+    return PlanoDeRegras(versao=versao, regras=tuple(vigentes), valido_ate=min(bordas))
+
+
+def plano_de_regras(rifa: Rifa, now=None) -> PlanoDeRegras:
+    now = now or timezone.now()
+    versao = versao_precos()
+    plano = _planos.get(rifa.id)
+    if plano is None or plano.versao != versao or now >= plano.valido_ate:
+        plano = compilar_plano(rifa.id, versao, now)
+        _planos[rifa.id] = plano
+    return plano
+
+
+def _cupom_por_codigo(codigo: str):
+    """Coupon ativo do código (instância compartilhada: não altere), ou None."""
+    versao = versao_precos()
+    agora = time.monotonic()
+    guardado = _cupons.get(codigo)
+    if guardado is None or guardado[0] != versao or agora >= guardado[1]:
+        cupom = Coupon.objects.filter(codigo=codigo, ativo=True).first()
+        guardado = (versao, agora + PRECOS_TTL, cupom)
+        _cupons[codigo] = guardado
+    return guardado[2]
+
+
+# ================================================================
+# PRECIFICAÇÃO
+# ================================================================
+def _aplicar_plano(plano: PlanoDeRegras, qtd: int, subtotal: Decimal):
+    aplicado = []
+    parcial = subtotal
+
+    for c in plano.regras:
+        # gatilho (janela de datas já resolvida no plano)
+        if qtd < c.qtd_min:
             continue
 
         # benefício
-        if r.tipo == DiscountRule.PERCENTUAL:
-            desc = _money(parcial * (r.valor/Decimal("100")))
-        else:
-            desc = _money(r.valor)
-        if desc <= 0: 
+        desc = _money(parcial * c.fator) if c.fator is not None else c.valor_fixo
+        if desc <= 0:
             continue
 
-        aplicado.append((r, desc))
+        aplicado.append((c.regra, desc))
         parcial = max(_money(parcial - desc), Decimal("0.00"))
 
-        if r.exclusiva:
+        if c.regra.exclusiva:
             break
 
     total_regras = _money(sum(v for _, v in aplicado)) if aplicado else Decimal("0.00")
     return total_regras, parcial, aplicado
 
-def validar_cupom(codigo: str, rifa: Rifa, cliente: Cliente, subtotal_pos_regras: Decimal, qtd: int):
-    if not codigo: 
-        return None, Decimal("0.00")
-    codigo = codigo.strip().upper()
-    try:
-        c = Coupon.objects.get(codigo=codigo, ativo=True)
-    except Coupon.DoesNotExist:
-        return None, Decimal("0.00")
+def aplicar_regras(rifa: Rifa, qtd: int, subtotal: Decimal):
+    """Aplica DiscountRules ativas, respeitando janelas/prioridade/exclusiva."""
+    return _aplicar_plano(plano_de_regras(rifa), qtd, subtotal)
+
+def _cupom_vigente(codigo: str, rifa: Rifa):
+    """Coupon do código que vale nesta rifa agora e não esgotou, ou None (sem olhar cliente/quantidade)."""
+    if not codigo:
+        return None
+    c = _cupom_por_codigo(codigo.strip().upper())
+    if c is None:
+        return None
 
     now = timezone.now()
-    if c.inicio and now < c.inicio: 
-        return None, Decimal("0.00")
-    if c.fim and now > c.fim: 
-        return None, Decimal("0.00")
+    if c.inicio and now < c.inicio:
+        return None
+    if c.fim and now > c.fim:
+        return None
     if c.rifa_id and c.rifa_id != rifa.id:
-        return None, Decimal("0.00")
-    if subtotal_pos_regras < (c.min_compra or Decimal("0.00")):
-        return None, Decimal("0.00")
+        return None
+
+    # limite global (o contador muda a cada uso: lido na hora). Quem
+    # garante o limite é reservar_uso_cupom(); aqui só evita o desconto
+    # que já se sabe esgotado.
+    if c.max_uso_global is not None:
+        uso = Coupon.objects.filter(pk=c.pk).values_list("uso_cache", flat=True).first() or 0
+        if uso >= c.max_uso_global:
+            return None
+    return c
+
+def _cupom_elegivel(codigo: str, rifa: Rifa, cliente: Cliente, qtd: int):
+    """Coupon que vale para este cliente/rifa/quantidade agora (sem olhar o valor), ou None."""
+    c = _cupom_vigente(codigo, rifa)
+    if c is None:
+        return None
     if c.qtd_min_numeros and qtd < c.qtd_min_numeros:
-        return None, Decimal("0.00")
+        return None
     if c.so_primeira_compra and cliente.pedidos.exists():
-        return None, Decimal("0.00")
-
-    # limites de uso
-    if c.max_uso_global is not None and c.uso_cache >= c.max_uso_global:
-        return None, Decimal("0.00")
+        return None
     if c.max_uso_por_cliente is not None:
-        usos_cliente = CouponRedemption.objects.filter(coupon=c, cliente=cliente).count()
+        usos_cliente = (
+            CouponUsoCliente.objects.filter(coupon=c, cliente=cliente).values_list("usos", flat=True).first() or 0
+        )
         if usos_cliente >= c.max_uso_por_cliente:
-            return None, Decimal("0.00")
+            return None
+    return c
 
-    # calcular valor
+def _desconto_cupom(c: Coupon, base: Decimal):
+    """Desconto do cupom sobre `base`; None se a base não atinge a compra mínima."""
+    if base < (c.min_compra or Decimal("0.00")):
+        return None
     if c.tipo == Coupon.PERCENTUAL:
-        desc = _money(subtotal_pos_regras * (c.valor/Decimal("100")))
+        desc = _money(base * (c.valor/Decimal("100")))
     else:
         desc = _money(c.valor)
-    desc = min(desc, subtotal_pos_regras)  # nunca negativo
+    return min(desc, base)  # nunca negativo
 
+def validar_cupom(codigo: str, rifa: Rifa, cliente: Cliente, subtotal_pos_regras: Decimal, qtd: int):
+    c = _cupom_elegivel(codigo, rifa, cliente, qtd)
+    desc = _desconto_cupom(c, subtotal_pos_regras) if c else None
+    if desc is None:
+        return None, Decimal("0.00")
     return c, desc
 
-def precificar(rifa: Rifa, qtd: int, cliente: Cliente, cupom_codigo: str | None):
-    subtotal = _money(Decimal(qtd) * rifa.preco_numero)
-
-    # Descontos automáticos
-    desc_regras, parcial, regras_aplicadas = aplicar_regras(rifa, qtd, subtotal)
-
-    # Cupom
-    c, desc_cupom = validar_cupom(cupom_codigo, rifa, cliente, parcial, qtd)
-    if c and c.acumulavel is False and desc_regras > 0:
+def _montar_preco(subtotal: Decimal, regras: tuple, c: Coupon | None):
+    """
+    Junta regras e cupom: (desc_regras, desc_cupom, total, regras_aplicadas, cupom).
+    `regras` = o que _aplicar_plano devolveu.
+    """
+    desc_regras, parcial, regras_aplicadas = regras
+    desc_cupom = _desconto_cupom(c, parcial) if c else None
+    if desc_cupom is None:
+        c, desc_cupom = None, Decimal("0.00")
+    elif c.acumulavel is False and desc_regras > 0:
         # cupom não acumulável com regras -> ignora regras
         parcial = subtotal
         desc_regras = Decimal("0.00")
-        # recalcula cupom nesse cenário
-        c, desc_cupom = validar_cupom(cupom_codigo, rifa, cliente, parcial, qtd)
+        regras_aplicadas = []
+        desc_cupom = _desconto_cupom(c, parcial)
     total = max(_money(parcial - desc_cupom), Decimal("0.00"))
+    return desc_regras, desc_cupom, total, regras_aplicadas, c
+
+def precificar(rifa: Rifa, qtd: int, cliente: Cliente, cupom_codigo: str | None):
+    subtotal = _money(Decimal(qtd) * rifa.preco_numero)
+
+    # Descontos automáticos, depois o cupom (validado uma vez só)
+    desc_regras, desc_cupom, total, regras_aplicadas, c = _montar_preco(
+        subtotal,
+        aplicar_regras(rifa, qtd, subtotal),
+        _cupom_elegivel(cupom_codigo, rifa, cliente, qtd),
+    )
 
     breakdown = {
         "subtotal": str(subtotal),
@@ -104,3 +241,121 @@ def precificar(rifa: Rifa, qtd: int, cliente: Cliente, cupom_codigo: str | None)
         "total": str(total),
     }
     return subtotal, desc_regras, desc_cupom, total, breakdown, regras_aplicadas, c
+
+def cotar(rifa: Rifa, qtds, cupom_codigo: str | None = None) -> list[dict]:
+    """
+    Preço de várias quantidades de uma vez (botões de pacote), com as mesmas
+    regras de precificar(), um plano e uma leitura de cupom para todas, sem
+    gravar nada. Sem cliente: limite por cliente e "só primeira compra" só
+    contam na hora do pedido.
+    """
+    plano = plano_de_regras(rifa)
+    c = _cupom_vigente(cupom_codigo, rifa)
+    linhas = []
+    for qtd in qtds:
+        subtotal = _money(Decimal(qtd) * rifa.preco_numero)
+        cupom_qtd = None if c is None or (c.qtd_min_numeros and qtd < c.qtd_min_numeros) else c
+        desc_regras, desc_cupom, total, regras_aplicadas, cupom_qtd = _montar_preco(
+            subtotal, _aplicar_plano(plano, qtd, subtotal), cupom_qtd,
+        )
+        linhas.append({
+            "qtd": qtd,
+            "subtotal": str(subtotal),
+            "desc_regras": str(desc_regras),
+            "desc_cupom": str(desc_cupom),
+            "total": str(total),
+            "regras": [r.nome for r, _ in regras_aplicadas],
+            "cupom": cupom_qtd.codigo if cupom_qtd else None,
+        })
+    return linhas
+
+# ================================================================
+# USO DE CUPOM: reservar / confirmar / liberar
+# ================================================================
+# O uso conta no limite desde a criação do pedido (reservado), por UPDATE
+# condicional em Coupon.uso_cache e CouponUsoCliente.usos: numa rajada,
+# quem passa do limite não consegue a linha e o pedido volta 409. Pedido
+# pago confirma o uso; expirado ou cancelado devolve (signals + varredura).
+MSG_CUPOM_ESGOTADO = "Este cupom esgotou. Tente novamente sem o cupom."
+MSG_CUPOM_CLIENTE = "Você já usou este cupom o máximo de vezes permitido."
+
+
+class CupomEsgotado(Exception):
+    """O limite global ou por cliente do cupom acabou entre a validação e a reserva."""
+
+
+def reservar_uso_cupom(c: Coupon, pedido: Pedido, cliente: Cliente, desconto: Decimal) -> CouponRedemption:
+    """Conta um uso do cupom para o pedido (tudo ou nada) ou levanta CupomEsgotado."""
+    with transaction.atomic():
+        globais = Coupon.objects.filter(pk=c.pk)
+        if c.max_uso_global is not None:
+            globais = globais.filter(uso_cache__lt=F("max_uso_global"))
+        if not globais.update(uso_cache=F("uso_cache") + 1):
+            raise CupomEsgotado(MSG_CUPOM_ESGOTADO)
+
+        CouponUsoCliente.objects.get_or_create(coupon=c, cliente=cliente)
+        do_cliente = CouponUsoCliente.objects.filter(coupon=c, cliente=cliente)
+        if c.max_uso_por_cliente is not None:
+            do_cliente = do_cliente.filter(usos__lt=c.max_uso_por_cliente)
+        if not do_cliente.update(usos=F("usos") + 1):
+            raise CupomEsgotado(MSG_CUPOM_CLIENTE)
+
+        return CouponRedemption.objects.create(
+            coupon=c, pedido=pedido, cliente=cliente, desconto_aplicado=desconto,
+        )
+
+
+def confirmar_usos_cupom(pedido_ids) -> int:
+    """Pedidos pagos: o uso reservado fica confirmado."""
+    ids = [p for p in pedido_ids if p]
+    if not ids:
+        return 0
+    confirmados = (
+        CouponRedemption.objects
+        .filter(pedido_id__in=ids, status=CouponRedemption.RESERVADO)
+        .update(status=CouponRedemption.CONFIRMADO)
+    )
+    # pago depois de expirar: o uso já tinha sido devolvido, volta a contar
+    # (mesmo passando do limite: o cliente já pagou com o desconto)
+    devolvidos = CouponRedemption.objects.filter(pedido_id__in=ids, status=CouponRedemption.LIBERADO)
+    for rid, coupon_id, cliente_id in devolvidos.values_list("id", "coupon_id", "cliente_id"):
+        with transaction.atomic():
+            if not CouponRedemption.objects.filter(pk=rid, status=CouponRedemption.LIBERADO).update(
+                status=CouponRedemption.CONFIRMADO
+            ):
+                continue
+            Coupon.objects.filter(pk=coupon_id).update(uso_cache=F("uso_cache") + 1)
+            CouponUsoCliente.objects.filter(coupon_id=coupon_id, cliente_id=cliente_id).update(usos=F("usos") + 1)
+        confirmados += 1
+    return confirmados
+
+
+def liberar_usos_cupom(pedido_ids=None) -> int:
+    """
+    Devolve os usos reservados de pedidos expirados/cancelados (todos, ou só
+    de `pedido_ids`). Cada uso volta uma vez só: a troca de status é
+    condicional.
+    """
+    abertos = CouponRedemption.objects.filter(
+        status=CouponRedemption.RESERVADO,
+        pedido__status__in=[Pedido.EXPIRADO, Pedido.CANCELADO],
+    )
+    if pedido_ids is not None:
+        ids = [p for p in pedido_ids if p]
+        if not ids:
+            return 0
+        abertos = abertos.filter(pedido_id__in=ids)
+
+    liberados = 0
+    for rid, coupon_id, cliente_id in abertos.values_list("id", "coupon_id", "cliente_id"):
+        with transaction.atomic():
+            if not CouponRedemption.objects.filter(pk=rid, status=CouponRedemption.RESERVADO).update(
+                status=CouponRedemption.LIBERADO
+            ):
+                continue
+            Coupon.objects.filter(pk=coupon_id, uso_cache__gt=0).update(uso_cache=F("uso_cache") - 1)
+            CouponUsoCliente.objects.filter(
+                coupon_id=coupon_id, cliente_id=cliente_id, usos__gt=0,
+            ).update(usos=F("usos") - 1)
+        liberados += 1
+    return liberados
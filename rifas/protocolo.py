@@ -0,0 +1,179 @@
+# rifas/protocolo.py
+"""
+Protocolo de pedido sem colisão, em ordem de tempo (estilo snowflake).
+
+60 bits, escritos em base32 de Crockford (sem I, L, O, U) em 12 caracteres
+de largura fixa, então ordem alfabética = ordem de criação:
+
+    40 bits  milissegundos desde PROTOCOLO_EPOCA (~34 anos)
+    10 bits  nó (0..1023): um por processo gerador
+    10 bits  sequência dentro do mesmo milissegundo (1024/ms por nó)
+
+Dois processos nunca geram o mesmo protocolo porque cada um tem o seu nó:
+
+- RIFAS_PROTOCOLO_NO fixa o nó (um valor diferente por processo/máquina);
+- sem ele, o processo reserva um nó livre no cache (cache.add, com
+  arrendamento renovado enquanto ele gera). A cada NO_CONFERIR segundos o
+  processo confere com cache.get que a chave ainda tem o token dele: se
+  ela sumiu (despejo por memória, restart do cache) ele a retoma com
+  cache.add; se outro processo já pegou o nó, larga e reserva outro. Isso só vale com cache
+  compartilhado (Redis/Memcached): com LocMem dois workers podem pegar o
+  mesmo nó, então com vários workers sem REDIS_URL defina
+  RIFAS_PROTOCOLO_NO (ver rifas/checks.py).
+
+Dentro do processo um lock serializa as threads; relógio que volta para
+trás reaproveita o último milissegundo (a sequência continua) e sequência
+esgotada espera o próximo milissegundo. Depois de um fork o filho reserva
+outro nó.
+
+Os protocolos antigos (6 caracteres aleatórios) continuam valendo; só os
+novos saem daqui.
+"""
+from __future__ import annotations
+
+import os
+import random
+import secrets
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+ALFABETO = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Crockford
+
+BITS_TEMPO = 40
+BITS_NO = 10
+BITS_SEQ = 10
+TAMANHO = (BITS_TEMPO + BITS_NO + BITS_SEQ) // 5  # 12 caracteres
+
+MAX_NO = (1 << BITS_NO) - 1
+MAX_SEQ = (1 << BITS_SEQ) - 1
+
+PROTOCOLO_EPOCA = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+_EPOCA_MS = int(PROTOCOLO_EPOCA.timestamp() * 1000)
+
+NO_FIXO = getattr(settings, "RIFAS_PROTOCOLO_NO", None)
+# o nó reservado no cache vale por isso; renovado a cada terço do prazo
+NO_ARRENDAMENTO = 60 * 60
+# de quanto em quanto tempo confere que o nó ainda é deste processo
+NO_CONFERIR = 2
+
+
+def codificar(valor: int, tamanho: int = TAMANHO) -> str:
+    saida = []
+    for _ in range(tamanho):
+        saida.append(ALFABETO[valor & 31])
+        valor >>= 5
+    return "".join(reversed(saida))
+
+
+def decodificar(texto: str) -> int:
+    texto = texto.strip().upper().translate(str.maketrans("OIL", "011"))
+    valor = 0
+    for ch in texto:
+        valor = (valor << 5) | ALFABETO.index(ch)
+    return valor
+
+
+def partes(protocolo: str) -> dict:
+    """{"ms", "criado_em", "no", "seq"} de um protocolo gerado aqui."""
+    valor = decodificar(protocolo)
+    ms = valor >> (BITS_NO + BITS_SEQ)
+    return {
+        "ms": ms,
+        "criado_em": datetime.fromtimestamp((ms + _EPOCA_MS) / 1000, tz=dt_timezone.utc),
+        "no": (valor >> BITS_SEQ) & MAX_NO,
+        "seq": valor & MAX_SEQ,
+    }
+
+
+class GeradorDeProtocolo:
+    def __init__(self, no: int | None = None):
+        self._lock = threading.Lock()
+        self._no_fixo = no
+        self._no = None
+        self._dono = None
+        self._pid = None
+        self._renovar_em = 0.0
+        self._conferir_em = 0.0
+        self._ultimo_ms = -1
+        self._seq = 0
+
+    # ------------------------------------------------------------------
+    def _chave_no(self, no: int) -> str:
+        return f"rifas:protocolo:no:{no}"
+
+    def _garantir_no(self) -> int:
+        pid = os.getpid()
+        if self._pid != pid:
+            # processo novo (ou fork): nada herdado vale
+            self._pid, self._no, self._ultimo_ms, self._seq = pid, None, -1, 0
+        if self._no_fixo is not None:
+            self._no = int(self._no_fixo) & MAX_NO
+            return self._no
+
+        agora = time.monotonic()
+        if self._no is not None and agora < self._conferir_em:
+            return self._no
+        if self._no is not None and self._ainda_e_meu(self._no, agora):
+            self._conferir_em = agora + NO_CONFERIR
+            return self._no
+
+        # reserva um nó livre, começando de um ponto aleatório
+        self._dono = f"{pid}:{secrets.token_hex(8)}"
+        inicio = random.randrange(MAX_NO + 1)
+        for i in range(MAX_NO + 1):
+            no = (inicio + i) & MAX_NO
+            if cache.add(self._chave_no(no), self._dono, NO_ARRENDAMENTO):
+                self._no = no
+                self._renovar_em = agora + NO_ARRENDAMENTO / 3
+                self._conferir_em = agora + NO_CONFERIR
+                # nó novo: a sequência pode recomeçar
+                self._ultimo_ms, self._seq = -1, 0
+                return no
+        raise RuntimeError("Nenhum nó de protocolo livre; defina RIFAS_PROTOCOLO_NO.")
+
+    def _ainda_e_meu(self, no: int, agora: float) -> bool:
+        """
+        O nó ainda é deste processo? Renova o arrendamento no prazo e
+        retoma a chave se ela sumiu do cache sem ninguém ter pego o nó.
+        """
+        chave = self._chave_no(no)
+        dono = cache.get(chave)
+        if dono is None:
+            # a chave sumiu: retoma, a não ser que outro tenha pego no meio
+            if not cache.add(chave, self._dono, NO_ARRENDAMENTO):
+                return False
+        elif dono != self._dono:
+            return False  # outro processo pegou: larga o nó
+        elif agora >= self._renovar_em and not cache.touch(chave, NO_ARRENDAMENTO):
+            return False
+        if dono is None or agora >= self._renovar_em:
+            self._renovar_em = agora + NO_ARRENDAMENTO / 3
+        return True
+
+    def novo(self) -> str:
+        with self._lock:
+            no = self._garantir_no()
+            ms = max(int(time.time() * 1000) - _EPOCA_MS, self._ultimo_ms)
+            if ms == self._ultimo_ms:
+                self._seq = (self._seq + 1) & MAX_SEQ
+                if self._seq == 0:
+                    # 1024 no mesmo ms: espera o relógio andar
+                    while ms <= self._ultimo_ms:
+                        time.sleep(0.0001)
+                        ms = int(time.time() * 1000) - _EPOCA_MS
+            else:
+                self._seq = 0
+            self._ultimo_ms = ms
+            valor = (ms << (BITS_NO + BITS_SEQ)) | (no << BITS_SEQ) | self._seq
+            return codificar(valor)
+
+
+gerador = GeradorDeProtocolo(NO_FIXO)
+
+
+def novo_protocolo() -> str:
+    return gerador.novo()
@@ -1,43 +1,81 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
+from django.db import transaction
 from django.dispatch import receiver
 
 from .models import (
     Rifa,
-    Numero,
+    RifaContagem,
     RifaFinanceiro,
+    CotaPremiada,
+    Coupon,
+    DiscountRule,
+    Pedido,
 )
+from .admissao import esquecer_limite
+from .grade import agendar_grade, invalidar_snapshot
+from .pricing import confirmar_usos_cupom, invalidar_precos, liberar_usos_cupom
 
 @receiver(post_save, sender=Rifa)
 def gerar_numeros_apos_criar(sender, instance: Rifa, created, **kwargs):
     """
-    - quando a rifa é criada: gera todos os números
-    - garante que exista o registro financeiro 1:1
-    - quando a rifa é editada e aumentam a quantidade de números,
-      cria só os que faltam
+    - quando a rifa é criada: financeiro e contagem 1:1 + geração da grade
+    - quando aumentam a quantidade de números: gera só a faixa que falta,
+      a partir de grade_gerada_ate (grade.agendar_grade)
+    - rifa com grade_esparsa não ganha linha nenhuma aqui
+    - qualquer outra edição (título, datas, links...) não faz consulta nenhuma
     """
-    # 1) garantir o financeiro 1:1
-    RifaFinanceiro.objects.get_or_create(rifa=instance)
-
-    # 2) se acabou de criar, gera tudo de uma vez
     if created:
-        if instance.quantidade_numeros > 0 and not instance.numeros.exists():
-            bulk = [
-                Numero(rifa=instance, numero=i)
-                for i in range(1, instance.quantidade_numeros + 1)
-            ]
-            Numero.objects.bulk_create(bulk, batch_size=5000)
+        RifaFinanceiro.objects.get_or_create(rifa=instance)
+        # contadores da grade começam zerados (tudo livre)
+        RifaContagem.objects.get_or_create(rifa=instance)
+        if not instance.grade_esparsa:
+            agendar_grade(instance)
         return
 
-    # 3) se não foi criado (foi UPDATE), pode ter mudado a quantidade
-    qtd_atual = instance.numeros.count()
-    if instance.quantidade_numeros > qtd_atual:
-        # criar só o que falta
-        inicio = qtd_atual + 1
-        fim = instance.quantidade_numeros
-        bulk = [
-            Numero(rifa=instance, numero=i)
-            for i in range(inicio, fim + 1)
-        ]
-        Numero.objects.bulk_create(bulk, batch_size=5000)
-    # se diminuir a quantidade, NÃO apagamos os números
+    # grade densa incompleta (quantidade aumentou, virou densa, geração
+    # interrompida): agenda a faixa que falta. Pronta = zero consultas.
+    # Se diminuir a quantidade, NÃO apagamos os números
     # (melhor fazer isso manual pra não perder venda/pedido)
+    if not instance.grade_esparsa and not instance.grade_pronta:
+        agendar_grade(instance)
+
+    # limite da sala de espera fica em cache por alguns segundos
+    esquecer_limite(instance.slug)
+
+    # o total vai no snapshot da grade
+    if instance.quantidade_numeros != getattr(instance, "_quantidade_carregada", None):
+        invalidar_snapshot(instance.id)
+
+
+@receiver(post_save, sender=CotaPremiada)
+@receiver(post_delete, sender=CotaPremiada)
+def invalidar_grade_ao_mudar_cota(sender, instance: CotaPremiada, **kwargs):
+    """O bitmap de cotas vai no snapshot da grade: mudou cota, descarta o snapshot."""
+    invalidar_snapshot(instance.rifa_id)
+
+
+@receiver(post_save, sender=DiscountRule)
+@receiver(post_delete, sender=DiscountRule)
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidar_precos_ao_mudar_regra(sender, instance, **kwargs):
+    """
+    Regras e cupons ficam compilados em cada processo (pricing.plano_de_regras).
+    Só depois do commit: antes disso outro processo recompilaria o valor velho.
+    """
+    transaction.on_commit(invalidar_precos)
+
+
+@receiver(post_save, sender=Pedido)
+def acompanhar_uso_de_cupom(sender, instance: Pedido, **kwargs):
+    """
+    O uso do cupom segue o pedido: pago confirma, expirado/cancelado devolve.
+    Pedido sem cupom não faz consulta nenhuma. Quem muda status com
+    .update() cai na varredura (tasks.liberar_reservas_expiradas).
+    """
+    if not instance.desconto_cupom:
+        return
+    if instance.status == Pedido.PAGO:
+        confirmar_usos_cupom([instance.pk])
+    elif instance.status in (Pedido.EXPIRADO, Pedido.CANCELADO):
+        liberar_usos_cupom([instance.pk])
@@ -0,0 +1,175 @@
+# rifas/stream.py
+"""
+Push da grade via Server-Sent Events (precisa rodar em ASGI).
+
+Um único produtor por rifa por processo olha Rifa.grade_versao a cada
+STREAM_INTERVALO segundos e, quando ela sobe, busca o delta uma vez só
+(grade.delta_grade) e distribui para todos os assinantes conectados.
+Reserva que vence sem ninguém soltar no banco não muda a versão: o
+produtor guarda o corte (próximo vencimento, grade.marca_grade) e, quando
+ele passa, publica o delta com essas reservas já como livres.
+Ou seja: 5k visitantes na mesma rifa = 1 consulta por segundo, não 5k.
+
+O front continua com o polling de ?since= como fallback (WSGI, proxy que
+corta SSE, navegador sem EventSource...).
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, HttpResponse, Http404, StreamingHttpResponse
+
+from .grade import delta_grade, marca_grade, versao_atual
+from .models import Rifa
+
+logger = logging.getLogger(__name__)
+
+STREAM_INTERVALO = getattr(settings, "RIFAS_STREAM_INTERVALO", 1.0)
+STREAM_HEARTBEAT = getattr(settings, "RIFAS_STREAM_HEARTBEAT", 15.0)
+# conexão é encerrada depois disso; o EventSource reconecta sozinho com Last-Event-ID
+STREAM_DURACAO_MAX = getattr(settings, "RIFAS_STREAM_DURACAO_MAX", 300.0)
+STREAM_FILA_MAX = 32
+
+
+# ======================================================================
+# PRODUTOR (1 por rifa por processo)
+# ======================================================================
+class _ProdutorGrade:
+    def __init__(self, rifa_id: int, versao: int):
+        self.rifa_id = rifa_id
+        self.versao = versao
+        self.corte = None  # epoch do próximo vencimento de reserva (0 = nenhuma)
+        self.assinantes: set[asyncio.Queue] = set()
+        self.task: asyncio.Task | None = None
+
+    def assinar(self) -> asyncio.Queue:
+        fila = asyncio.Queue(maxsize=STREAM_FILA_MAX)
+        self.assinantes.add(fila)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._rodar())
+        return fila
+
+    def cancelar(self, fila: asyncio.Queue):
+        self.assinantes.discard(fila)
+
+    async def _rodar(self):
+        try:
+            while self.assinantes:
+                await asyncio.sleep(STREAM_INTERVALO)
+                if not self.assinantes:
+                    break
+                try:
+                    evento = await sync_to_async(self._buscar_mudancas)()
+                except Exception:
+                    logger.exception("stream da grade: falha ao buscar mudanças (rifa %s)", self.rifa_id)
+                    continue
+                if evento is not None:
+                    self._publicar(evento)
+        finally:
+            chave = (id(asyncio.get_running_loop()), self.rifa_id)
+            if _PRODUTORES.get(chave) is self:
+                del _PRODUTORES[chave]
+
+    def _buscar_mudancas(self) -> dict | None:
+        rifa = (
+            Rifa.objects
+            .only("id", "grade_versao", "quantidade_numeros")
+            .filter(pk=self.rifa_id)
+            .first()
+        )
+        if rifa is None:
+            return None
+        versao_atual(rifa)  # avança a marca d'água se alguma versão já fechou
+        venceu = bool(self.corte) and time.time() >= self.corte
+        if rifa.grade_versao == self.versao and not venceu:
+            if self.corte is None:
+                self.corte = marca_grade(rifa)[1]
+            return None
+        # versão nova, ou alguma reserva venceu (expiração virtual)
+        evento = delta_grade(rifa, self.versao)
+        self.versao = evento["versao"]
+        self.corte = marca_grade(rifa)[1]
+        return evento
+
+    def _publicar(self, evento: dict):
+        for fila in list(self.assinantes):
+            try:
+                fila.put_nowait(evento)
+            except asyncio.QueueFull:
+                # assinante lento: manda recarregar a grade inteira
+                while not fila.empty():
+                    fila.get_nowait()
+                fila.put_nowait({"versao": evento["versao"], "resync": True, "numeros": []})
+
+
+_PRODUTORES: dict[tuple[int, int], _ProdutorGrade] = {}
+
+
+def _produtor(rifa: Rifa) -> _ProdutorGrade:
+    chave = (id(asyncio.get_running_loop()), rifa.id)
+    prod = _PRODUTORES.get(chave)
+    if prod is None:
+        prod = _ProdutorGrade(rifa.id, rifa.grade_versao)
+        _PRODUTORES[chave] = prod
+    return prod
+
+
+# ======================================================================
+# VIEW SSE
+# ======================================================================
+def _sse(evento: dict, nome: str = "grade") -> str:
+    return f"id: {evento['versao']}\nevent: {nome}\ndata: {json.dumps(evento)}\n\n"
+
+
+async def api_rifa_grade_stream(request: HttpRequest, slug: str):
+    """
+    GET /api/rifas/<slug>/grade/stream/
+
+    Eventos "grade" com o mesmo JSON do ?since= (versao, resync, numeros).
+    Aceita Last-Event-ID (reconexão do EventSource) ou ?since= para
+    recuperar o que mudou enquanto o cliente estava desconectado.
+    """
+    if not isinstance(request, ASGIRequest):
+        # em WSGI a conexão ficaria presa num worker: o front cai no polling
+        return HttpResponse(status=204)
+
+    rifa = await Rifa.objects.filter(slug=slug, ativo=True).afirst()
+    if rifa is None:
+        raise Http404("Rifa não encontrada")
+
+    since_raw = request.headers.get("Last-Event-ID") or request.GET.get("since")
+    try:
+        since = int(since_raw) if since_raw not in (None, "") else None
+    except (TypeError, ValueError):
+        since = -1
+
+    async def eventos():
+        prod = _produtor(rifa)
+        fila = prod.assinar()
+        try:
+            yield "retry: 3000\n\n"
+            if since is not None and since != rifa.grade_versao:
+                yield _sse(await sync_to_async(delta_grade)(rifa, since))
+
+            loop = asyncio.get_running_loop()
+            fim = loop.time() + STREAM_DURACAO_MAX
+            while loop.time() < fim:
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(evento)
+        finally:
+            prod.cancelar(fila)
+
+    resp = StreamingHttpResponse(eventos(), content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"  # nginx não segura o stream
+    return resp
@@ -1,61 +1,334 @@
 # rifas/tasks.py
+import heapq
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from django.db import transaction, models
+from django.db import connection, transaction, models
+
+from .models import Numero, Pagamento, Pedido
+from .grade import atualizar_numeros
+from .pricing import liberar_usos_cupom
 
-from .models import Numero, Pedido
+logger = logging.getLogger(__name__)
 
 
-def liberar_reservas_expiradas():
+def liberar_reservas_expiradas(rifa_id: int | None = None, agora=None):
     """
-    Libera TODAS as reservas expiradas de TODAS as rifas.
-    E expira os PEDIDOS que ficaram sem nenhum número por causa disso.
+    Libera as reservas vencidas (Numero.expira_em <= agora, o mesmo corte
+    das leituras) de todas as
+    rifas, ou só de `rifa_id`, e expira os PEDIDOS pendentes que ficaram
+    sem nenhum número por causa disso.
     Retorna (qtd_numeros_liberados, qtd_pedidos_expirados)
+
+    Tudo por conjunto, pelo índice parcial de reservas abertas: um UPDATE
+    de números por rifa afetada (cada rifa precisa da sua versão da grade)
+    e um UPDATE de pedidos no fim.
     """
-    expirados_ids = []
-    pedidos_tocados = set()
+    agora = agora or timezone.now()
+    vencidos = Numero.objects.filter(status=Numero.RESERVADO, expira_em__lte=agora)
+    if rifa_id is not None:
+        vencidos = vencidos.filter(rifa_id=rifa_id)
+
+    with transaction.atomic():
+        afetados = list(vencidos.order_by().values_list("rifa_id", "pedido_id").distinct())
+        if not afetados:
+            return 0, 0
+
+        # 1) solta os números vencidos (uma versão nova da grade por rifa)
+        total_liberados = 0
+        for rid in sorted({r for r, _ in afetados}):
+            total_liberados += atualizar_numeros(
+                rid,
+                vencidos.filter(rifa_id=rid),
+                status=Numero.LIVRE,
+                cliente=None,
+                reservado_em=None,
+                pedido=None,
+            )
+
+        # 2) expira só os pedidos que perderam número agora e ficaram vazios
+        pedidos_expirados = expirar_pedidos_vazios(p for _, p in afetados)
+
+    return total_liberados, pedidos_expirados
 
-    # pega todos os números reservados
-    qs = (
-        Numero.objects
-        .select_related("rifa", "pedido")
-        .filter(status=Numero.RESERVADO)
+
+def expirar_pedidos_vazios(pedido_ids) -> int:
+    """
+    Expira os pedidos PENDENTES de `pedido_ids` que não têm mais número
+    nenhum (a reserva venceu e foi solta ou retomada por outro pedido).
+    """
+    pedidos = {p for p in pedido_ids if p}
+    if not pedidos:
+        return 0
+    expirados = (
+        Pedido.objects
+        .filter(id__in=pedidos, status=Pedido.PENDENTE)
+        .exclude(models.Exists(Numero.objects.filter(pedido=models.OuterRef("pk"))))
+        .update(status=Pedido.EXPIRADO)
     )
+    if expirados:
+        # .update() não passa pelo signal: devolve aqui o uso dos cupons
+        liberar_usos_cupom(pedidos)
+    return expirados
 
-    for n in qs:
-        # usa o método do model (já respeita rifa.minutos_expiracao_reserva)
-        if n.expirou():
-            expirados_ids.append(n.id)
-            if n.pedido_id:
-                pedidos_tocados.add(n.pedido_id)
 
-    # se não tem nada expirado, sai
-    if not expirados_ids:
-        return 0, 0
+# ======================================================================
+# VARREDURA POR RIFA (uma por vez, no máximo uma por intervalo)
+# ======================================================================
+# Com vários workers e muita gente na mesma rifa, cada request que quisesse
+# "limpar antes de ler" faria a mesma varredura ao mesmo tempo. varrer_rifa()
+# deixa passar uma só por rifa a cada VARREDURA_INTERVALO segundos (marca
+# "última varredura" no cache) e, enquanto ela roda, um lock curto no cache
+# faz os outros pularem direto para a leitura. Quem pulou não perde nada:
+# reserva vencida já é lida como livre (expiração virtual, ver grade.py) e
+# quem grava aceita retomar número com reserva vencida.
+#
+# O cache tem que ser compartilhado entre os workers para valer entre eles.
+VARREDURA_INTERVALO = getattr(settings, "RIFAS_VARREDURA_INTERVALO", 5.0)
+VARREDURA_LOCK_TTL = 30
 
-    with transaction.atomic():
-        # 1) solta os números vencidos
-        Numero.objects.filter(id__in=expirados_ids).update(
-            status=Numero.LIVRE,
-            cliente=None,
-            reservado_em=None,
-            pedido=None,
-        )
-
-        # 2) expira só os pedidos que realmente perderam número agora
-        pedidos_expirados = 0
-        if pedidos_tocados:
-            for pid in pedidos_tocados:
-                try:
-                    ped = Pedido.objects.get(id=pid)
-                except Pedido.DoesNotExist:
-                    continue
-
-                # só mexe se ainda estiver pendente
-                if ped.status == Pedido.PENDENTE:
-                    # depois de liberar os números acima, confere se o pedido ficou vazio
-                    if ped.numeros.count() == 0:
-                        ped.status = Pedido.EXPIRADO
-                        ped.save(update_fields=["status"])
-                        pedidos_expirados += 1
-
-    return len(expirados_ids), pedidos_expirados
+
+def _varredura_ultima_key(rifa_id: int) -> str:
+    return f"rifas:varredura:ultima:{rifa_id}"
+
+
+def _varredura_lock_key(rifa_id: int) -> str:
+    return f"rifas:varredura:lock:{rifa_id}"
+
+
+def _varredura_stat_key(nome: str) -> str:
+    return f"rifas:varredura:stats:{nome}"
+
+
+def _contar_varredura(nome: str) -> None:
+    chave = _varredura_stat_key(nome)
+    try:
+        cache.incr(chave)
+    except ValueError:
+        # primeira vez (ou o cache despejou a chave)
+        if not cache.add(chave, 1, None):
+            cache.incr(chave)
+
+
+def estatisticas_varredura() -> dict:
+    """{"executadas": n, "coalescidas": n} desde que o cache subiu."""
+    nomes = ("executadas", "coalescidas")
+    valores = cache.get_many([_varredura_stat_key(n) for n in nomes])
+    return {n: int(valores.get(_varredura_stat_key(n)) or 0) for n in nomes}
+
+
+def varrer_rifa(rifa_id: int, agora=None) -> bool:
+    """
+    Libera as reservas vencidas de uma rifa, a não ser que outra varredura
+    dela esteja rodando ou tenha rodado há menos de VARREDURA_INTERVALO.
+    Retorna True se varreu, False se foi coalescida com outra.
+    """
+    ultima = cache.get(_varredura_ultima_key(rifa_id))
+    if ultima is not None and time.time() - ultima < VARREDURA_INTERVALO:
+        _contar_varredura("coalescidas")
+        return False
+
+    lock = _varredura_lock_key(rifa_id)
+    if not cache.add(lock, 1, VARREDURA_LOCK_TTL):
+        _contar_varredura("coalescidas")
+        return False
+
+    try:
+        liberar_reservas_expiradas(rifa_id, agora)
+        cache.set(_varredura_ultima_key(rifa_id), time.time(), max(1, int(VARREDURA_INTERVALO) + 1))
+        _contar_varredura("executadas")
+    finally:
+        cache.delete(lock)
+    return True
+
+
+# ======================================================================
+# FILA DE VENCIMENTOS (worker_reservas)
+# ======================================================================
+def vencimentos_pendentes(rifa_id: int | None = None):
+    """[(vencimento, rifa_id)] da reserva aberta que vence primeiro em cada rifa."""
+    qs = Numero.objects.filter(status=Numero.RESERVADO, expira_em__isnull=False)
+    if rifa_id is not None:
+        qs = qs.filter(rifa_id=rifa_id)
+    linhas = qs.order_by().values("rifa_id").annotate(primeira=models.Min("expira_em"))
+    return [(l["primeira"], l["rifa_id"]) for l in linhas]
+
+
+class FilaDeVencimentos:
+    """
+    Heap (vencimento, rifa_id) com o próximo vencimento de reserva de cada
+    rifa. Reagendar uma rifa só empilha de novo; a entrada velha é ignorada
+    quando sai do heap (não bate com self._agendado).
+    """
+
+    def __init__(self):
+        self._heap: list = []
+        self._agendado: dict[int, object] = {}
+
+    def __len__(self):
+        return len(self._agendado)
+
+    def agendar(self, vencimento, rifa_id: int) -> None:
+        atual = self._agendado.get(rifa_id)
+        if atual is not None and atual <= vencimento:
+            return
+        self._agendado[rifa_id] = vencimento
+        heapq.heappush(self._heap, (vencimento, rifa_id))
+
+    def recarregar(self, rifa_id: int | None = None) -> None:
+        """Lê do banco os vencimentos (de todas as rifas ou de uma)."""
+        if rifa_id is not None:
+            self._agendado.pop(rifa_id, None)
+        for vencimento, rid in vencimentos_pendentes(rifa_id):
+            self.agendar(vencimento, rid)
+
+    def proximo(self):
+        """Próximo vencimento válido (ou None com a fila vazia)."""
+        while self._heap:
+            vencimento, rifa_id = self._heap[0]
+            if self._agendado.get(rifa_id) == vencimento:
+                return vencimento
+            heapq.heappop(self._heap)
+        return None
+
+    def vencidas(self, agora) -> list[int]:
+        """Tira da fila e devolve as rifas com vencimento <= agora."""
+        rifas = []
+        while (vencimento := self.proximo()) is not None and vencimento <= agora:
+            _, rifa_id = heapq.heappop(self._heap)
+            del self._agendado[rifa_id]
+            rifas.append(rifa_id)
+        return rifas
+
+
+# ======================================================================
+# COBRANÇA (outbox do pagamento)
+# ======================================================================
+# O pedido só grava um Pagamento "na_fila" na mesma transação dos números e
+# responde; a cobrança na Efí (token, cob, QR, com timeouts e fallback de
+# certificado) sai depois do commit, sem lock nenhum segurado. O cliente
+# recebe o PIX pelo polling do status do pedido.
+#
+# Quem emite: uma thread disparada no commit (RIFAS_COBRANCA_EM_THREAD) e o
+# worker_cobrancas, que pega o que ficou para trás e as novas tentativas.
+COBRANCA_EM_THREAD = getattr(settings, "RIFAS_COBRANCA_EM_THREAD", True)
+COBRANCA_TENTATIVAS = getattr(settings, "RIFAS_COBRANCA_TENTATIVAS", 5)
+# quem pegou a cobrança tem esse tempo antes de outro poder tentar de novo.
+# Pior caso da Efí: token, cob (PUT e GET) e QR, cada um sem e com
+# certificado = 8 requests de 20s de timeout (160s). Se mesmo assim estourar,
+# o txid fixo do pagamento faz a outra tentativa cair na mesma cob.
+COBRANCA_LEASE = timedelta(seconds=getattr(settings, "RIFAS_COBRANCA_LEASE", 300))
+
+
+def enfileirar_cobranca(pedido: Pedido) -> Pagamento:
+    """Cria o Pagamento na fila. Tem que rodar na transação do pedido."""
+    pagamento = Pagamento.objects.create(
+        pedido=pedido,
+        provider="pending",
+        status_provider=Pagamento.NA_FILA,
+        proxima_tentativa_em=timezone.now(),
+    )
+    if COBRANCA_EM_THREAD:
+        pagamento_id = pagamento.id
+        transaction.on_commit(lambda: _emitir_em_thread(pagamento_id))
+    return pagamento
+
+
+def cobrancas_na_fila(agora=None, limite: int = 100) -> list[int]:
+    """Ids dos pagamentos na fila cuja vez já chegou."""
+    agora = agora or timezone.now()
+    return list(
+        Pagamento.objects
+        .filter(status_provider=Pagamento.NA_FILA, proxima_tentativa_em__lte=agora)
+        .order_by("proxima_tentativa_em")
+        .values_list("id", flat=True)[:limite]
+    )
+
+
+def emitir_cobranca(pagamento_id: int, agora=None) -> bool | None:
+    """
+    Cria a cobrança (Efí; sem Efí, o registry local) de um pagamento na
+    fila. Depois que uma cob foi pedida à Efí o pagamento fica nela: as
+    novas tentativas repetem o mesmo txid e o registry não entra mais (seria
+    uma segunda cobrança do mesmo pedido). Retorna True se emitiu, False se falhou (volta para
+    a fila com backoff, ou FALHOU depois de COBRANCA_TENTATIVAS) e None se
+    não era a vez dele ou outro worker já pegou.
+    """
+    agora = agora or timezone.now()
+    # pega a cobrança com um UPDATE condicional: dois workers não emitem a mesma
+    pegou = Pagamento.objects.filter(
+        pk=pagamento_id,
+        status_provider=Pagamento.NA_FILA,
+        proxima_tentativa_em__lte=agora,
+    ).update(
+        proxima_tentativa_em=agora + COBRANCA_LEASE,
+        tentativas=models.F("tentativas") + 1,
+    )
+    if not pegou:
+        return None
+
+    pagamento = Pagamento.objects.select_related("pedido__rifa").get(pk=pagamento_id)
+    pedido = pagamento.pedido
+    if pedido.status != Pedido.PENDENTE:
+        _falhar_cobranca(pagamento, "pedido não está mais pendente", definitivo=True)
+        return False
+
+    # as funções da Efí/registry moram na api_public (que importa este módulo)
+    from .api_public import _criar_cobranca_efi_e_salvar, _criar_pagamento_registry, _efi_disponivel
+
+    erro = ""
+    try:
+        if pagamento.provider == "efi" or _efi_disponivel(pedido.rifa):
+            dados = _criar_cobranca_efi_e_salvar(pedido, pagamento, pedido.rifa, pedido.total)
+            if dados and dados.get("ok"):
+                return True
+            if pagamento.provider == "efi":
+                # a cob pode existir: tenta de novo só na Efí, com o mesmo txid
+                _falhar_cobranca(pagamento, "erro ao criar cobrança EFI")
+                return False
+            erro = "EFI sem credencial ou sem token"
+        dados, erro_registry = _criar_pagamento_registry(pedido, pagamento)
+        if dados and dados.get("ok"):
+            return True
+        erro = "; ".join(e for e in (erro, erro_registry) if e)
+    except Exception as exc:
+        logger.exception("cobrança do pagamento %s falhou", pagamento_id)
+        erro = str(exc)
+
+    _falhar_cobranca(pagamento, erro or "sem provedor de pagamento")
+    return False
+
+
+def _falhar_cobranca(pagamento: Pagamento, erro: str, definitivo: bool = False) -> None:
+    tentativas = Pagamento.objects.filter(pk=pagamento.pk).values_list("tentativas", flat=True).get()
+    if definitivo or tentativas >= COBRANCA_TENTATIVAS:
+        campos = {"status_provider": Pagamento.FALHOU, "proxima_tentativa_em": None}
+    else:
+        espera = timedelta(seconds=5 * 2 ** (tentativas - 1))  # 5s, 10s, 20s...
+        campos = {"status_provider": Pagamento.NA_FILA, "proxima_tentativa_em": timezone.now() + espera}
+    Pagamento.objects.filter(pk=pagamento.pk).update(
+        ultimo_erro=erro[:2000], atualizado_em=timezone.now(), **campos
+    )
+
+
+def _emitir_em_thread(pagamento_id: int) -> None:
+    threading.Thread(
+        target=_rodar_emissao,
+        args=(pagamento_id,),
+        name=f"cobranca-{pagamento_id}",
+        daemon=True,
+    ).start()
+
+
+def _rodar_emissao(pagamento_id: int) -> None:
+    try:
+        emitir_cobranca(pagamento_id)
+    except Exception:
+        logger.exception("cobrança %s falhou na thread; o worker_cobrancas tenta de novo", pagamento_id)
+    finally:
+        connection.close()  # conexão desta thread
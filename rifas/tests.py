@@ -1,3 +1,1527 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import admissao, grade, holds, idempotencia, pricing, protocolo, stream, tasks
+from .grade import (
+    NumerosIndisponiveis,
+    atualizar_numeros,
+    codificar_grade,
+    contar_grade,
+    decodificar_grade,
+    fechar_versao,
+    proxima_versao,
+    recontar_grade,
+    reservar_numeros,
+    salvar_numero,
+    versao_atual,
+)
+from .models import (
+    Cliente,
+    Coupon,
+    CouponRedemption,
+    CouponUsoCliente,
+    DiscountRule,
+    Numero,
+    Pedido,
+    Rifa,
+    RifaContagem,
+)
+from .pricing import CupomEsgotado, reservar_uso_cupom
+from .protocolo import ALFABETO, TAMANHO, GeradorDeProtocolo, partes
+from .tasks import FilaDeVencimentos, liberar_reservas_expiradas
+
+
+def _rifa(quantidade=50, **kw):
+    agora = timezone.now()
+    kw.setdefault("slug", f"rifa-{Rifa.objects.count() + 1}")
+    kw.setdefault("grade_esparsa", True)
+    return Rifa.objects.create(
+        titulo="Rifa de teste",
+        preco_numero=Decimal("2.00"),
+        quantidade_numeros=quantidade,
+        inicio_vendas=agora - timedelta(days=1),
+        fim_vendas=agora + timedelta(days=1),
+        **kw,
+    )
+
+
+def _cliente(cpf):
+    return Cliente.objects.create(nome="Cliente", email=f"{cpf}@fake.local", telefone="-", cpf=cpf)
+
+
+def _pedido(rifa, cliente, protocolo, **kw):
+    return Pedido.objects.create(rifa=rifa, cliente=cliente, protocolo=protocolo, **kw)
+
+
+# ======================================================================
+# RESERVA EM LOTE (grade.reservar_numeros)
+# ======================================================================
+class ReservarNumerosTests(TestCase):
+    def setUp(self):
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+        self.bia = _cliente("22222222222")
+
+    def _reservados(self):
+        # rifa relida: a contagem fica em cache na instância
+        return contar_grade(Rifa.objects.get(pk=self.rifa.pk))["reservados"]
+
+    def test_reserva_tudo_e_conta(self):
+        pedido = _pedido(self.rifa, self.ana, "P1")
+        self.assertEqual(reservar_numeros(self.rifa, [3, 1, 2], pedido, self.ana), set())
+
+        reservados = Numero.objects.filter(rifa=self.rifa, status=Numero.RESERVADO, pedido=pedido)
+        self.assertEqual(sorted(reservados.values_list("numero", flat=True)), [1, 2, 3])
+        self.assertEqual(self._reservados(), 3)
+
+    def test_conflito_nao_reserva_nada(self):
+        primeiro = _pedido(self.rifa, self.ana, "P1")
+        reservar_numeros(self.rifa, [5], primeiro, self.ana)
+
+        segundo = _pedido(self.rifa, self.bia, "P2")
+        with self.assertRaises(NumerosIndisponiveis) as ctx:
+            reservar_numeros(self.rifa, [4, 5, 6], segundo, self.bia)
+
+        self.assertEqual(ctx.exception.numero, 5)
+        self.assertEqual(ctx.exception.todos, [5])
+        # tudo ou nada: 4 e 6 continuam livres
+        self.assertFalse(Numero.objects.filter(pedido=segundo).exists())
+        self.assertEqual(Numero.objects.get(rifa=self.rifa, numero=5).pedido, primeiro)
+        self.assertEqual(self._reservados(), 1)
+
+    def test_fora_do_intervalo(self):
+        pedido = _pedido(self.rifa, self.ana, "P1")
+        with self.assertRaises(NumerosIndisponiveis) as ctx:
+            reservar_numeros(self.rifa, [51], pedido, self.ana)
+        self.assertEqual(ctx.exception.numero, 51)
+
+    def test_retoma_reserva_vencida(self):
+        antigo = _pedido(self.rifa, self.ana, "P1")
+        ha_uma_hora = timezone.now() - timedelta(hours=1)
+        reservar_numeros(self.rifa, [7, 8], antigo, self.ana, agora=ha_uma_hora)
+
+        novo = _pedido(self.rifa, self.bia, "P2")
+        retomados = reservar_numeros(self.rifa, [8, 9], novo, self.bia)
+
+        self.assertEqual(retomados, {antigo.id})
+        n8 = Numero.objects.get(rifa=self.rifa, numero=8)
+        self.assertEqual((n8.pedido_id, n8.cliente_id), (novo.id, self.bia.id))
+        self.assertGreater(n8.expira_em, timezone.now())
+        self.assertEqual(Numero.objects.get(rifa=self.rifa, numero=7).pedido, antigo)
+        # 8 retomado não conta duas vezes; 7 venceu e já conta como livre
+        self.assertEqual(self._reservados(), 2)
+
+    def test_reserva_no_prazo_nao_e_retomada(self):
+        antigo = _pedido(self.rifa, self.ana, "P1")
+        reservar_numeros(self.rifa, [7], antigo, self.ana, agora=timezone.now() - timedelta(minutes=1))
+
+        novo = _pedido(self.rifa, self.bia, "P2")
+        with self.assertRaises(NumerosIndisponiveis):
+            reservar_numeros(self.rifa, [7], novo, self.bia)
+
+
+# ======================================================================
+# VERSÃO DA GRADE (contador no cache + marca d'água)
+# ======================================================================
+class VersaoGradeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+
+    def _publicada(self):
+        return Rifa.objects.values_list("grade_versao", flat=True).get(pk=self.rifa.pk)
+
+    def test_versao_nao_trava_a_rifa(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            versao = proxima_versao(self.rifa.id)
+        # até o commit a linha da rifa nem é tocada
+        self.assertEqual(self._publicada(), 0)
+        for cb in callbacks:
+            cb()
+        self.assertEqual(self._publicada(), versao)
+
+    def test_marca_espera_a_versao_mais_antiga_aberta(self):
+        v1 = proxima_versao(self.rifa.id)
+        v2 = proxima_versao(self.rifa.id)
+        self.assertEqual(v2, v1 + 1)
+
+        # v2 commitou antes de v1: a marca não pode passar de v1
+        self.assertEqual(fechar_versao(self.rifa.id, v2), v1 - 1)
+        self.assertEqual(self._publicada(), v1 - 1)
+        self.assertEqual(fechar_versao(self.rifa.id, v1), v2)
+        self.assertEqual(self._publicada(), v2)
+
+    def test_versao_aberta_vence_no_ttl(self):
+        with mock.patch.object(grade, "VERSAO_ABERTA_TTL", 1):
+            v1 = proxima_versao(self.rifa.id)
+        v2 = proxima_versao(self.rifa.id)
+        fechar_versao(self.rifa.id, v2)
+        self.assertEqual(self._publicada(), v1 - 1)
+
+        # v1 foi desfeita sem avisar: passado o TTL a marca anda
+        time.sleep(1.1)
+        self.assertEqual(versao_atual(Rifa.objects.get(pk=self.rifa.pk)), v2)
+
+    def test_reserva_desfeita_fecha_a_versao(self):
+        ana = _cliente("11111111111")
+        reservar_numeros(self.rifa, [1], _pedido(self.rifa, ana, "P1"), ana)
+        with self.assertRaises(NumerosIndisponiveis):
+            reservar_numeros(self.rifa, [1], _pedido(self.rifa, ana, "P2"), ana)
+        v3 = proxima_versao(self.rifa.id)
+        # só a 1ª reserva (nunca commitada aqui) segura a marca
+        fechar_versao(self.rifa.id, v3 - 2)
+        self.assertEqual(fechar_versao(self.rifa.id, v3), v3)
+
+    def test_contador_perdido_nao_repete_versao(self):
+        v1 = proxima_versao(self.rifa.id)
+        Numero.objects.create(rifa=self.rifa, numero=1, versao=v1)
+        cache.delete(grade._versao_key(self.rifa.id))
+        self.assertGreater(proxima_versao(self.rifa.id), v1)
+
+
+# ======================================================================
+# CONTADORES (RifaContagem)
+# ======================================================================
+class ContagemTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+
+    def _real(self):
+        por_status = {Numero.RESERVADO: 0, Numero.PAGO: 0}
+        for st in Numero.objects.filter(rifa=self.rifa).values_list("status", flat=True):
+            if st in por_status:
+                por_status[st] += 1
+        return por_status[Numero.RESERVADO], por_status[Numero.PAGO]
+
+    def _contagem(self):
+        return RifaContagem.objects.values_list("reservados", "pagos").get(rifa=self.rifa)
+
+    def test_contagem_acompanha_as_transicoes(self):
+        p1 = _pedido(self.rifa, self.ana, "P1")
+        reservar_numeros(self.rifa, [1, 2, 3], p1, self.ana)
+        self.assertEqual(self._contagem(), self._real())
+
+        atualizar_numeros(self.rifa.id, p1.numeros.filter(numero__in=[1, 2]), status=Numero.PAGO)
+        self.assertEqual(self._contagem(), (1, 2))
+
+        p2 = _pedido(self.rifa, self.ana, "P2")
+        reservar_numeros(self.rifa, [4, 5], p2, self.ana, agora=timezone.now() - timedelta(hours=1))
+        # retomar a vencida não conta de novo
+        reservar_numeros(self.rifa, [5, 6], _pedido(self.rifa, self.ana, "P3"), self.ana)
+        self.assertEqual(self._contagem(), self._real())
+
+        liberar_reservas_expiradas(self.rifa.id)
+        p2.liberar_numeros()
+        numero = Numero.objects.get(rifa=self.rifa, numero=1)
+        numero.status = Numero.LIVRE
+        salvar_numero(numero, ["status"])
+        self.assertEqual(self._contagem(), self._real())
+        self.assertEqual(self._real(), (3, 1))
+
+    def test_recontar_corrige_contagem_fora_do_prumo(self):
+        reservar_numeros(self.rifa, [1, 2], _pedido(self.rifa, self.ana, "P1"), self.ana)
+        RifaContagem.objects.filter(rifa=self.rifa).update(reservados=40, pagos=7)
+
+        contagem = recontar_grade(self.rifa.id)
+        self.assertEqual((contagem.reservados, contagem.pagos), (2, 0))
+        self.assertEqual(self._contagem(), (2, 0))
+
+    def test_recontar_cria_a_contagem(self):
+        reservar_numeros(self.rifa, [1], _pedido(self.rifa, self.ana, "P1"), self.ana)
+        RifaContagem.objects.filter(rifa=self.rifa).delete()
+        recontar_grade(self.rifa.id)
+        self.assertEqual(self._contagem(), (1, 0))
+
+
+# ======================================================================
+# GERAÇÃO DA GRADE DENSA (agendar_grade + worker_reservas)
+# ======================================================================
+class GeracaoGradeTests(TestCase):
+    def _gerados(self, rifa):
+        return Numero.objects.filter(rifa=rifa).count()
+
+    def test_grade_pequena_sai_no_request(self):
+        rifa = _rifa(30, grade_esparsa=False)
+        self.assertTrue(Rifa.objects.get(pk=rifa.pk).grade_pronta)
+        self.assertEqual(self._gerados(rifa), 30)
+
+    @mock.patch.object(grade, "GRADE_SINCRONA_ATE", 10)
+    def test_grade_grande_fica_para_o_worker(self):
+        threads = threading.active_count()
+        rifa = _rifa(50, grade_esparsa=False)
+
+        # nada de thread no worker web: a rifa espera o worker_reservas
+        self.assertEqual(threading.active_count(), threads)
+        self.assertFalse(Rifa.objects.get(pk=rifa.pk).grade_pronta)
+        self.assertEqual(list(grade.rifas_com_grade_incompleta()), [rifa])
+
+        # um lote por volta, retomando de grade_gerada_ate
+        self.assertEqual(grade.gerar_lote_pendente(lote=20), rifa.id)
+        self.assertEqual(Rifa.objects.get(pk=rifa.pk).grade_gerada_ate, 20)
+        grade.gerar_lote_pendente(lote=20)
+        self.assertEqual(self._gerados(rifa), 40)
+
+        call_command("worker_reservas", "--uma-vez", stdout=StringIO())
+        self.assertTrue(Rifa.objects.get(pk=rifa.pk).grade_pronta)
+        self.assertEqual(self._gerados(rifa), 50)
+        self.assertIsNone(grade.gerar_lote_pendente())
+
+
+# ======================================================================
+# WORKER DE RESERVAS (FilaDeVencimentos + worker_reservas)
+# ======================================================================
+class WorkerReservasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+
+    def _reservar(self, rifa, numeros, protocolo, **kw):
+        pedido = _pedido(rifa, self.ana, protocolo)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(rifa, numeros, pedido, self.ana, **kw)
+        return pedido
+
+    def test_fila_acorda_no_vencimento_mais_proximo(self):
+        agora = timezone.now()
+        fila = FilaDeVencimentos()
+        fila.agendar(agora + timedelta(seconds=10), 1)
+        fila.agendar(agora + timedelta(seconds=5), 2)
+        fila.agendar(agora + timedelta(seconds=2), 1)   # adianta a rifa 1
+        fila.agendar(agora + timedelta(seconds=20), 2)  # mais tarde: ignorado
+        self.assertEqual(len(fila), 2)
+        self.assertEqual(fila.proximo(), agora + timedelta(seconds=2))
+
+        self.assertEqual(fila.vencidas(agora), [])
+        self.assertEqual(fila.vencidas(agora + timedelta(seconds=3)), [1])
+        self.assertEqual(fila.proximo(), agora + timedelta(seconds=5))
+        self.assertEqual(fila.vencidas(agora + timedelta(seconds=30)), [2])
+        self.assertIsNone(fila.proximo())
+
+    def test_recarregar_le_o_primeiro_vencimento_de_cada_rifa(self):
+        outra = _rifa()
+        self._reservar(self.rifa, [1], "P1")
+        self._reservar(self.rifa, [2], "P2", agora=timezone.now() - timedelta(minutes=5))
+        self._reservar(outra, [1], "P3")
+
+        fila = FilaDeVencimentos()
+        fila.recarregar()
+        self.assertEqual(len(fila), 2)
+        primeiro = Numero.objects.get(rifa=self.rifa, numero=2).expira_em
+        self.assertEqual(fila.proximo(), primeiro)
+        self.assertEqual(fila.vencidas(primeiro), [self.rifa.id])
+
+    def test_uma_vez_libera_e_expira_os_pedidos_vazios(self):
+        vencido = self._reservar(self.rifa, [3, 4], "P1", agora=timezone.now() - timedelta(hours=1))
+        no_prazo = self._reservar(self.rifa, [5], "P2")
+
+        saida = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("worker_reservas", "--uma-vez", stdout=saida)
+
+        self.assertIn("2 números liberados, 1 pedidos expirados", saida.getvalue())
+        self.assertEqual(Pedido.objects.get(pk=vencido.pk).status, Pedido.EXPIRADO)
+        self.assertEqual(Pedido.objects.get(pk=no_prazo.pk).status, Pedido.PENDENTE)
+        self.assertEqual(
+            dict(Numero.objects.filter(rifa=self.rifa).values_list("numero", "status")),
+            {3: Numero.LIVRE, 4: Numero.LIVRE, 5: Numero.RESERVADO},
+        )
+
+
+# ======================================================================
+# EXPIRAÇÃO POR CONJUNTO (tasks.liberar_reservas_expiradas)
+# ======================================================================
+class ExpiracaoEmLoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ana = _cliente("11111111111")
+
+    def _reservar(self, rifa, numeros, protocolo, **kw):
+        pedido = _pedido(rifa, self.ana, protocolo)
+        reservar_numeros(rifa, numeros, pedido, self.ana, **kw)
+        return pedido
+
+    def test_prazo_gravado_na_reserva(self):
+        rifa = _rifa(minutos_expiracao_reserva=7)
+        agora = timezone.now()
+        self._reservar(rifa, [1, 2], "P1", agora=agora)
+        for n in Numero.objects.filter(rifa=rifa):
+            self.assertEqual(n.expira_em, agora + timedelta(minutes=7))
+
+    def test_consultas_nao_crescem_com_as_reservas(self):
+        ha_uma_hora = timezone.now() - timedelta(hours=1)
+        consultas = []
+        for qtd in (2, 40):
+            rifa = _rifa(50)
+            for i in range(0, qtd, 2):
+                self._reservar(rifa, [i + 1, i + 2], f"P{rifa.id}-{i}", agora=ha_uma_hora)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(liberar_reservas_expiradas(rifa.id), (qtd, qtd // 2))
+            consultas.append(len(ctx.captured_queries))
+        self.assertEqual(consultas[0], consultas[1])
+
+    def test_so_expira_pedido_pendente_que_ficou_vazio(self):
+        rifa = _rifa()
+        ha_uma_hora = timezone.now() - timedelta(hours=1)
+        vencido = self._reservar(rifa, [1], "P1", agora=ha_uma_hora)
+        no_prazo = self._reservar(rifa, [2], "P2")
+        pago = self._reservar(rifa, [3], "P3", agora=ha_uma_hora)
+        Pedido.objects.filter(pk=pago.pk).update(status=Pedido.PAGO)
+
+        self.assertEqual(liberar_reservas_expiradas(rifa.id), (2, 1))
+        status = dict(Pedido.objects.values_list("protocolo", "status"))
+        self.assertEqual(
+            status,
+            {vencido.protocolo: Pedido.EXPIRADO, no_prazo.protocolo: Pedido.PENDENTE, pago.protocolo: Pedido.PAGO},
+        )
+        self.assertEqual(Numero.objects.get(rifa=rifa, numero=2).status, Numero.RESERVADO)
+
+
+# ======================================================================
+# EXPIRAÇÃO VIRTUAL (leitura pública não grava)
+# ======================================================================
+class ExpiracaoVirtualTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa(10)
+        self.ana = _cliente("11111111111")
+        vencido = _pedido(self.rifa, self.ana, "P1")
+        no_prazo = _pedido(self.rifa, self.ana, "P2")
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(self.rifa, [1, 2], vencido, self.ana, agora=timezone.now() - timedelta(hours=1))
+            reservar_numeros(self.rifa, [3], no_prazo, self.ana)
+
+    def _ler_sem_gravar(self, url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url, params)
+        self.assertEqual(resp.status_code, 200)
+        escritas = [
+            q["sql"] for q in ctx.captured_queries
+            if q["sql"].lstrip().upper().startswith(("UPDATE", "INSERT", "DELETE"))
+        ]
+        self.assertEqual(escritas, [])
+        return resp
+
+    def test_grade_le_a_reserva_vencida_como_livre(self):
+        for url in (f"/api/rifas/{self.rifa.slug}/grade/", f"/api/rifas/{self.rifa.slug}/grade-drf/"):
+            cache.clear()
+            dados = self._ler_sem_gravar(url, {"from": 1, "to": 3}).json()
+            self.assertEqual(
+                [n["status"] for n in dados["numeros"]], [Numero.LIVRE, Numero.LIVRE, Numero.RESERVADO]
+            )
+            self.assertEqual((dados["livres"], dados["reservados"]), (9, 1))
+            self._ler_sem_gravar(url)
+
+        # a linha continua reservada até o worker soltar
+        self.assertEqual(Numero.objects.get(rifa=self.rifa, numero=1).status, Numero.RESERVADO)
+
+    def test_meus_numeros_e_contagem_da_pagina(self):
+        dados = self._ler_sem_gravar(
+            f"/api/rifas/{self.rifa.slug}/meus-numeros/", {"cpf": self.ana.cpf}
+        ).json()
+        self.assertEqual([n["numero"] for n in dados["numeros"]], [3])
+
+        resp = self._ler_sem_gravar(f"/r/{self.rifa.slug}/")
+        self.assertEqual((resp.context["livres"], resp.context["reservados"]), (9, 1))
+
+
+# ======================================================================
+# VARREDURA POR RIFA (tasks.varrer_rifa)
+# ======================================================================
+class VarreduraTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+
+    def _reservar_vencido(self, numero):
+        pedido = _pedido(self.rifa, self.ana, f"P{numero}")
+        reservar_numeros(self.rifa, [numero], pedido, self.ana, agora=timezone.now() - timedelta(hours=1))
+
+    def _livre(self, numero):
+        return Numero.objects.get(rifa=self.rifa, numero=numero).status == Numero.LIVRE
+
+    def test_uma_varredura_por_intervalo(self):
+        self._reservar_vencido(1)
+        self.assertTrue(tasks.varrer_rifa(self.rifa.id))
+        self.assertTrue(self._livre(1))
+
+        # dentro do intervalo: pula direto, mesmo com coisa vencida
+        self._reservar_vencido(2)
+        self.assertFalse(tasks.varrer_rifa(self.rifa.id))
+        self.assertFalse(self._livre(2))
+        # outra rifa não espera por esta
+        self.assertTrue(tasks.varrer_rifa(_rifa().id))
+
+        with mock.patch.object(tasks, "VARREDURA_INTERVALO", 0):
+            self.assertTrue(tasks.varrer_rifa(self.rifa.id))
+        self.assertTrue(self._livre(2))
+        self.assertEqual(tasks.estatisticas_varredura(), {"executadas": 3, "coalescidas": 1})
+
+    def test_varredura_rodando_faz_os_outros_pularem(self):
+        self._reservar_vencido(1)
+        cache.add(tasks._varredura_lock_key(self.rifa.id), 1, tasks.VARREDURA_LOCK_TTL)
+        with mock.patch.object(tasks, "liberar_reservas_expiradas") as liberar:
+            self.assertFalse(tasks.varrer_rifa(self.rifa.id))
+        liberar.assert_not_called()
+        self.assertEqual(tasks.estatisticas_varredura()["coalescidas"], 1)
+
+        # o lock é solto no fim, mesmo se a varredura falhar
+        cache.delete(tasks._varredura_lock_key(self.rifa.id))
+        with mock.patch.object(tasks, "liberar_reservas_expiradas", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                tasks.varrer_rifa(self.rifa.id)
+        self.assertTrue(tasks.varrer_rifa(self.rifa.id))
+
+
+# ======================================================================
+# GRADE BINÁRIA
+# ======================================================================
+class GradeBinariaTests(SimpleTestCase):
+    def test_ida_e_volta(self):
+        ocupados = [(2, Numero.RESERVADO), (9, Numero.PAGO), (10, Numero.PAGO), (11, Numero.LIVRE)]
+        grade = decodificar_grade(codificar_grade(10, ocupados, cotas=[1, 9]))
+
+        esperado = [Numero.LIVRE] * 10
+        esperado[1] = Numero.RESERVADO
+        esperado[8] = esperado[9] = Numero.PAGO
+        self.assertEqual(grade["status"], esperado)
+        self.assertEqual(grade["cotas"], {1, 9})
+        self.assertEqual(
+            (grade["total"], grade["livres"], grade["reservados"], grade["pagos"]),
+            (10, 7, 1, 2),
+        )
+
+    def test_grade_vazia(self):
+        grade = decodificar_grade(codificar_grade(0, []))
+        self.assertEqual((grade["total"], grade["status"], grade["cotas"]), (0, [], set()))
+
+    def test_blob_truncado(self):
+        with self.assertRaises(ValueError):
+            decodificar_grade(codificar_grade(100, [])[:-1])
+
+
+# ======================================================================
+# SNAPSHOT DA GRADE
+# ======================================================================
+class SnapshotGradeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa(100)
+        self.ana = _cliente("11111111111")
+
+    def _rifa_atual(self):
+        return Rifa.objects.get(pk=self.rifa.pk)
+
+    def _reservar(self, numeros, protocolo, **kw):
+        pedido = _pedido(self.rifa, self.ana, protocolo)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(self.rifa, numeros, pedido, self.ana, **kw)
+        return pedido
+
+    def test_versao_nova_aplica_so_as_mudancas(self):
+        pedido = self._reservar([1, 2, 3], "P1")
+        grade.snapshot_grade(self._rifa_atual())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            atualizar_numeros(self.rifa.id, pedido.numeros.filter(numero=1), status=Numero.PAGO)
+        self._reservar([50], "P2")
+
+        rifa = self._rifa_atual()
+        # nada de reler a grade inteira: só as linhas com versão nova
+        with mock.patch.object(grade, "_ocupados", side_effect=AssertionError("releu a grade")):
+            snap = grade.snapshot_grade(rifa)
+        self.assertEqual(snap["versao"], rifa.grade_versao)
+        self.assertEqual(decodificar_grade(snap["bin"]), decodificar_grade(grade.grade_binaria(rifa)))
+        self.assertEqual(grade.janela_grade(rifa, 1, 3)["numeros"][0]["status"], Numero.PAGO)
+        self.assertEqual(decodificar_grade(snap["bin"])["livres"], 96)
+
+    def test_reserva_que_venceu_depois_do_snapshot_fica_livre(self):
+        self._reservar([7, 8], "P1")
+        rifa = self._rifa_atual()
+        anterior = grade.snapshot_grade(rifa)
+
+        # o prazo passou sem a versão mudar (expiração virtual)
+        Numero.objects.filter(rifa=rifa, numero=7).update(expira_em=timezone.now())
+        with mock.patch.object(grade, "_ocupados", side_effect=AssertionError("releu a grade")):
+            snap = grade._montar_snapshot(rifa, anterior=anterior)
+        g = decodificar_grade(snap["bin"])
+        self.assertEqual((g["status"][6], g["status"][7]), (Numero.LIVRE, Numero.RESERVADO))
+        self.assertEqual((g["livres"], g["reservados"]), (99, 1))
+        self.assertGreater(snap["corte"], time.time())
+
+    def test_mudanca_demais_monta_do_zero(self):
+        rifa = self._rifa_atual()
+        anterior = grade.snapshot_grade(rifa)
+        self._reservar([1, 2, 3], "P1")
+        with mock.patch.object(grade, "SNAPSHOT_MUDANCAS_MAX", 2):
+            snap = grade._montar_snapshot(self._rifa_atual(), anterior=anterior)
+        self.assertEqual(decodificar_grade(snap["bin"])["reservados"], 3)
+
+    def test_rifa_grande_vem_binaria_por_padrao(self):
+        url = f"/api/rifas/{self.rifa.slug}/grade/"
+        self.assertEqual(self.client.get(url)["Content-Type"], "application/json")
+        with mock.patch.object(grade, "GRADE_JSON_MAX", 50):
+            resp = self.client.get(url)
+            self.assertEqual(resp["Content-Type"], grade.CONTENT_TYPE_BIN)
+            self.assertEqual(decodificar_grade(resp.content)["total"], 100)
+            # quem pede JSON explicitamente continua recebendo
+            self.assertEqual(self.client.get(url, {"formato": "json"})["Content-Type"], "application/json")
+
+
+# ======================================================================
+# FEED ?since= (grade.delta_grade)
+# ======================================================================
+class DeltaGradeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+        self.url = f"/api/rifas/{self.rifa.slug}/grade/"
+
+    def _delta(self, since, **headers):
+        return self.client.get(self.url, {"since": since}, **headers)
+
+    def _versao(self):
+        return self._delta(0).json()["versao"]
+
+    def _reservar(self, numeros, protocolo="P1", **kw):
+        pedido = _pedido(self.rifa, self.ana, protocolo)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(self.rifa, numeros, pedido, self.ana, **kw)
+        return pedido
+
+    def _mudancas(self, since):
+        dados = self._delta(since).json()
+        self.assertFalse(dados["resync"])
+        return {m["numero"]: m["status"] for m in dados["numeros"]}, dados["versao"]
+
+    def test_reserva_sobe_a_versao_e_so_manda_o_que_mudou(self):
+        self._reservar([1, 2])
+        v1 = self._versao()
+        self._reservar([7], "P2")
+
+        mudancas, v2 = self._mudancas(v1)
+        self.assertGreater(v2, v1)
+        self.assertEqual(mudancas, {7: Numero.RESERVADO})
+        self.assertEqual(self._mudancas(v2)[0], {})
+
+    def test_pagar_e_cancelar(self):
+        pedido = self._reservar([3, 4])
+        v1 = self._versao()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            atualizar_numeros(self.rifa.id, pedido.numeros.all(), status=Numero.PAGO)
+        mudancas, v2 = self._mudancas(v1)
+        self.assertGreater(v2, v1)
+        self.assertEqual(mudancas, {3: Numero.PAGO, 4: Numero.PAGO})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.liberar_numeros()
+        mudancas, v3 = self._mudancas(v2)
+        self.assertGreater(v3, v2)
+        self.assertEqual(mudancas, {3: Numero.LIVRE, 4: Numero.LIVRE})
+
+    def test_expirar(self):
+        self._reservar([5], agora=timezone.now() - timedelta(hours=1))
+        v1 = self._versao()
+        # vencida e ainda não solta: já sai como livre (expiração virtual)
+        self.assertEqual(self._mudancas(v1)[0], {5: Numero.LIVRE})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            liberar_reservas_expiradas(self.rifa.id)
+        mudancas, v2 = self._mudancas(v1)
+        self.assertGreater(v2, v1)
+        self.assertEqual(mudancas, {5: Numero.LIVRE})
+        self.assertEqual(self._mudancas(v2)[0], {})
+
+    def test_resync_quando_muito_atras(self):
+        v0 = self._versao()
+        self._reservar([1, 2, 3, 4])
+        with mock.patch.object(grade, "DELTA_MAX_MUDANCAS", 3):
+            dados = self._delta(v0).json()
+            self.assertTrue(dados["resync"])
+            self.assertEqual(dados["numeros"], [])
+            # versão do futuro (ou inválida) também pede recarga
+            self.assertTrue(self._delta(dados["versao"] + 1).json()["resync"])
+            self.assertTrue(self._delta("x").json()["resync"])
+
+    def test_304_enquanto_a_versao_nao_muda(self):
+        self._reservar([1])
+        v1 = self._versao()
+        resp = self._delta(v1)
+        self.assertEqual(resp.status_code, 200)
+
+        de_novo = self._delta(v1, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(de_novo.status_code, 304)
+
+        self._reservar([2], "P2")
+        depois = self._delta(v1, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(depois.status_code, 200)
+        self.assertEqual(depois.json()["numeros"], [{"numero": 2, "status": Numero.RESERVADO}])
+
+
+# ======================================================================
+# JANELA DA GRADE (?from=&to=&status=)
+# ======================================================================
+class JanelaGradeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa(30)
+        self.ana = _cliente("11111111111")
+        self.url = f"/api/rifas/{self.rifa.slug}/grade/"
+        pedido = _pedido(self.rifa, self.ana, "P1")
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(self.rifa, [2, 3, 10, 17, 29], pedido, self.ana)
+
+    def _janela(self, **params):
+        resp = self.client.get(self.url, params)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_limites_da_janela(self):
+        dados = self._janela(**{"from": 0, "to": 500})
+        self.assertEqual((dados["from"], dados["to"]), (1, 30))
+        self.assertEqual(len(dados["numeros"]), 30)
+        self.assertIsNone(dados["proximo"])
+        # contagens da rifa inteira, não só da janela
+        dados = self._janela(**{"from": 1, "to": 3})
+        self.assertEqual([n["numero"] for n in dados["numeros"]], [1, 2, 3])
+        self.assertEqual((dados["total"], dados["livres"], dados["reservados"], dados["pagos"]), (30, 25, 5, 0))
+
+    def test_filtro_de_status_pagina_pelo_proximo(self):
+        dados = self._janela(status="reservado", limite=2)
+        self.assertEqual([n["numero"] for n in dados["numeros"]], [2, 3])
+        vistos = [2, 3]
+        while dados["proximo"]:
+            dados = self._janela(status="reservado", limite=2, **{"from": dados["proximo"]})
+            vistos += [n["numero"] for n in dados["numeros"]]
+        self.assertEqual(vistos, [2, 3, 10, 17, 29])
+
+        livres = self._janela(status="livre", **{"from": 1, "to": 4})["numeros"]
+        self.assertEqual([n["numero"] for n in livres], [1, 4])
+
+    def test_status_invalido(self):
+        resp = self.client.get(self.url, {"status": "vendido"})
+        self.assertEqual(resp.status_code, 400)
+
+
+# ======================================================================
+# PUSH DA GRADE (stream SSE, um produtor por rifa)
+# ======================================================================
+class StreamGradeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+
+    def _reservar(self, numeros, protocolo, **kw):
+        pedido = _pedido(self.rifa, self.ana, protocolo)
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(self.rifa, numeros, pedido, self.ana, **kw)
+
+    def _produtor(self, *filas):
+        prod = stream._ProdutorGrade(self.rifa.id, versao_atual(Rifa.objects.get(pk=self.rifa.pk)))
+        prod.assinantes.update(filas)
+        return prod
+
+    def test_wsgi_cai_no_polling(self):
+        resp = self.client.get(f"/api/rifas/{self.rifa.slug}/grade/stream/")
+        self.assertEqual(resp.status_code, 204)
+
+    def test_um_delta_para_todos_os_assinantes(self):
+        filas = [asyncio.Queue(maxsize=stream.STREAM_FILA_MAX) for _ in range(3)]
+        prod = self._produtor(*filas)
+        self.assertIsNone(prod._buscar_mudancas())
+
+        self._reservar([4, 9], "P1")
+        with mock.patch.object(stream, "delta_grade", wraps=grade.delta_grade) as delta:
+            evento = prod._buscar_mudancas()
+            prod._publicar(evento)
+            # nada mudou depois: nem consulta o delta
+            self.assertIsNone(prod._buscar_mudancas())
+        self.assertEqual(delta.call_count, 1)
+        self.assertEqual(
+            {m["numero"]: m["status"] for m in evento["numeros"]},
+            {4: Numero.RESERVADO, 9: Numero.RESERVADO},
+        )
+        for fila in filas:
+            self.assertIs(fila.get_nowait(), evento)
+
+    def test_reserva_vencida_sai_sem_versao_nova(self):
+        self._reservar([5], "P1")
+        prod = self._produtor()
+        self.assertIsNone(prod._buscar_mudancas())  # guarda o corte
+
+        Numero.objects.filter(rifa=self.rifa, numero=5).update(expira_em=timezone.now() - timedelta(seconds=1))
+        prod.corte = time.time() - 1
+        evento = prod._buscar_mudancas()
+        self.assertEqual(evento["numeros"], [{"numero": 5, "status": Numero.LIVRE}])
+
+    def test_assinante_lento_recebe_resync(self):
+        lenta = asyncio.Queue(maxsize=1)
+        prod = self._produtor(lenta)
+        prod._publicar({"versao": 1, "resync": False, "numeros": []})
+        prod._publicar({"versao": 2, "resync": False, "numeros": []})
+        self.assertEqual(lenta.get_nowait(), {"versao": 2, "resync": True, "numeros": []})
+
+
+# ======================================================================
+# ETAG / 304 NOS ENDPOINTS DE POLLING
+# ======================================================================
+class EtagPollingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+        self.pedido = _pedido(self.rifa, self.ana, "P1", total=Decimal("4.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(self.rifa, [1, 2], self.pedido, self.ana)
+
+    def _get(self, url, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(url, **headers)
+
+    def _revalida(self, url):
+        """ETag da 1ª resposta, conferindo que repetir sem mudança dá 304."""
+        resp = self._get(url)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        etag = resp["ETag"]
+        self.assertEqual(self._get(url, etag).status_code, 304)
+        return etag
+
+    def test_grade(self):
+        url = f"/api/rifas/{self.rifa.slug}/grade/"
+        etag = self._revalida(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            atualizar_numeros(self.rifa.id, self.pedido.numeros.all(), status=Numero.PAGO)
+        self.assertEqual(self._get(url, etag).status_code, 200)
+
+    def test_top(self):
+        url = f"/api/rifas/{self.rifa.slug}/top/"
+        etag = self._revalida(url)
+        self.assertEqual(self._get(url).json(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            atualizar_numeros(self.rifa.id, self.pedido.numeros.all(), status=Numero.PAGO)
+        resp = self._get(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()[0]["qtd"], 2)
+
+    def test_status_do_pedido_acompanha_pagamento_e_cotas(self):
+        from .models import CotaPremiada, Pagamento
+
+        url = f"/api/pedidos/{self.pedido.protocolo}/"
+        etag = self._revalida(url)
+
+        pg = Pagamento.objects.create(pedido=self.pedido, provider="efi", status_provider="ATIVA")
+        resp = self._get(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp["ETag"]
+
+        # update() não mexe em atualizado_em: o conteúdo entra no ETag
+        Pagamento.objects.filter(pk=pg.pk).update(copia_cola="000201PIX")
+        resp = self._get(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["pagamento"]["copia_cola"], "000201PIX")
+        etag = resp["ETag"]
+
+        CotaPremiada.objects.create(rifa=self.rifa, numero=2, descricao="Pix", valor_premio=Decimal("50.00"))
+        resp = self._get(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["cotas_premiadas"][0]["numero"], 2)
+
+    def test_detalhe_publico_acompanha_cliente(self):
+        from .models import Pagamento
+
+        # com o PIX já gerado (sem PIX o GET ainda tem trabalho e não dá 304)
+        Pagamento.objects.create(pedido=self.pedido, provider="efi", copia_cola="000201PIX")
+        url = f"/api/pedidos-public/{self.pedido.protocolo}/"
+        etag = self._revalida(url)
+        Cliente.objects.filter(pk=self.ana.pk).update(nome="Ana Souza")
+        resp = self._get(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["cliente"]["nome"], "Ana Souza")
+
+
+# ======================================================================
+# PROTOCOLO
+# ======================================================================
+class ProtocoloTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_formato_e_ordem(self):
+        gerador = GeradorDeProtocolo(no=7)
+        gerados = [gerador.novo() for _ in range(3000)]
+
+        self.assertEqual(len(set(gerados)), len(gerados))
+        self.assertEqual(gerados, sorted(gerados))
+        for protocolo in gerados[:50]:
+            self.assertEqual(len(protocolo), TAMANHO)
+            self.assertTrue(set(protocolo) <= set(ALFABETO))
+            self.assertEqual(partes(protocolo)["no"], 7)
+
+    def test_unico_entre_threads(self):
+        gerador = GeradorDeProtocolo(no=3)
+        gerados = []
+
+        def gerar():
+            lote = [gerador.novo() for _ in range(1000)]
+            gerados.extend(lote)
+
+        threads = [threading.Thread(target=gerar) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(set(gerados)), 4000)
+
+    def test_nos_diferentes_nao_colidem(self):
+        a, b = GeradorDeProtocolo(no=1), GeradorDeProtocolo(no=2)
+        gerados = [g.novo() for _ in range(500) for g in (a, b)]
+        self.assertEqual(len(set(gerados)), 1000)
+
+    def test_no_reservado_no_cache(self):
+        a, b = GeradorDeProtocolo(), GeradorDeProtocolo()
+        self.assertNotEqual(partes(a.novo())["no"], partes(b.novo())["no"])
+
+    @mock.patch.object(protocolo, "NO_CONFERIR", 0)
+    def test_retoma_no_despejado_do_cache(self):
+        gerador = GeradorDeProtocolo()
+        no = partes(gerador.novo())["no"]
+        chave = gerador._chave_no(no)
+        dono = cache.get(chave)
+
+        cache.delete(chave)  # despejo por memória
+        self.assertEqual(partes(gerador.novo())["no"], no)
+        self.assertEqual(cache.get(chave), dono)
+
+    @mock.patch.object(protocolo, "NO_CONFERIR", 0)
+    def test_larga_no_que_outro_pegou(self):
+        gerador = GeradorDeProtocolo()
+        no = partes(gerador.novo())["no"]
+        chave = gerador._chave_no(no)
+
+        # a chave sumiu e outro processo arrendou o mesmo nó
+        cache.set(chave, "outro-processo")
+        self.assertNotEqual(partes(gerador.novo())["no"], no)
+        self.assertEqual(cache.get(chave), "outro-processo")
+
+
+# ======================================================================
+# USOS DE CUPOM (pricing.reservar_uso_cupom + signal do Pedido)
+# ======================================================================
+class UsoDeCupomTests(TestCase):
+    def setUp(self):
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+        self.bia = _cliente("22222222222")
+        self.cupom = Coupon.objects.create(codigo="DEZ", valor=Decimal("10.00"), max_uso_global=2)
+
+    def _usar(self, cliente, protocolo):
+        pedido = _pedido(self.rifa, cliente, protocolo, desconto_cupom=Decimal("1.00"))
+        reservar_uso_cupom(self.cupom, pedido, cliente, Decimal("1.00"))
+        return pedido
+
+    def _contadores(self):
+        self.cupom.refresh_from_db()
+        por_cliente = dict(
+            CouponUsoCliente.objects.filter(coupon=self.cupom).values_list("cliente_id", "usos")
+        )
+        return self.cupom.uso_cache, por_cliente
+
+    def test_reserva_conta_e_esgota(self):
+        self._usar(self.ana, "P1")
+        self._usar(self.bia, "P2")
+        self.assertEqual(self._contadores(), (2, {self.ana.id: 1, self.bia.id: 1}))
+
+        pedido = _pedido(self.rifa, self.ana, "P3")
+        with self.assertRaises(CupomEsgotado):
+            reservar_uso_cupom(self.cupom, pedido, self.ana, Decimal("1.00"))
+        self.assertEqual(self._contadores(), (2, {self.ana.id: 1, self.bia.id: 1}))
+        self.assertFalse(CouponRedemption.objects.filter(pedido=pedido).exists())
+
+    def test_limite_por_cliente_desfaz_o_global(self):
+        self.cupom.max_uso_global = None
+        self.cupom.max_uso_por_cliente = 1
+        self.cupom.save()
+        self._usar(self.ana, "P1")
+
+        with self.assertRaises(CupomEsgotado):
+            self._usar(self.ana, "P2")
+        self.assertEqual(self._contadores(), (1, {self.ana.id: 1}))
+
+    def test_expirar_devolve_uma_vez(self):
+        pedido = self._usar(self.ana, "P1")
+        self._usar(self.bia, "P2")
+
+        pedido.status = Pedido.EXPIRADO
+        pedido.save()
+        pedido.save()  # de novo: o uso não volta duas vezes
+
+        redemption = CouponRedemption.objects.get(pedido=pedido)
+        self.assertEqual(redemption.status, CouponRedemption.LIBERADO)
+        self.assertEqual(self._contadores(), (1, {self.ana.id: 0, self.bia.id: 1}))
+        # o uso devolvido abre vaga para outro pedido
+        self._usar(self.ana, "P3")
+        self.assertEqual(self._contadores(), (2, {self.ana.id: 1, self.bia.id: 1}))
+
+    def test_pagar_confirma_sem_contar_de_novo(self):
+        pedido = self._usar(self.ana, "P1")
+
+        pedido.status = Pedido.PAGO
+        pedido.save()
+
+        redemption = CouponRedemption.objects.get(pedido=pedido)
+        self.assertEqual(redemption.status, CouponRedemption.CONFIRMADO)
+        self.assertEqual(self._contadores(), (1, {self.ana.id: 1}))
+
+    def test_pago_depois_de_expirar_volta_a_contar(self):
+        pedido = self._usar(self.ana, "P1")
+        pedido.status = Pedido.EXPIRADO
+        pedido.save()
+        self.assertEqual(self._contadores(), (0, {self.ana.id: 0}))
+
+        pedido.status = Pedido.PAGO
+        pedido.save()
+        self.assertEqual(CouponRedemption.objects.get(pedido=pedido).status, CouponRedemption.CONFIRMADO)
+        self.assertEqual(self._contadores(), (1, {self.ana.id: 1}))
+
+
+# ======================================================================
+# HOLD NO CACHE (holds.segurar + pedido com hold_id)
+# ======================================================================
+class HoldTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.outra = _rifa()
+
+    def test_segura_e_acumula_no_mesmo_hold(self):
+        hold = holds.segurar(self.rifa, 4)
+        hold = holds.segurar(self.rifa, 2, hold["hold_id"])
+        self.assertEqual(hold["numeros"], [2, 4])
+        self.assertEqual(holds.ler_hold(hold["hold_id"])["numeros"], [4, 2])
+
+    def test_numero_de_outro_hold_da_conflito(self):
+        primeiro = holds.segurar(self.rifa, 4)
+        with self.assertRaises(holds.HoldIndisponivel):
+            holds.segurar(self.rifa, 4)
+        self.assertEqual(holds.segurados_por_outros(self.rifa.id, [3, 4]), [4])
+        self.assertEqual(holds.segurados_por_outros(self.rifa.id, [4], primeiro["hold_id"]), [])
+
+        resp = self.client.post(
+            f"/api/rifas/{self.rifa.slug}/hold/", {"numero": 4}, content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 409)
+
+    def test_soltar_libera_para_outro(self):
+        hold = holds.segurar(self.rifa, 4)
+        holds.soltar(self.rifa, hold["hold_id"], 4)
+        self.assertIsNone(holds.ler_hold(hold["hold_id"]))
+        self.assertEqual(holds.segurar(self.rifa, 4)["numeros"], [4])
+
+    def test_hold_vence_no_ttl(self):
+        with mock.patch.object(holds, "HOLD_TTL", 1):
+            hold = holds.segurar(self.rifa, 4)
+        time.sleep(1.1)
+        self.assertIsNone(holds.ler_hold(hold["hold_id"]))
+        self.assertEqual(holds.segurados_por_outros(self.rifa.id, [4]), [])
+        self.assertNotEqual(holds.segurar(self.rifa, 4)["hold_id"], hold["hold_id"])
+
+    def test_hold_de_outra_rifa_comeca_outro(self):
+        hold = holds.segurar(self.rifa, 4)
+        outro = holds.segurar(self.outra, 4, hold["hold_id"])
+        self.assertNotEqual(outro["hold_id"], hold["hold_id"])
+        self.assertEqual(holds.ler_hold(hold["hold_id"]), {"rifa": self.rifa.id, "numeros": [4]})
+
+        # pedido numa rifa com o hold da outra não leva os números
+        resp = self.client.post(
+            "/api/v2/pedidos/",
+            {"slug": self.outra.slug, "cpf": "11111111111", "hold_id": hold["hold_id"]},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.status_code, 409)
+        self.assertFalse(Pedido.objects.exists())
+
+    def test_limite_por_pedido(self):
+        self.rifa.limite_por_pedido = 1
+        self.rifa.save()
+        hold = holds.segurar(self.rifa, 4)
+        with self.assertRaises(holds.HoldIndisponivel):
+            holds.segurar(self.rifa, 5, hold["hold_id"])
+
+    @mock.patch("rifas.tasks.COBRANCA_EM_THREAD", False)
+    def test_pedido_consome_o_hold(self):
+        hold = holds.segurar(self.rifa, 4)
+        hold = holds.segurar(self.rifa, 9, hold["hold_id"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(
+                "/api/v2/pedidos/",
+                {"slug": self.rifa.slug, "cpf": "11111111111", "hold_id": hold["hold_id"]},
+                content_type="application/json",
+            )
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(resp.json()["numeros"], [4, 9])
+
+        pedido = Pedido.objects.get(protocolo=resp.json()["protocolo"])
+        self.assertEqual(
+            sorted(Numero.objects.filter(pedido=pedido, status=Numero.RESERVADO).values_list("numero", flat=True)),
+            [4, 9],
+        )
+        # o hold saiu do cache: o banco é quem vale agora
+        self.assertIsNone(holds.ler_hold(hold["hold_id"]))
+        self.assertEqual(holds.segurados_por_outros(self.rifa.id, [4, 9]), [])
+        with self.assertRaises(holds.HoldIndisponivel):
+            holds.segurar(Rifa.objects.get(pk=self.rifa.pk), 4)
+
+
+# ======================================================================
+# COMPRA POR QUANTIDADE (grade.sortear_livres + pedido com "quantidade")
+# ======================================================================
+class SorteioTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ana = _cliente("11111111111")
+
+    def _vender(self, rifa, numeros):
+        pedido = _pedido(rifa, self.ana, f"P{rifa.id}")
+        with self.captureOnCommitCallbacks(execute=True):
+            reservar_numeros(rifa, numeros, pedido, self.ana)
+        return Rifa.objects.get(pk=rifa.pk)
+
+    def _comprar(self, rifa, **dados):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/api/v2/pedidos/",
+                {"slug": rifa.slug, "cpf": "22222222222", **dados},
+                content_type="application/json",
+            )
+
+    def test_livres_por_bloco_batem_com_a_grade(self):
+        rifa = self._vender(_rifa(1001), list(range(1, 1002, 3)))
+        snap = grade.snapshot_grade(rifa)
+        acum = snap["livres_acum"]
+        self.assertEqual(len(acum), 4)
+        self.assertEqual(acum[-1], grade.GRADE_HEADER.unpack_from(snap["bin"])[4])
+        livres = [n for n, s in enumerate(decodificar_grade(snap["bin"])["status"], 1) if s == Numero.LIVRE]
+        for k in (0, 1, 170, 171, len(livres) - 1):
+            self.assertEqual(grade._k_esimo_livre(snap["bin"], acum, k), livres[k])
+
+    def test_sorteia_com_a_rifa_quase_vendida(self):
+        rifa = self._vender(_rifa(1000), list(range(1, 991)))
+        grade.snapshot_grade(rifa)
+        # com o snapshot pronto, sortear não relê a grade
+        with mock.patch.object(grade, "_ocupados", side_effect=AssertionError("releu a grade")):
+            sorteados = grade.sortear_livres(rifa, 10)
+            sobra = grade.sortear_livres(rifa, 20)
+        self.assertEqual(sorted(sorteados), list(range(991, 1001)))
+        self.assertEqual(sorted(sobra), list(range(991, 1001)))
+
+    def test_respeita_excluir(self):
+        rifa = _rifa(10)
+        for _ in range(5):
+            sorteados = grade.sortear_livres(rifa, 7, excluir={1, 2, 3})
+            self.assertEqual(len(set(sorteados)), 7)
+            self.assertFalse({1, 2, 3} & set(sorteados))
+
+    @mock.patch("rifas.tasks.COBRANCA_EM_THREAD", False)
+    def test_pedido_por_quantidade(self):
+        rifa = _rifa(50, limite_por_pedido=5, permitir_numero_escolhido=False)
+
+        self.assertEqual(self._comprar(rifa, quantidade=6).status_code, 400)
+        self.assertEqual(self._comprar(rifa, numeros=[1, 2]).status_code, 400)
+        self.assertFalse(Pedido.objects.exists())
+
+        resp = self._comprar(rifa, quantidade=5)
+        self.assertEqual(resp.status_code, 201, resp.content)
+        numeros = resp.json()["numeros"]
+        self.assertEqual(len(set(numeros)), 5)
+        pedido = Pedido.objects.get(protocolo=resp.json()["protocolo"])
+        self.assertEqual(
+            sorted(pedido.numeros.filter(status=Numero.RESERVADO).values_list("numero", flat=True)), numeros
+        )
+
+    @mock.patch("rifas.tasks.COBRANCA_EM_THREAD", False)
+    def test_sorteio_repete_sem_o_que_ja_foi_pego(self):
+        rifa = self._vender(_rifa(10), [5])
+        # snapshot atrás do banco: o 1º sorteio devolve o 5, já reservado
+        with mock.patch("rifas.api_public.sortear_livres", side_effect=[[5], [7]]) as sortear:
+            resp = self._comprar(rifa, quantidade=1)
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(resp.json()["numeros"], [7])
+        self.assertEqual(sortear.call_args_list[1].args[2], {5})
+
+
+# ======================================================================
+# COBRANÇA FORA DA TRANSAÇÃO (outbox: tasks.enfileirar/emitir_cobranca)
+# ======================================================================
+class CobrancaOutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+
+    def _na_fila(self):
+        from .tasks import enfileirar_cobranca
+
+        pedido = _pedido(self.rifa, self.ana, "P1", total=Decimal("2.00"))
+        with mock.patch("rifas.tasks.COBRANCA_EM_THREAD", False):
+            return enfileirar_cobranca(pedido)
+
+    def _efi(self, efi_chamar):
+        return mock.patch.multiple(
+            "rifas.api_public",
+            _efi_disponivel=mock.Mock(return_value=True),
+            _get_efi_cred=mock.Mock(return_value=mock.Mock(chave_pix="chave")),
+            _get_efi_token=mock.Mock(return_value={"access_token": "t"}),
+            _efi_chamar=mock.Mock(side_effect=efi_chamar),
+            _criar_pagamento_registry=mock.Mock(side_effect=AssertionError("registry numa cob da Efí")),
+        )
+
+    @mock.patch("rifas.tasks.COBRANCA_EM_THREAD", False)
+    def test_pedido_responde_sem_falar_com_a_efi(self):
+        from .models import Pagamento
+
+        with mock.patch("rifas.api_public._criar_cobranca_efi_e_salvar") as efi:
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = self.client.post(
+                    "/api/v2/pedidos/",
+                    {"slug": self.rifa.slug, "cpf": "22222222222", "numeros": [1]},
+                    content_type="application/json",
+                )
+        self.assertEqual(resp.status_code, 201, resp.content)
+        efi.assert_not_called()
+        pg = Pagamento.objects.get(pedido__protocolo=resp.json()["protocolo"])
+        self.assertEqual(pg.status_provider, Pagamento.NA_FILA)
+
+    def test_emite_uma_vez_e_repete_o_mesmo_txid(self):
+        from .models import Pagamento
+        from .tasks import emitir_cobranca
+
+        pagamento = self._na_fila()
+        urls = []
+        concorrente = []
+
+        def efi_fora_do_ar(metodo, url, *args, **kwargs):
+            urls.append((metodo, url))
+            if not concorrente:
+                # outro worker tentando a mesma cobrança enquanto esta roda
+                concorrente.append(emitir_cobranca(pagamento.id))
+            return None
+
+        with self._efi(efi_fora_do_ar):
+            self.assertFalse(emitir_cobranca(pagamento.id))
+        self.assertEqual(concorrente, [None])
+        pg = Pagamento.objects.get(pk=pagamento.pk)
+        self.assertEqual((pg.status_provider, pg.provider, pg.tentativas), (Pagamento.NA_FILA, "efi", 1))
+        txid = pg.provider_preference_id
+        self.assertTrue(all(url.endswith(f"/v2/cob/{txid}") for _, url in urls))
+
+        def efi_no_ar(metodo, url, *args, **kwargs):
+            urls.append((metodo, url))
+            if url.endswith("/qrcode"):
+                return mock.Mock(json=lambda: {"qrcode": "000201PIX", "imagemQrcode": "QR"})
+            return mock.Mock(json=lambda: {"loc": {"id": 7}})
+
+        urls.clear()
+        depois = timezone.now() + timedelta(hours=1)
+        with self._efi(efi_no_ar):
+            self.assertTrue(emitir_cobranca(pagamento.id, agora=depois))
+            # já emitida: não sai de novo
+            self.assertIsNone(emitir_cobranca(pagamento.id, agora=depois))
+        self.assertEqual(urls[0][0], "PUT")
+        self.assertTrue(urls[0][1].endswith(f"/v2/cob/{txid}"))
+        self.assertEqual(len(urls), 2)
+
+        pg = Pagamento.objects.get(pk=pagamento.pk)
+        self.assertEqual((pg.copia_cola, pg.provider_preference_id), ("000201PIX", txid))
+
+
+# ======================================================================
+# IDEMPOTENCY-KEY NA CRIAÇÃO DE PEDIDO
+# ======================================================================
+@mock.patch("rifas.tasks.COBRANCA_EM_THREAD", False)
+class IdempotenciaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa()
+
+    def _post(self, url="/api/v2/pedidos/", chave="chave-1", cpf="22222222222", **dados):
+        dados.setdefault("numeros", [1, 2])
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                url, {"slug": self.rifa.slug, "cpf": cpf, **dados},
+                content_type="application/json", HTTP_IDEMPOTENCY_KEY=chave,
+            )
+
+    def test_repeticao_devolve_a_primeira_resposta(self):
+        primeira = self._post()
+        self.assertEqual(primeira.status_code, 201, primeira.content)
+
+        with mock.patch("rifas.api_public.reservar_numeros") as reservar:
+            repetida = self._post()
+        reservar.assert_not_called()
+        self.assertEqual(repetida.status_code, 201)
+        self.assertEqual(repetida["Idempotent-Replayed"], "true")
+        self.assertEqual(repetida.json(), primeira.json())
+        self.assertEqual(Pedido.objects.count(), 1)
+
+        # o front repete no endpoint legado com a mesma chave
+        legado = self._post("/api/pedidos/")
+        self.assertEqual(legado["Idempotent-Replayed"], "true")
+        self.assertEqual(legado.json()["protocolo"], primeira.json()["protocolo"])
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_mesma_chave_com_outro_corpo(self):
+        self.assertEqual(self._post().status_code, 201)
+        resp = self._post(numeros=[3])
+        self.assertEqual(resp.status_code, 422)
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_repeticao_enquanto_a_primeira_roda(self):
+        chave = idempotencia.chave_da_requisicao(
+            mock.Mock(headers={"Idempotency-Key": "chave-1"}, method="GET"), self.rifa.slug, "22222222222"
+        )
+        digital = idempotencia.impressao_do_pedido({"numeros": [1, 2]})
+        self.assertIsNone(idempotencia.comecar(chave, digital))
+
+        self.assertEqual(self._post().status_code, 409)
+        self.assertFalse(Pedido.objects.exists())
+
+    def test_chave_vale_por_cpf_e_erro_nao_fica_guardado(self):
+        self.assertEqual(self._post().status_code, 201)
+        # mesma chave, outro cliente: pedido próprio (e os números já estão com o 1º)
+        self.assertEqual(self._post(cpf="33333333333").status_code, 409)
+        self.assertEqual(self._post(cpf="33333333333", numeros=[3]).status_code, 201)
+        self.assertEqual(Pedido.objects.count(), 2)
+
+
+# ======================================================================
+# SALA DE ESPERA (admissao.admitir)
+# ======================================================================
+@mock.patch("rifas.tasks.COBRANCA_EM_THREAD", False)
+class AdmissaoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rifa = _rifa(pedidos_por_segundo=1)
+
+    def _post(self, numeros, chave=None):
+        extra = {"HTTP_IDEMPOTENCY_KEY": chave} if chave else {}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/api/v2/pedidos/",
+                {"slug": self.rifa.slug, "cpf": "22222222222", "numeros": numeros},
+                content_type="application/json", **extra,
+            )
+
+    def test_429_com_retry_after_acima_do_limite(self):
+        with mock.patch("rifas.admissao.time.time", return_value=1000.0):
+            self.assertEqual(self._post([1]).status_code, 201)
+            resp = self._post([2], chave="k")
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp["Retry-After"], "1")
+        self.assertEqual(resp.json()["retry_after"], 1)
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(
+            admissao.estatisticas_admissao(self.rifa.slug), {"limite": 1, "admitidos": 1, "adiados": 1}
+        )
+
+        # no segundo seguinte entra, com a mesma Idempotency-Key (o 429 não ficou guardado)
+        with mock.patch("rifas.admissao.time.time", return_value=1001.0):
+            self.assertEqual(self._post([2], chave="k").status_code, 201)
+
+    def test_retry_after_espalha_quem_passou(self):
+        self.assertEqual(admissao.limite_da_rifa(self.rifa.slug), 1)
+        # limite em cache: update() sem passar pelo save não muda nada
+        Rifa.objects.filter(pk=self.rifa.pk).update(pedidos_por_segundo=2)
+        self.assertEqual(admissao.limite_da_rifa(self.rifa.slug), 1)
+
+        self.rifa.pedidos_por_segundo = 2
+        self.rifa.save()
+        with mock.patch("rifas.admissao.time.time", return_value=2000.0):
+            respostas = [admissao.admitir(self.rifa.slug) for _ in range(6)]
+        self.assertEqual(respostas, [(True, 0), (True, 0), (False, 1), (False, 1), (False, 2), (False, 2)])
+
+    def test_sem_limite_admite_tudo(self):
+        rifa = _rifa()
+        with mock.patch("rifas.admissao.time.time", return_value=1000.0):
+            self.assertTrue(all(admissao.admitir(rifa.slug)[0] for _ in range(50)))
+        self.assertEqual(admissao.estatisticas_admissao(rifa.slug)["admitidos"], 0)
+
+
+# ======================================================================
+# CPF CANÔNICO (Cliente.cpf_digitos + mesclar_clientes)
+# ======================================================================
+class CpfCanonicoTests(TestCase):
+    def _legado(self, cpf, **kw):
+        # cliente de antes da chave: gravado sem passar pelo save()
+        kw.setdefault("nome", "Cliente")
+        cliente = Cliente(email=f"{Cliente.objects.count()}@fake.local", telefone="-", cpf=cpf, **kw)
+        Cliente.objects.bulk_create([cliente])
+        return Cliente.objects.order_by("-id").first()
+
+    def test_um_cliente_por_cpf_com_ou_sem_mascara(self):
+        ana = _cliente("111.111.111-11")
+        self.assertEqual((ana.cpf, ana.cpf_digitos), ("111.111.111-11", "11111111111"))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            _cliente("11111111111")
+        self.assertEqual(Cliente.por_cpf("11111111111"), ana)
+        self.assertEqual(Cliente.por_cpf("111.111.111-11"), ana)
+        self.assertIsNone(Cliente.por_cpf(""))
+
+    def test_mesclar_leva_tudo_para_o_mais_antigo(self):
+        rifa = _rifa()
+        canon = self._legado("11111111111")
+        dup = self._legado("111.111.111-11", nome="Ana Souza")
+        sozinho = self._legado("222.222.222-22")
+        Cliente.objects.filter(pk=canon.pk).update(cpf_digitos="11111111111")
+
+        pedido = _pedido(rifa, dup, "P1")
+        reservar_numeros(rifa, [1], pedido, dup)
+        cupom = Coupon.objects.create(codigo="DEZ", valor=Decimal("10.00"))
+        CouponUsoCliente.objects.create(coupon=cupom, cliente=canon, usos=1)
+        CouponUsoCliente.objects.create(coupon=cupom, cliente=dup, usos=2)
+
+        saida = StringIO()
+        call_command("mesclar_clientes", "--dry-run", stdout=saida)
+        self.assertIn("[dry-run] 1 duplicados mesclados, 1 clientes ganharam a chave", saida.getvalue())
+        self.assertTrue(Cliente.objects.filter(pk=dup.pk).exists())
+
+        call_command("mesclar_clientes", "--lote", "1", stdout=StringIO())
+        self.assertFalse(Cliente.objects.filter(pk=dup.pk).exists())
+        canon.refresh_from_db()
+        self.assertEqual(canon.nome, "Ana Souza")
+        self.assertEqual(Pedido.objects.get(pk=pedido.pk).cliente_id, canon.id)
+        self.assertEqual(Numero.objects.get(rifa=rifa, numero=1).cliente_id, canon.id)
+        self.assertEqual(list(CouponUsoCliente.objects.values_list("cliente_id", "usos")), [(canon.id, 3)])
+        self.assertEqual(Cliente.objects.get(pk=sozinho.pk).cpf_digitos, "22222222222")
+
+        # meus números: uma busca pela chave, com ou sem máscara
+        resp = self.client.get(f"/api/rifas/{rifa.slug}/meus-numeros/", {"cpf": "111.111.111-11"})
+        self.assertEqual([n["numero"] for n in resp.json()["numeros"]], [1])
+
+
+# ======================================================================
+# PLANO DE REGRAS COMPILADO (pricing.plano_de_regras)
+# ======================================================================
+class PlanoDeRegrasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        pricing.invalidar_precos()
+        self.rifa = _rifa()
+        self.ana = _cliente("11111111111")
+
+    def _regra(self, **kw):
+        kw.setdefault("nome", "Regra")
+        kw.setdefault("valor", Decimal("10.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            return DiscountRule.objects.create(**kw)
+
+    def _total(self, qtd, cupom=None):
+        return pricing.precificar(self.rifa, qtd, self.ana, cupom)[3]
+
+    def test_regime_sem_consultar_regras(self):
+        self._regra(nome="Geral", valor=Decimal("10.00"), prioridade=1)
+        self._regra(nome="Da rifa", rifa=self.rifa, valor=Decimal("50.00"), qtd_numeros_min=5, prioridade=2,
+                    exclusiva=True)
+        self.assertEqual(self._total(1), Decimal("1.80"))
+        with self.assertNumQueries(0):
+            self.assertEqual(self._total(1), Decimal("1.80"))
+            # exclusiva de prioridade maior barra a geral
+            self.assertEqual(self._total(5), Decimal("5.00"))
+
+    def test_salvar_regra_ou_cupom_invalida(self):
+        regra = self._regra(valor=Decimal("10.00"))
+        self.assertEqual(self._total(10), Decimal("18.00"))
+
+        regra.valor = Decimal("20.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            regra.save()
+        self.assertEqual(self._total(10), Decimal("16.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cupom = Coupon.objects.create(codigo="DOIS", tipo=Coupon.VALOR, valor=Decimal("2.00"))
+        self.assertEqual(self._total(10, "DOIS"), Decimal("14.00"))
+        cupom.ativo = False
+        with self.captureOnCommitCallbacks(execute=True):
+            cupom.save()
+        self.assertEqual(self._total(10, "DOIS"), Decimal("16.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            regra.delete()
+        self.assertEqual(self._total(10), Decimal("20.00"))
+
+    def test_plano_vence_na_borda_da_janela(self):
+        agora = timezone.now()
+        self._regra(inicio=agora + timedelta(minutes=5))
+        plano = pricing.plano_de_regras(self.rifa, now=agora)
+        self.assertEqual(plano.regras, ())
+        self.assertEqual(
+            plano.valido_ate,
+            min(agora + timedelta(minutes=5), agora + timedelta(seconds=pricing.PRECOS_TTL)),
+        )
+
+        depois = agora + timedelta(minutes=6)
+        self.assertEqual(len(pricing.plano_de_regras(self.rifa, now=depois).regras), 1)
+
+
+# ======================================================================
+# COTAÇÃO DE PACOTES (/api/rifas/<slug>/cotacao/)
+# ======================================================================
+class CotacaoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        pricing.invalidar_precos()
+        self.rifa = _rifa(100)
+        self.url = f"/api/rifas/{self.rifa.slug}/cotacao/"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.regra = DiscountRule.objects.create(nome="Pacote", valor=Decimal("10.00"), qtd_numeros_min=5)
+            Coupon.objects.create(codigo="UM", tipo=Coupon.VALOR, valor=Decimal("1.00"), qtd_min_numeros=10)
+
+    def _cotar(self, qtds, **params):
+        resp = self.client.get(self.url, {"qtds": qtds, **params})
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp
+
+    def test_escada_de_precos(self):
+        dados = self._cotar("10,1,5,5", cupom="um").json()
+        self.assertEqual(dados["cupom"], "UM")
+        self.assertEqual(
+            [(c["qtd"], c["total"], c["regras"], c["cupom"]) for c in dados["cotacoes"]],
+            [(1, "2.00", [], None), (5, "9.00", ["Pacote"], None), (10, "17.00", ["Pacote"], "UM")],
+        )
+        # o mesmo preço que o pedido teria, sem gravar nada
+        ana = _cliente("11111111111")
+        self.assertEqual(str(pricing.precificar(self.rifa, 10, ana, "UM")[3]), "17.00")
+        self.assertFalse(Pedido.objects.exists())
+
+    def test_quantidades_invalidas(self):
+        for qtds in ("x", "0,5", "101", ",".join(str(q) for q in range(1, 30))):
+            self.assertEqual(self.client.get(self.url, {"qtds": qtds}).status_code, 400, qtds)
+
+    def test_etag_muda_com_as_regras(self):
+        etag = self._cotar("1,5")["ETag"]
+        self.assertEqual(self.client.get(self.url, {"qtds": "1,5"}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.regra.valor = Decimal("20.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.regra.save()
+        resp = self.client.get(self.url, {"qtds": "1,5"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["cotacoes"][1]["total"], "8.00")
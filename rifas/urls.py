@@ -4,6 +4,7 @@ from django.views.decorators.csrf import csrf_exempt
 
 from . import painel
 from . import views_site as site
+from . import stream
 
 # webhook “fixo” do app (o mais estável)
 from .webhooks import webhook_provider as main_webhook_provider
@@ -14,8 +15,8 @@ from .webhooks import webhook_provider as main_webhook_provider
 # -------------------------------------------------
 API_OK = True
 api = None
-RifasListView = RifaDetailView = GradeView = TopCompradoresView = None
-CriarPedidoView = PedidoStatusView = ReservarNumeroView = None
+RifasListView = RifaDetailView = GradeView = TopCompradoresView = CotacaoView = None
+CriarPedidoView = PedidoStatusView = ReservarNumeroView = HoldView = None
 
 try:
     from . import api_public as api
@@ -24,9 +25,11 @@ try:
         RifaDetailView,
         GradeView,
         TopCompradoresView,
+        CotacaoView,
         CriarPedidoView,
         PedidoStatusView,
         ReservarNumeroView,
+        HoldView,
         webhook_provider as api_webhook_provider,  # pode existir lá também
         PedidoPublicDetailView,
     )
@@ -125,6 +128,7 @@ urlpatterns = [
     path("pedido/<str:protocolo>/json/", site.pedido_status_json, name="pedido_status_json"),
 
     path("api/rifas/<slug:slug>/grade/",        site.api_rifa_grade,        name="rifas_api_grade"),
+    path("api/rifas/<slug:slug>/grade/stream/", stream.api_rifa_grade_stream, name="rifas_api_grade_stream"),
     path("api/rifas/<slug:slug>/meus-numeros/", site.api_rifa_meus_numeros, name="rifas_api_meus_numeros"),
 
     path(
@@ -168,7 +172,14 @@ if API_OK:
         path("api/rifas/<slug:slug>/info/",      RifaDetailView.as_view(),     name="api_rifa_detail"),
         path("api/rifas/<slug:slug>/grade-drf/", GradeView.as_view(),          name="api_rifa_grade_drf"),
         path("api/rifas/<slug:slug>/top/",       TopCompradoresView.as_view(), name="api_rifa_top"),
+        path("api/rifas/<slug:slug>/cotacao/",   CotacaoView.as_view(),        name="api_rifa_cotacao"),
         path("api/rifas/<slug:slug>/reservar/",  ReservarNumeroView.as_view(), name="api_rifa_reservar"),
+        path("api/rifas/<slug:slug>/hold/",      csrf_exempt(ReservarNumeroView.as_view()), name="api_rifa_hold"),
+        path(
+            "api/rifas/<slug:slug>/hold/<str:hold_id>/",
+            csrf_exempt(HoldView.as_view()),
+            name="api_rifa_hold_detail",
+        ),
 
         # criar pedido v2 (POST) — EFI
         path(
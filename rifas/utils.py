@@ -1,10 +1,14 @@
 # rifas/utils.py
-import random, string, re
+import hashlib
+import re
 from datetime import timedelta
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 
-def gera_protocolo(n=6):
-    return "".join(random.choices(string.ascii_uppercase + string.digits, k=n))
+def gera_protocolo() -> str:
+    """Protocolo novo de pedido: único entre processos e em ordem de tempo (ver protocolo.py)."""
+    from .protocolo import novo_protocolo
+    return novo_protocolo()
 
 def abreviar_nome(nome: str) -> str:
     partes = [p for p in (nome or "").strip().split() if p]
@@ -29,3 +33,28 @@ def reserva_expirou(reservado_em, minutos: int) -> bool:
     if not reservado_em:
         return False
     return (timezone.now() - reservado_em) > timedelta(minutes=minutos)
+
+def etag_forte(*partes) -> str:
+    """
+    ETag forte a partir de partes baratas (ids, versões, status, datas).
+    Mesmas partes -> mesmo ETag; qualquer mudança -> outro.
+    """
+    bruto = "|".join("" if p is None else str(p) for p in partes)
+    return '"%s"' % hashlib.md5(bruto.encode("utf-8")).hexdigest()[:20]
+
+def nao_modificado(request, etag: str):
+    """
+    304 (com o ETag) se o If-None-Match do request bate com `etag`; senão None.
+    Chame antes das consultas caras da view.
+    """
+    resp = get_conditional_response(request, etag=etag)
+    if resp is not None:
+        resp["ETag"] = etag
+        resp["Cache-Control"] = "no-cache"
+    return resp
+
+def com_etag(resp, etag: str):
+    """Carimba ETag + no-cache (o navegador sempre revalida) na resposta."""
+    resp["ETag"] = etag
+    resp["Cache-Control"] = "no-cache"
+    return resp
@@ -5,7 +5,7 @@ import json
 from decimal import Decimal
 
 from django.db import transaction, models
-from django.shortcuts import get_object_or_404, render
+from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
 from django.http import (
     JsonResponse,
@@ -20,6 +20,22 @@ from .models import (
     Pedido,
     Numero,
 )
+from .grade import (
+    MSG_GRADE_GERANDO,
+    NumerosIndisponiveis,
+    PedidoForaDasRegras,
+    contar_grade,
+    formato_pedido,
+    janela_pedida,
+    reservar_numeros,
+    resposta_delta,
+    resposta_grade,
+    resposta_janela,
+    since_pedido,
+    validar_pedido,
+)
+from . import admissao, holds, idempotencia
+from .tasks import enfileirar_cobranca, expirar_pedidos_vazios, varrer_rifa
 
 # tentar importar Cliente / Pagamento / CotaPremiada (nem todo projeto tem)
 try:
@@ -29,24 +45,11 @@ except Exception:
     Pagamento = None
     CotaPremiada = None
 
-# vamos reutilizar helpers do api_public
-try:
-    from .api_public import (
-        _liberar_expirados as _liberar_expirados_public,
-        _efi_disponivel,
-        _criar_cobranca_efi_e_salvar,
-    )
-except Exception:
-    _liberar_expirados_public = None
-    _efi_disponivel = None
-    _criar_cobranca_efi_e_salvar = None
-
 # helper que você usava em alguns lugares
 try:
     from .utils import gera_protocolo, cpf_normalize
 except Exception:
-    def gera_protocolo() -> str:
-        return timezone.now().strftime("R%Y%m%d%H%M%S%f")[:20]
+    from .protocolo import novo_protocolo as gera_protocolo
 
     def cpf_normalize(cpf: str) -> str:
         return "".join(ch for ch in (cpf or "") if ch.isdigit())
@@ -67,53 +70,6 @@ def _cpf_mask(cpf_digits: str) -> str:
     return f"{d[0:3]}.{d[3:6]}.{d[6:9]}-{d[9:11]}"
 
 
-# ---------------------------------------------------------------------
-# função interna para liberar reservas SÓ dessa rifa
-# ---------------------------------------------------------------------
-def _liberar_reservas_da_rifa(rifa: Rifa) -> int:
-    """
-    Libera reservas vencidas SOMENTE dessa rifa,
-    usando Numero.expirou() que já lê rifa.minutos_expiracao_reserva.
-    Também expira pedidos pendentes da mesma rifa que ficaram sem número.
-    Retorna quantos números foram liberados.
-    """
-    # se estiver disponível o helper do api_public, usa ele
-    if _liberar_expirados_public is not None:
-        _liberar_expirados_public(rifa)
-        return 0
-
-    # caso contrário, faz local
-    reservados = (
-        Numero.objects
-        .select_related("rifa", "pedido")
-        .filter(rifa=rifa, status=Numero.RESERVADO)
-    )
-
-    expirados_ids: list[int] = []
-    for n in reservados:
-        if n.expirou():
-            expirados_ids.append(n.id)
-
-    if not expirados_ids:
-        return 0
-
-    with transaction.atomic():
-        Numero.objects.filter(id__in=expirados_ids).update(
-            status=Numero.LIVRE,
-            cliente=None,
-            reservado_em=None,
-            pedido=None,
-        )
-
-        Pedido.objects.filter(
-            rifa=rifa,
-            status=Pedido.PENDENTE,
-            numeros__isnull=True,
-        ).update(status=Pedido.EXPIRADO)
-
-    return len(expirados_ids)
-
-
 # ---------------------------------------------------------------------
 # páginas públicas simples
 # ---------------------------------------------------------------------
@@ -129,33 +85,34 @@ def home(request: HttpRequest):
 
 def rifa_detail(request: HttpRequest, slug: str):
     rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
-    _liberar_reservas_da_rifa(rifa)
 
-    pagos = Numero.objects.filter(rifa=rifa, status=Numero.PAGO).count()
-    reservados = Numero.objects.filter(rifa=rifa, status=Numero.RESERVADO).count()
-    livres = Numero.objects.filter(rifa=rifa, status=Numero.LIVRE).count()
-    total_numeros = int(rifa.quantidade_numeros or 0)
+    contagem = contar_grade(rifa)
+    pagos = contagem["pagos"]
+    reservados = contagem["reservados"]
+    livres = contagem["livres"]
+    total_numeros = contagem["total"]
 
+    # a grade não vem no HTML: o template pede janelas em
+    # /api/rifas/<slug>/grade/?from=&to= conforme a rolagem
     ctx = {
         "rifa": rifa,
         "pagos": pagos,
         "reservados": reservados,
         "livres": livres,
         "total_numeros": total_numeros,
-        "numeros_lista": list(range(1, total_numeros + 1)),
+        "now": timezone.now(),
     }
-    return render(request, "rifas/site/rifa_detail.html", ctx)
+    return render(request, "rifas/admin/rifa_public.html", ctx)
 
 
 def rifa_public_view(request: HttpRequest, slug: str):
     rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
 
-    _liberar_reservas_da_rifa(rifa)
-
-    pagos = Numero.objects.filter(rifa=rifa, status=Numero.PAGO).count()
-    reservados = Numero.objects.filter(rifa=rifa, status=Numero.RESERVADO).count()
-    livres = Numero.objects.filter(rifa=rifa, status=Numero.LIVRE).count()
-    total_numeros = int(rifa.quantidade_numeros or 0)
+    contagem = contar_grade(rifa)
+    pagos = contagem["pagos"]
+    reservados = contagem["reservados"]
+    livres = contagem["livres"]
+    total_numeros = contagem["total"]
 
     top_compradores = []
     if getattr(rifa, "mostrar_top_compradores", False):
@@ -215,14 +172,7 @@ def checkout(request: HttpRequest, slug: str):
         cliente_data = {}
 
         if raw_cpf and Cliente is not None:
-            only = _cpf_only_digits(raw_cpf)
-            masked = _cpf_mask(only)
-
-            cli = (
-                Cliente.objects
-                .filter(cpf__in=[raw_cpf, only, masked])
-                .first()
-            )
+            cli = Cliente.por_cpf(raw_cpf)
             if cli:
                 found = True
                 cliente_data = {
@@ -252,7 +202,6 @@ def pedido_status(request: HttpRequest, protocolo: str):
         Pedido.objects.select_related("cliente", "rifa"),
         protocolo=protocolo,
     )
-    _liberar_reservas_da_rifa(pedido.rifa)
     return render(request, "rifas/site/pedido_status.html", {"pedido": pedido})
 
 
@@ -280,125 +229,41 @@ def pedido_status_json(request: HttpRequest, protocolo: str):
 @require_GET
 def api_rifa_grade(request: HttpRequest, slug: str):
     """
-    Endpoint que o front chama toda hora.
-    Agora:
-      - limpa reservas vencidas SÓ dessa rifa
-      - expira pedidos pendentes que ficaram sem número
-      - devolve a grade marcando cotas premiadas
+    Endpoint que o front chama toda hora. Só leitura: quem solta reserva
+    vencida é o worker_reservas (e quem vai reservar), não o GET.
+      - devolve a grade marcando cotas premiadas (snapshot em cache, já com gzip)
+      - ?formato=bin|b64 devolve a grade bit-packed (ver rifas/grade.py); sem
+        ?formato=, rifa grande já vem binária (grade.formato_pedido)
+      - ?since=<versao> devolve só os números que mudaram depois dessa versão
+      - ?from=&to=&status= devolve só uma janela da grade (virtual scroll)
     """
     rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
 
-    # 👇 aqui é o ponto que faltava
-    _liberar_reservas_da_rifa(rifa)
+    # só o que mudou desde a versão que o front já tem
+    since = since_pedido(request)
+    if since is not None:
+        return resposta_delta(request, rifa, since)
 
-    # ---------------------------
-    # cotas premiadas dessa rifa
-    # ---------------------------
-    cotas_map = set()
-    if CotaPremiada is not None:
-        cotas_map = set(
-            CotaPremiada.objects
-            .filter(rifa=rifa, ativo=True)
-            .values_list("numero", flat=True)
-        )
-    elif hasattr(rifa, "cotas_premiadas") and rifa.cotas_premiadas:
-        for item in rifa.cotas_premiadas:
-            try:
-                cotas_map.add(int(item.get("numero")))
-            except Exception:
-                pass
-
-    # ---------------------------
-    # monta a grade
-    # ---------------------------
-    numeros = (
-        Numero.objects
-        .filter(rifa=rifa)
-        .values("numero", "status")
-        .order_by("numero")
-    )
-
-    data = []
-    for item in numeros:
-        n = item["numero"]
-        data.append(
-            {
-                "numero": n,
-                "status": item["status"],
-                "cota_premiada": n in cotas_map,
-            }
-        )
+    # só um pedaço da grade (?from=&to=&status=), para o virtual scroll
+    try:
+        janela = janela_pedida(request)
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    if janela is not None:
+        return resposta_janela(request, rifa, janela)
 
-    return JsonResponse({"numeros": data})
+    # grade inteira (json / ?formato=bin / ?formato=b64) a partir do snapshot em cache
+    return resposta_grade(request, rifa, formato_pedido(request, rifa))
 
 
 def _liberar_reservas_da_rifa(rifa: Rifa):
     """
     Libera somente as reservas EXPIRADAS dessa rifa
     e marca como EXPIRADO os pedidos pendentes que ficaram sem número.
-    Isso é exatamente o que você falou: "número libera mas pedido continua pendente".
+    Pula se outra varredura dessa rifa rodou agora há pouco
+    (ver tasks.varrer_rifa).
     """
-    minutos = rifa.minutos_expiracao_reserva or 0
-    if minutos <= 0:
-        # se a rifa nem tem tempo de expiração configurado, sai
-        return
-
-    agora = timezone.now()
-
-    # pega só os reservados dessa rifa
-    reservados = (
-        Numero.objects
-        .select_related("pedido")
-        .filter(rifa=rifa, status=Numero.RESERVADO)
-    )
-
-    expirados_ids = []
-    pedidos_afetados = set()
-
-    for num in reservados:
-        if not num.reservado_em:
-            continue
-
-        if (agora - num.reservado_em).total_seconds() > (minutos * 60):
-            # venceu
-            expirados_ids.append(num.id)
-            if num.pedido_id:
-                pedidos_afetados.add(num.pedido_id)
-
-    if not expirados_ids:
-        # nada venceu
-        return
-
-    with transaction.atomic():
-        # 1) soltar os números
-        Numero.objects.filter(id__in=expirados_ids).update(
-            status=Numero.LIVRE,
-            cliente=None,
-            pedido=None,
-            reservado_em=None,
-        )
-
-        # 2) para cada pedido que perdeu número, se ficou sem NENHUM número -> expira
-        for pid in pedidos_afetados:
-            try:
-                ped = Pedido.objects.get(id=pid)
-            except Pedido.DoesNotExist:
-                continue
-
-            # se ainda tá pendente e não tem mais número, vira expirado
-            if ped.status == Pedido.PENDENTE and ped.numeros.count() == 0:
-                ped.status = Pedido.EXPIRADO
-                ped.save(update_fields=["status"])
-
-        # 3) garantia extra:
-        #    se por algum outro lugar um pedido ficou pendente e sem número, expira também
-        (
-            Pedido.objects
-            .filter(rifa=rifa, status=Pedido.PENDENTE)
-            .annotate(qtd=models.Count("numeros"))
-            .filter(qtd=0)
-            .update(status=Pedido.EXPIRADO)
-        )
+    return varrer_rifa(rifa.id)
 
 
 @require_GET
@@ -411,16 +276,21 @@ def api_rifa_meus_numeros(request: HttpRequest, slug: str):
     cpf_only = _cpf_only_digits(raw_cpf)
     cpf_masked = _cpf_mask(cpf_only)
 
-    _liberar_reservas_da_rifa(rifa)
-
+    # o cliente sai do índice de cpf_digitos; os números, pelo cliente_id
+    # (0 = CPF sem cadastro, nenhum número)
+    cliente_id = (
+        Cliente.objects.filter(cpf_digitos=cpf_only).values_list("id", flat=True).first()
+        if cpf_only else None
+    )
     qs = (
         Numero.objects
         .filter(
             rifa=rifa,
-            cliente__isnull=False,
-            cliente__cpf__in=[raw_cpf, cpf_only, cpf_masked],
+            cliente_id=cliente_id or 0,
             status__in=[Numero.RESERVADO, Numero.PAGO],
         )
+        # reserva vencida (ainda não solta pelo worker) já não é do cliente
+        .exclude(status=Numero.RESERVADO, expira_em__lte=timezone.now())
         .select_related("pedido")
         .order_by("numero")
     )
@@ -446,29 +316,59 @@ def api_rifa_meus_numeros(request: HttpRequest, slug: str):
     )
 
 
-# ---------------------------------------------------------------------
-# helper pra gerar protocolo (fallback)
-# ---------------------------------------------------------------------
-def _gerar_protocolo() -> str:
-    return timezone.now().strftime("R%Y%m%d%H%M%S%f")[:20]
-
-
 # ---------------------------------------------------------------------
 # criação de pedido via JS público
 # ---------------------------------------------------------------------
 @require_POST
-@transaction.atomic
 def api_pedido_create(request: HttpRequest):
     try:
         payload = json.loads(request.body.decode("utf-8"))
     except Exception:
         return HttpResponseBadRequest("JSON inválido")
 
+    # Idempotency-Key: repetição do mesmo POST devolve a 1ª resposta
+    chave = idempotencia.chave_da_requisicao(request, payload.get("slug") or "", payload.get("cpf") or "")
+    digital = idempotencia.impressao_do_pedido(payload)
+    try:
+        guardada = idempotencia.comecar(chave, digital)
+    except idempotencia.ChaveEmUso as exc:
+        return JsonResponse({"error": str(exc)}, status=exc.status)
+    if guardada is not None:
+        resp = JsonResponse(guardada[1], status=guardada[0])
+        resp[idempotencia.HEADER_REPLAY] = "true"
+        return resp
+
+    # sala de espera: acima do limite por segundo nem chega no banco
+    admitido, espera = admissao.admitir(payload.get("slug") or "")
+    if not admitido:
+        idempotencia.largar(chave)
+        resp = JsonResponse({"error": admissao.MSG_ESPERA, "retry_after": espera}, status=429)
+        resp["Retry-After"] = str(espera)
+        return resp
+
+    try:
+        resp = _criar_pedido_site(payload)
+    except Exception:
+        idempotencia.largar(chave)
+        raise
+    idempotencia.guardar(chave, digital, resp.status_code, json.loads(resp.content))
+    return resp
+
+
+def _criar_pedido_site(payload: dict) -> JsonResponse:
     slug = payload.get("slug")
     cpf_raw = (payload.get("cpf") or "").strip()
     nome = (payload.get("nome") or "").strip()
     telefone = (payload.get("telefone") or "").strip()
     numeros_req = payload.get("numeros") or []
+    hold_id = payload.get("hold_id") or None
+
+    hold = None
+    if hold_id and not numeros_req:
+        hold = holds.ler_hold(hold_id)
+        if hold is None:
+            return JsonResponse({"error": "Sua seleção expirou. Escolha os números novamente."}, status=409)
+        numeros_req = hold["numeros"]
 
     if not slug or not cpf_raw or not numeros_req:
         return JsonResponse(
@@ -477,6 +377,25 @@ def api_pedido_create(request: HttpRequest):
         )
 
     rifa = get_object_or_404(Rifa, slug=slug, ativo=True)
+    if not rifa.grade_pronta:
+        return JsonResponse({"error": MSG_GRADE_GERANDO}, status=409)
+    if hold is not None and hold["rifa"] != rifa.id:
+        return JsonResponse({"error": "Essa seleção é de outra rifa. Escolha os números novamente."}, status=409)
+
+    try:
+        numeros_req = sorted({int(n) for n in numeros_req})
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "Número inválido"}, status=400)
+    if any(n < 1 or n > int(rifa.quantidade_numeros) for n in numeros_req):
+        return JsonResponse({"error": "Alguns números não existem"}, status=400)
+    try:
+        validar_pedido(rifa, len(numeros_req), escolhidos=True)
+    except PedidoForaDasRegras as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    ocupados = holds.segurados_por_outros(rifa.id, numeros_req, hold_id)
+    if ocupados:
+        return JsonResponse({"error": f"Número {ocupados[0]} não está disponível"}, status=409)
 
     _liberar_reservas_da_rifa(rifa)
 
@@ -484,20 +403,16 @@ def api_pedido_create(request: HttpRequest):
         return JsonResponse({"error": "Modelo Cliente não disponível"}, status=500)
 
     cpf_only = _cpf_only_digits(cpf_raw)
-    cpf_masked = _cpf_mask(cpf_only)
-    cli = (
-        Cliente.objects
-        .filter(cpf__in=[cpf_raw, cpf_only, cpf_masked])
-        .first()
+    cli, criado = Cliente.objects.get_or_create(
+        cpf_digitos=cpf_only,
+        defaults={
+            "nome": nome or "Cliente",
+            "email": f"{cpf_only}@fake.local",
+            "telefone": telefone,
+            "cpf": cpf_only,
+        },
     )
-    if not cli:
-        cli = Cliente.objects.create(
-            nome=nome or "Cliente",
-            email=f"{cpf_only}@fake.local",
-            telefone=telefone,
-            cpf=cpf_masked,
-        )
-    else:
+    if not criado:
         changed = False
         if nome and not cli.nome:
             cli.nome = nome
@@ -508,88 +423,49 @@ def api_pedido_create(request: HttpRequest):
         if changed:
             cli.save()
 
-    numeros_db = list(
-        Numero.objects
-        .select_for_update()
-        .filter(rifa=rifa, numero__in=numeros_req)
-    )
-
-    if len(numeros_db) != len(set(numeros_req)):
-        return JsonResponse({"error": "Alguns números não existem"}, status=400)
-
-    for n in numeros_db:
-        if n.status != Numero.LIVRE:
-            return JsonResponse({"error": f"Número {n.numero} não está disponível"}, status=400)
-
     preco_unit = rifa.preco_numero or Decimal("0.00")
-    subtotal = preco_unit * Decimal(len(numeros_db))
-
-    pedido = Pedido.objects.create(
-        rifa=rifa,
-        cliente=cli,
-        protocolo=_gerar_protocolo(),
-        subtotal=subtotal,
-        desconto_regras=Decimal("0.00"),
-        desconto_cupom=Decimal("0.00"),
-        total=subtotal,
-        status=Pedido.PENDENTE,
-        pricing_breakdown={
-            "qtd": len(numeros_db),
-            "preco_unit": str(preco_unit),
-        },
-    )
+    subtotal = preco_unit * Decimal(len(numeros_req))
 
-    now = timezone.now()
-    for n in numeros_db:
-        n.status = Numero.RESERVADO
-        n.cliente = cli
-        n.reservado_em = now
-        n.pedido = pedido
-        n.save(update_fields=["status", "cliente", "reservado_em", "pedido"])
-
-    payment_url = None
-    pix_qr = None
-    pix_code = None
-
-    pg = None
-    if Pagamento is not None:
-        pg = Pagamento.objects.create(
-            pedido=pedido,
-            provider="efi",
-            status_provider="pending",
+    # a varredura roda antes e a reserva é o último passo da transação:
+    # os locks dos números e da contagem ficam presos até o commit
+    with transaction.atomic():
+        pedido = Pedido.objects.create(
+            rifa=rifa,
+            cliente=cli,
+            protocolo=gera_protocolo(),
+            subtotal=subtotal,
+            desconto_regras=Decimal("0.00"),
+            desconto_cupom=Decimal("0.00"),
+            total=subtotal,
+            status=Pedido.PENDENTE,
+            pricing_breakdown={
+                "qtd": len(numeros_req),
+                "preco_unit": str(preco_unit),
+            },
         )
 
-    # tenta gerar PIX real na EFI
-    pix_data = None
-    if _efi_disponivel is not None and _efi_disponivel(rifa) and _criar_cobranca_efi_e_salvar is not None:
-        pix_data = _criar_cobranca_efi_e_salvar(pedido, pg, rifa, subtotal)
+        # a cobrança sai depois do commit (tasks.enfileirar_cobranca); o PIX
+        # chega pelo status do pedido
+        if Pagamento is not None:
+            enfileirar_cobranca(pedido)
 
-    if pix_data and pix_data.get("ok"):
-        pix_qr = pix_data.get("qr_code_base64")
-        pix_code = pix_data.get("copia_cola")
-    else:
-        # fallback: se tiver registry
+        # tudo ou nada, num UPDATE só (ver grade.reservar_numeros)
         try:
-            from .payments.registry import current as pay
-            pref = pay.create_preference(pedido)
-            pix_code = getattr(pref, "copia_cola", None)
-            pix_qr = getattr(pref, "qr_code_base64", None)
-            if pg:
-                pg.provider = "registry"
-                pg.copia_cola = pix_code
-                pg.qr_code_base64 = pix_qr
-                pg.status_provider = "pending"
-                pg.save()
-        except Exception:
-            pass
+            retomados = reservar_numeros(rifa, numeros_req, pedido, cli)
+        except NumerosIndisponiveis as exc:
+            transaction.set_rollback(True)
+            return JsonResponse({"error": f"Número {exc.numero} não está disponível"}, status=400)
+        transaction.on_commit(lambda: expirar_pedidos_vazios(retomados))
+        if hold_id:
+            transaction.on_commit(lambda: holds.encerrar(hold_id))
 
     return JsonResponse(
         {
             "ok": True,
             "protocolo": pedido.protocolo,
-            "payment_url": payment_url,
-            "pix_qr": pix_qr,
-            "pix_code": pix_code,
+            "payment_url": None,
+            "pix_qr": None,
+            "pix_code": None,
         }
     )
 
@@ -614,12 +490,62 @@ def checkout_rapido(request: HttpRequest, slug: str) -> HttpResponse:
             "rifa": rifa,
             "erro": "Informe CPF e selecione pelo menos 1 número.",
         })
+    if not rifa.grade_pronta:
+        return render(request, "rifas/site/checkout_rapido.html", {
+            "rifa": rifa,
+            "erro": MSG_GRADE_GERANDO,
+        })
+
+    # idempotency_key (campo do form) ou Idempotency-Key: reenvio do mesmo
+    # formulário cai na página do pedido que já foi criado
+    chave = idempotencia.chave_da_requisicao(request, rifa.slug, cpf)
+    digital = idempotencia.impressao(sorted(nums_list))
+    try:
+        guardada = idempotencia.comecar(chave, digital)
+    except idempotencia.ChaveEmUso as exc:
+        return render(request, "rifas/site/checkout_rapido.html", {"rifa": rifa, "erro": str(exc)})
+    if guardada is not None:
+        return redirect(guardada[1]["location"])
+
+    admitido, espera = admissao.admitir(rifa.slug)
+    if not admitido:
+        idempotencia.largar(chave)
+        resp = render(request, "rifas/site/checkout_rapido.html", {
+            "rifa": rifa,
+            "erro": f"{admissao.MSG_ESPERA} Tente em {espera}s.",
+        }, status=429)
+        resp["Retry-After"] = str(espera)
+        return resp
+
+    try:
+        resp = _checkout_rapido_criar(request, rifa, cpf, nome, telefone, nums_list)
+    except Exception:
+        idempotencia.largar(chave)
+        raise
+    if resp.status_code == 302:
+        idempotencia.guardar(chave, digital, 200, {"location": resp["Location"]})
+    else:
+        idempotencia.largar(chave)
+    return resp
+
+
+def _checkout_rapido_criar(request: HttpRequest, rifa: Rifa, cpf: str, nome: str,
+                           telefone: str, nums_list: list) -> HttpResponse:
+    try:
+        qtd = len({int(n) for n in nums_list})
+    except (TypeError, ValueError):
+        return render(request, "rifas/site/checkout_rapido.html", {"rifa": rifa, "erro": "Número inválido."})
+    try:
+        validar_pedido(rifa, qtd, escolhidos=True)
+    except PedidoForaDasRegras as exc:
+        return render(request, "rifas/site/checkout_rapido.html", {"rifa": rifa, "erro": str(exc)})
 
     cpf_clean = cpf_normalize(cpf)
 
     cliente, _ = Cliente.objects.get_or_create(
-        cpf=cpf_clean,
+        cpf_digitos=cpf_clean,
         defaults={
+            "cpf": cpf_clean,
             "nome": nome or "Cliente",
             "telefone": telefone or "-",
             "email": f"{cpf_clean}@fake.local",
@@ -635,97 +561,32 @@ def checkout_rapido(request: HttpRequest, slug: str) -> HttpResponse:
     if changed:
         cliente.save()
 
+    total = (rifa.preco_numero or Decimal("0.00")) * Decimal(qtd)
+
+    # fora da transação do pedido: a varredura trava os números vencidos e a
+    # contagem, que só podem ficar presos com a reserva, o último passo
+    varrer_rifa(rifa.id)
+
     with transaction.atomic():
         pedido = Pedido.objects.create(
             rifa=rifa,
             cliente=cliente,
             protocolo=gera_protocolo(),
             status=Pedido.PENDENTE,
+            subtotal=total,
+            total=total,
         )
 
-        qtd = 0
-        now = timezone.now()
-
-        mins = rifa.minutos_expiracao_reserva or 15
-        limite = now - timezone.timedelta(minutes=mins)
-        Numero.objects.filter(
-            rifa=rifa,
-            status=Numero.RESERVADO,
-            reservado_em__lt=limite,
-        ).update(
-            status=Numero.LIVRE,
-            cliente=None,
-            pedido=None,
-            reservado_em=None,
-        )
-
-        for n in nums_list:
-            n_int = int(n)
-            num_obj, _ = Numero.objects.select_for_update().get_or_create(
-                rifa=rifa,
-                numero=n_int,
-                defaults={
-                    "status": Numero.RESERVADO,
-                    "cliente": cliente,
-                    "pedido": pedido,
-                    "reservado_em": now,
-                },
-            )
-            if num_obj.status in (Numero.PAGO, Numero.RESERVADO) and num_obj.pedido_id != pedido.id:
-                transaction.set_rollback(True)
-                return render(request, "rifas/site/checkout_rapido.html", {
-                    "rifa": rifa,
-                    "erro": f"Número {n_int} não está disponível.",
-                })
-
-            num_obj.status = Numero.RESERVADO
-            num_obj.cliente = cliente
-            num_obj.pedido = pedido
-            num_obj.reservado_em = now
-            num_obj.save()
-            qtd += 1
-
-        total = (rifa.preco_numero or Decimal("0.00")) * Decimal(qtd)
-        pedido.total = total
-        pedido.subtotal = total
-        pedido.save()
-
-        pagamento = None
         if Pagamento is not None:
-            pagamento = Pagamento.objects.create(
-                pedido=pedido,
-                provider="efi",
-                status_provider="pending",
-            )
+            enfileirar_cobranca(pedido)
 
-        pix_data = None
-        if _efi_disponivel is not None and _efi_disponivel(rifa) and _criar_cobranca_efi_e_salvar is not None:
-            pix_data = _criar_cobranca_efi_e_salvar(
-                pedido,
-                pagamento,
-                rifa,
-                total,
-            )
-
-        if not pix_data:
-            return render(request, "rifas/site/checkout_rapido.html", {
-                "rifa": rifa,
-                "erro": "Não foi possível gerar o PIX. Tente novamente.",
-            })
-
-        if pagamento is not None:
-            pagamento.copia_cola = pix_data.get("copia_cola")
-            pagamento.qr_code_base64 = pix_data.get("qr_code_base64")
-            pagamento.provider_preference_id = pix_data.get("txid")
-            pagamento.save()
-
-    numeros_pedido = list(pedido.numeros.order_by("numero").values_list("numero", flat=True))
-
-    return render(request, "rifas/site/pagamento_pix.html", {
-        "rifa": rifa,
-        "pedido": pedido,
-        "cliente": cliente,
-        "numeros": numeros_pedido,
-        "copia_cola": pix_data.get("copia_cola"),
-        "qr_code_base64": pix_data.get("qr_code_base64"),
-    })
+        # tudo ou nada, num UPDATE só (ver grade.reservar_numeros)
+        try:
+            retomados = reservar_numeros(rifa, nums_list, pedido, cliente)
+        except NumerosIndisponiveis as exc:
+            transaction.set_rollback(True)
+            return render(request, "rifas/site/checkout_rapido.html", {"rifa": rifa, "erro": str(exc)})
+        transaction.on_commit(lambda: expirar_pedidos_vazios(retomados))
+
+    # a página do pedido acompanha a cobrança e mostra o PIX quando sair
+    return redirect("pedido_status", protocolo=pedido.protocolo)
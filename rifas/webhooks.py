@@ -12,6 +12,8 @@ except Exception:
     WebhookEvent = None
     Pedido = None
 
+from .grade import atualizar_numeros
+
 
 @csrf_exempt
 def webhook_provider(request, provider_key: str):
@@ -66,7 +68,7 @@ def webhook_provider(request, provider_key: str):
                     p.save(update_fields=["status", "pago_em"])
                     # se tiver relação de números
                     if hasattr(p, "numeros"):
-                        p.numeros.update(status="pago")
+                        atualizar_numeros(p.rifa_id, p.numeros.all(), status="pago")
             except Pedido.DoesNotExist:
                 pass
             except Exception: